@@ -0,0 +1,99 @@
+# Benchmark for floating-point reduction loops,
+# with and without fast-math semantics.
+# Run from the `aki` directory: python benchmarks/fastmath.py
+
+import ctypes
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from core.repl import Repl
+from core.compiler import AkiCompiler
+
+KERNELS = r"""
+uni {
+    data:array f64[65536]
+}
+
+def fill():f64 {
+    var x = 0.0
+    loop (var i=0, i<65536) {
+        data[i] = x
+        x += 0.25
+    }
+    x
+}
+
+@noinline
+def dot():f64 {
+    var s = 0.0
+    loop (var i=0, i<65536) {
+        s += data[i] * data[i]
+    }
+    s
+}
+
+@noinline
+def total():f64 {
+    var s = 0.0
+    loop (var i=0, i<65536) {
+        s += data[i]
+    }
+    s
+}
+
+def run_dot():f64 {
+    var s = 0.0
+    loop (var r=0, r<REPS) {
+        # Touch the data so each call has to be recomputed
+        data[r] += 1.0
+        s += dot()
+    }
+    s
+}
+
+def run_total():f64 {
+    var s = 0.0
+    loop (var r=0, r<REPS) {
+        # Touch the data so each call has to be recomputed
+        data[r] += 1.0
+        s += total()
+    }
+    s
+}
+"""
+
+REPS = 500
+
+
+def run(opt_level, fastmath):
+    repl = Repl()
+    repl.settings["opt_level"] = opt_level
+    repl.settings["fastmath"] = fastmath
+    repl.compiler = AkiCompiler(opt_level)
+    repl.load_stdlib()
+    repl.main_module = repl.make_module(None)
+    source = f"const {{REPS={REPS}}}\n{KERNELS}"
+    for _ in repl.interactive(source):
+        pass
+    list(repl.interactive("fill()"))
+
+    results = {}
+    for kernel in ("run_dot", "run_total"):
+        func = ctypes.CFUNCTYPE(ctypes.c_double)(repl.compiler.get_addr(kernel))
+        begin = time.perf_counter()
+        value = func()
+        results[kernel] = (time.perf_counter() - begin, value)
+    return results
+
+
+if __name__ == "__main__":
+    for opt_level in (0, 3):
+        for fastmath in (False, True):
+            results = run(opt_level, fastmath)
+            line = ", ".join(
+                f"{kernel}: {t*1000:8.2f} ms" for kernel, (t, _) in results.items()
+            )
+            print(f"-O{opt_level} fastmath={str(fastmath):5} {line}")
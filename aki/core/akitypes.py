@@ -1,15 +1,35 @@
 from llvmlite.ir import types
 from llvmlite import ir, binding
 import ctypes
-from core.astree import Constant, IfExpr, BinOp, VarTypeName, LLVMNode, String, Name
-from typing import Optional
-from core.error import AkiTypeErr, AkiSyntaxErr
+from core.astree import (
+    Constant,
+    IfExpr,
+    BinOp,
+    VarTypeName,
+    LLVMNode,
+    String,
+    Name,
+    AnyDimension,
+)
+from typing import Optional, NamedTuple
+from core.error import AkiTypeErr, AkiSyntaxErr, AkiNameErr
 
 
 def _int(value: int):
     return ir.Constant(ir.IntType(32), value)
 
 
+class AkiLayout(NamedTuple):
+    """
+    ABI layout of an LLVM type: its size and alignment in bytes,
+    and for structures, the byte offset of each field.
+    """
+
+    size: int
+    align: int
+    offsets: tuple = ()
+
+
 class AkiType:
     """
     Base type for all Aki types.
@@ -20,8 +40,8 @@ class AkiType:
     type_id: Optional[str] = None
     enum_id: Optional[int] = None
     comp_ins: Optional[str] = None
-    original_function: Optional[ir.Function] = None
     literal_ptr: bool = False
+    align: Optional[int] = None
     bits: int = 0
 
     comp_ops = {
@@ -53,7 +73,11 @@ class AkiType:
         return f":{self.type_id}"
 
     def __eq__(self, other):
-        return self.type_id == other.type_id
+        # Structural types are interned, so identical types
+        # are almost always the same object. Comparing by ID
+        # is only needed for aliases, like `int` and `i32`,
+        # and for types from another type manager.
+        return self is other or self.type_id == other.type_id
 
     def c(self):
         """
@@ -72,7 +96,7 @@ class AkiType:
         return node
 
     def c_size(self, codegen, node, llvm_obj):
-        size = llvm_obj.type.get_abi_size(codegen.typemgr.target_data())
+        size = codegen.typemgr.layout(llvm_obj.type).size
         return codegen._codegen(Constant(node, size, codegen.types["u_size"]))
 
 
@@ -161,7 +185,8 @@ class AkiObject(AkiType):
             module.types["u_size"].llvm_type,
             # Was this object allocated from the heap?
             module.types["bool"].llvm_type,
-            # refcount for object, not used yet
+            # Number of variables holding a reference to the object,
+            # for objects allocated from the heap
             module.types["u_size"].llvm_type,
         ]
         # TODO: Have a dummy pointer at end that we use to calculate total size?
@@ -387,23 +412,25 @@ class AkiBaseFloat(AkiType):
 
     bin_ops = {"+": "add", "-": "sub", "*": "mul", "/": "div"}
 
+    # Each op carries the fast-math flags currently in effect, if any.
+
     def binop_add(self, codegen, node, lhs, rhs, op_name):
-        return codegen.builder.fadd(lhs, rhs, f".f{op_name}")
+        return codegen.builder.fadd(lhs, rhs, f".f{op_name}", codegen._fastmath_flags())
 
     def binop_sub(self, codegen, node, lhs, rhs, op_name):
-        return codegen.builder.fsub(lhs, rhs, f".f{op_name}")
+        return codegen.builder.fsub(lhs, rhs, f".f{op_name}", codegen._fastmath_flags())
 
     def binop_mul(self, codegen, node, lhs, rhs, op_name):
-        return codegen.builder.fmul(lhs, rhs, f".f{op_name}")
+        return codegen.builder.fmul(lhs, rhs, f".f{op_name}", codegen._fastmath_flags())
 
     def binop_div(self, codegen, node, lhs, rhs, op_name):
-        return codegen.builder.fdiv(lhs, rhs, f".f{op_name}")
+        return codegen.builder.fdiv(lhs, rhs, f".f{op_name}", codegen._fastmath_flags())
 
     def unop_neg(self, codegen, node, operand):
         lhs = codegen._codegen(
             Constant(node, 0.0, VarTypeName(node, operand.akitype.type_id))
         )
-        return codegen.builder.fsub(lhs, operand, "fnegop")
+        return codegen.builder.fsub(lhs, operand, "fnegop", codegen._fastmath_flags())
 
     signed = True
     comp_ins = "fcmp_ordered"
@@ -454,55 +481,95 @@ class AkiArray(AkiObject, AkiType):
         self.module = module
 
     def new(self, codegen, node, base_type: AkiType, accessors: list):
-        new = AkiArray(codegen.module)
+        dimensions = [self._dimension(codegen, _) for _ in accessors]
+
+        # If any dimension isn't a constant, the array is allocated
+        # at runtime, so its type only depends on how many dimensions it has
+
+        if None in dimensions:
+            return codegen.typemgr.intern(
+                ("heap array", base_type.type_id, len(dimensions)),
+                self._heap_array,
+                base_type,
+                len(dimensions),
+            )
+
+        # Booleans are packed eight to a byte
+
+        if isinstance(base_type, AkiBool):
+            for _, accessor_dimension in zip(accessors, dimensions):
+                if accessor_dimension <= 0:
+                    raise AkiSyntaxErr(
+                        _, codegen.text, f"Array dimensions must be greater than zero"
+                    )
+            return AkiBitArray.new(codegen, node, base_type, dimensions)
 
         array_type = base_type.llvm_type
         array_type.akitype = base_type
         array_type.akinode = node
 
-        array_aki_type = base_type
         subaccessors = []
 
-        for _ in reversed(accessors):
-            accessor_dimension = None
-            if isinstance(_, Constant):
-                accessor_dimension = _.val
-            elif isinstance(_, Name):
-
-                # try:
-                #     t_val = codegen.eval_to_result(node,[_])
-                # except Exception as e:
-                #     print("err", e)
+        for _, accessor_dimension in zip(reversed(accessors), reversed(dimensions)):
 
-                name_val = codegen._name(node, _.name)
-                try:
-                    accessor_dimension = name_val.initializer.constant
-                except Exception:
-                    pass
-
-            if not accessor_dimension:
+            if accessor_dimension <= 0:
                 raise AkiSyntaxErr(
-                    _,
-                    codegen.text,
-                    f"Only constants (not computed values) allowed for array dimensions",
+                    _, codegen.text, f"Array dimensions must be greater than zero"
                 )
 
-            array_type = ir.ArrayType(array_type, accessor_dimension)
             subaccessors.append(accessor_dimension)
 
-            subakitype = AkiArray(codegen.module)
-            subakitype.llvm_type = array_type
-            subakitype.type_id = (
-                f"array({base_type})[{','.join([str(_) for _ in subaccessors])}]"
+            new = codegen.typemgr.intern(
+                ("array", base_type.type_id, tuple(subaccessors)),
+                self._subarray,
+                node,
+                base_type,
+                array_type,
+                subaccessors,
             )
+            array_type = new.llvm_type
 
-            array_type.akitype = subakitype
-            array_type.akinode = node
+        return new
+
+    def _dimension(self, codegen, accessor):
+        """
+        Get the value of one of an array's dimensions,
+        or `None` if it's only known at runtime.
+        """
+        if isinstance(accessor, Constant):
+            return accessor.val
+        if isinstance(accessor, Name):
+
+            # try:
+            #     t_val = codegen.eval_to_result(node,[_])
+            # except Exception as e:
+            #     print("err", e)
+
+            name_val = codegen._name(accessor, accessor.name)
+            try:
+                return name_val.initializer.constant
+            except Exception:
+                pass
+        return None
+
+    def _heap_array(self, base_type, dimensions):
+        """
+        Create the type for an array with runtime dimensions.
+        """
+        return AkiHeapArray(self.module, base_type, dimensions)
 
-        new.llvm_type = array_type
+    def _subarray(self, node, base_type, element_type, subaccessors):
+        """
+        Create the array type for one level of an array's dimensions.
+        """
+        new = AkiArray(self.module)
+        new.base_type = base_type
+        new.dimensions = len(subaccessors)
+        new.llvm_type = ir.ArrayType(element_type, subaccessors[-1])
         new.type_id = f"array({base_type})[{','.join([str(_) for _ in subaccessors])}]"
 
-        codegen.typemgr.add_type(new.type_id, new, codegen.module)
+        new.llvm_type.akitype = new
+        new.llvm_type.akinode = node
         return new
 
     def default(self, codegen, node):
@@ -531,77 +598,298 @@ class AkiArray(AkiObject, AkiType):
         return obj_ptr
 
 
-class AkiString(AkiObject, AkiType):
+class AkiBitArray(AkiArray):
     """
-    Type for Aki string constants.
-   
+    Aki array type for arrays of booleans,
+    which store each element as a single bit.
+    The bits are packed into words, and each row of the last dimension
+    starts on a new word, so rows can be operated on a word at a time:
+    [
+        [row of words],
+        [row of words],
+        ...
+    ]
     """
 
-    signed = False
-    type_id = "str"
+    WORD_BITS = 64
+
+    @classmethod
+    def new(cls, codegen, node, base_type, dimensions):
+        return codegen.typemgr.intern(
+            ("bit array", tuple(dimensions)),
+            cls._bit_array,
+            codegen.typemgr.module,
+            node,
+            base_type,
+            tuple(dimensions),
+        )
 
-    bin_ops = {"+": "add"}
+    @classmethod
+    def _bit_array(cls, module, node, base_type, dimensions):
+        """
+        Create the array type for one level of a boolean array's dimensions.
+        """
+        new = cls(module)
+        new.base_type = base_type
+        new.shape = dimensions
+        new.dimensions = len(dimensions)
+
+        words = -(-dimensions[-1] // cls.WORD_BITS)
+        llvm_type = ir.ArrayType(ir.IntType(cls.WORD_BITS), words)
+        for _ in reversed(dimensions[:-1]):
+            llvm_type = ir.ArrayType(llvm_type, _)
+
+        new.llvm_type = llvm_type
+        new.type_id = f"array({base_type})[{','.join([str(_) for _ in dimensions])}]"
+        new.llvm_type.akitype = new
+        new.llvm_type.akinode = node
+        return new
 
-    def __init__(self, module):
-        self.module = module
-        self.llvm_type_base = module.context.get_identified_type(".str")
-        self.llvm_type_base.elements = [
-            # Header block
-            module.types["obj"].llvm_type,
-            # Pointer to data
-            module.typemgr.as_ptr(module.types["u_mem"]).llvm_type,
-        ]
+    def op_index(self, codegen, node, expr):
+        """
+        Index into the array. Indexing only some of the dimensions
+        gives a pointer to that part of the array, as a smaller array.
+        Indexing all of them gives a pointer to the word with the element,
+        with the element's position in the word as its `bit`.
+        """
+        builder = codegen.builder
+        accessors = node.accessors.accessors
+        indices = [_int(0)] + [codegen._codegen(_) for _ in accessors]
+
+        if len(accessors) < self.dimensions:
+            result = builder.gep(expr, indices)
+            result.akitype = AkiBitArray.new(
+                codegen, node, self.base_type, self.shape[len(accessors) :]
+            )
+            result.akinode = node
+            return result
+
+        word_type = ir.IntType(self.WORD_BITS)
+        index = indices[-1]
+        if index.type.width < word_type.width:
+            index = builder.zext(index, word_type)
+        indices[-1] = builder.lshr(
+            index, ir.Constant(word_type, self.WORD_BITS.bit_length() - 1)
+        )
+
+        result = builder.gep(expr, indices)
+        result.bit = builder.and_(index, ir.Constant(word_type, self.WORD_BITS - 1))
+        result.bit_array = self
+        result.akitype = self.base_type
+        result.akinode = node
+        return result
+
+    def load_element(self, codegen, ptr):
+        """
+        Load the element at a pointer from `op_index`.
+        """
+        builder = codegen.builder
+        word = builder.load(ptr)
+        return builder.trunc(builder.lshr(word, ptr.bit), self.base_type.llvm_type)
+
+    def store_element(self, codegen, ptr, value):
+        """
+        Store an element at a pointer from `op_index`.
+        In threads, the word is updated atomically,
+        since other threads may be writing other bits in it.
+        """
+        builder = codegen.builder
+        word_type = ir.IntType(self.WORD_BITS)
+        mask = builder.shl(ir.Constant(word_type, 1), ptr.bit)
+        bit = builder.shl(builder.zext(value, word_type), ptr.bit)
+        if codegen.fn.threaded:
+            builder.atomic_rmw("and", ptr, builder.not_(mask), "monotonic")
+            builder.atomic_rmw("or", ptr, bit, "monotonic")
+        else:
+            word = builder.and_(builder.load(ptr), builder.not_(mask))
+            builder.store(builder.or_(word, bit), ptr)
+
+    def words(self, codegen, ptr):
+        """
+        Get a pointer to the first word of an array, and the number of words.
+        """
+        word_type = ir.IntType(self.WORD_BITS)
+        size = codegen.typemgr.layout(self.llvm_type).size
+        return (
+            codegen.builder.bitcast(ptr, word_type.as_pointer()),
+            ir.Constant(
+                codegen.types["u_size"].llvm_type, size // (self.WORD_BITS // 8)
+            ),
+        )
 
-        # TODO: we may later use a zero length array as the type,
-        # so that we can encode the data directly into the block
-        # instead of following a pointer
 
+class AkiHeapArray(AkiType):
+    """
+    Aki array type, for arrays whose dimensions are computed at runtime.
+    The array is allocated from the heap as a single block:
+    [
+        [object header],
+        [size of each dimension],
+        [stride of each dimension but the last, in elements],
+        [elements]
+    ]
+    Variables of this type hold a pointer to the block.
+    """
+
+    signed = None
+    name = None
+
+    HEADER = 0
+    DIMENSIONS = 1
+    STRIDES = 2
+    DATA = 3
+
+    def __init__(self, module, base_type: AkiType, dimensions: int):
+        self.module = module
+        self.base_type = base_type
+        self.dimensions = dimensions
+
+        size_type = module.types["u_size"].llvm_type
+        self.llvm_type_base = ir.LiteralStructType(
+            [
+                module.types["obj"].llvm_type,
+                ir.ArrayType(size_type, dimensions),
+                ir.ArrayType(size_type, dimensions - 1),
+                ir.ArrayType(base_type.llvm_type, 0),
+            ]
+        )
         self.llvm_type = ir.PointerType(self.llvm_type_base)
+        self.type_id = f"array({base_type})[{','.join(['*'] * dimensions)}]"
 
     def c(self):
         return ctypes.c_void_p
 
     def default(self, codegen, node):
-        null_str = codegen._codegen(String(node, "", None)).get_reference()
-        return null_str
-
-    def binop_add(self, codegen, node, lhs, rhs, op_name):
-        pass
-        # extract lengths of each string
-        #   c_size
-        # compute new string length
-        # (check for overflow?)
-        # (later when we have result types)
-        # allocate new header
-        #   malloc
-        # set details
-        #
-        # allocate new string body
-        #   malloc
-        # store string data
-        #   =
+        # A null pointer, until the array is allocated
+        return None
 
     def format_result(self, result):
-        char_p = ctypes.POINTER(ctypes.c_char_p)
-        result1 = ctypes.cast(result, char_p)
-        result2 = f'"{str(ctypes.string_at(result1),"utf8")}"'
-        return result2
+        if result is None:
+            result = 0
+        return f"<{self.type_id} @ {hex(result)}>"
 
-    def data(self, text):
-        data = bytearray((text + "\x00").encode("utf8"))
-        data_array = ir.ArrayType(self.module.types["byte"].llvm_type, len(data))
-        return data, data_array
+    def allocate(self, codegen, node, accessors: list):
+        """
+        Allocate an array with the dimensions computed from `accessors`.
+        The strides for indexing are computed once, here.
+        """
+        for _ in accessors:
+            if isinstance(_, AnyDimension):
+                raise AkiSyntaxErr(
+                    _, codegen.text, f"New arrays need a size for every dimension"
+                )
+
+        builder = codegen.builder
+        size_type = codegen.types["u_size"].llvm_type
+        dimensions = [codegen._size_arg(node, _) for _ in accessors]
+
+        # The stride of each dimension is the product
+        # of the sizes of the dimensions after it
+
+        strides = []
+        count = dimensions[-1]
+        for _ in reversed(dimensions[:-1]):
+            strides.insert(0, count)
+            count = builder.mul(count, _)
+
+        layout = codegen.typemgr.layout(self.llvm_type_base)
+        element_size = codegen.typemgr.layout(self.base_type.llvm_type).size
+        data_size = builder.mul(count, ir.Constant(size_type, element_size))
+        size = builder.add(data_size, ir.Constant(size_type, layout.offsets[self.DATA]))
+
+        block = builder.bitcast(codegen._heap_alloc(node, size), self.llvm_type)
+
+        header = builder.gep(block, [_int(0), _int(self.HEADER)])
+        for index, value in (
+            (AkiObject.OBJECT_TYPE, ir.Constant(size_type, self.enum_id)),
+            (AkiObject.LENGTH, data_size),
+            (AkiObject.IS_ALLOCATED, ir.Constant(ir.IntType(1), 1)),
+        ):
+            builder.store(value, builder.gep(header, [_int(0), _int(index)]))
+
+        for field, values in ((self.DIMENSIONS, dimensions), (self.STRIDES, strides)):
+            for index, value in enumerate(values):
+                builder.store(
+                    value, builder.gep(block, [_int(0), _int(field), _int(index)])
+                )
+
+        block.akitype = self
+        block.akinode = node
+        return block
+
+    def deallocate(self, codegen, node, block):
+        """
+        Free an array. The header and elements are a single allocation.
+        """
+        if codegen._is_heap_object(self.base_type):
+            builder = codegen.builder
+            length = builder.load(
+                builder.gep(block, [_int(0), _int(self.HEADER), _int(AkiObject.LENGTH)])
+            )
+            element_size = codegen.typemgr.layout(self.base_type.llvm_type).size
+            codegen._each_element(
+                builder.gep(block, [_int(0), _int(self.DATA), _int(0)]),
+                builder.udiv(length, ir.Constant(length.type, element_size)),
+                lambda _, index: codegen._release(node, _, self.base_type),
+            )
+        codegen._heap_free(node, block)
+
+    def dimension(self, codegen, node, block, index: int):
+        """
+        Get the size of one of the array's dimensions.
+        """
+        builder = codegen.builder
+        result = builder.load(
+            builder.gep(block, [_int(0), _int(self.DIMENSIONS), _int(index)])
+        )
+        result.akitype = codegen.types["u_size"]
+        result.akinode = node
+        return result
+
+    def op_index(self, codegen, node, expr):
+        accessors = node.accessors.accessors
+        if len(accessors) != self.dimensions:
+            raise AkiSyntaxErr(
+                node,
+                codegen.text,
+                f"Array has {self.dimensions} dimension(s), but {len(accessors)} index(es) were given",
+            )
+
+        builder = codegen.builder
+        block = builder.load(expr)
+
+        # offset = (index_0 * stride_0) + ... + index_n
+
+        offset = None
+        for dimension, _ in enumerate(accessors):
+            index = codegen._codegen(_)
+            if not isinstance(index.akitype, AkiBaseInt):
+                raise AkiTypeErr(_, codegen.text, f"Array index must be an integer")
+            index = codegen._as_size(index)
+            if dimension < self.dimensions - 1:
+                stride = builder.load(
+                    builder.gep(block, [_int(0), _int(self.STRIDES), _int(dimension)])
+                )
+                index = builder.mul(index, stride)
+            offset = index if offset is None else builder.add(offset, index)
+
+        result = builder.gep(block, [_int(0), _int(self.DATA), offset])
+        result.akitype = self.base_type
+        result.akinode = node
+        return result
 
     def c_data(self, codegen, node):
-        obj_ptr = codegen.builder.gep(node, [_int(0), _int(1)])
-        obj_ptr = codegen.builder.load(obj_ptr)
+        obj_ptr = codegen.builder.gep(node, [_int(0), _int(self.DATA), _int(0)])
+        obj_ptr = codegen.builder.bitcast(
+            obj_ptr, codegen.types["u_mem"].llvm_type.as_pointer(0)
+        )
         obj_ptr.akitype = codegen.typemgr.as_ptr(codegen.types["u_mem"])
         obj_ptr.akinode = node.akinode
         return obj_ptr
 
     def c_size(self, codegen, node, llvm_obj):
         obj_ptr = codegen.builder.gep(
-            llvm_obj, [_int(0), _int(0), _int(AkiObject.LENGTH)]
+            llvm_obj, [_int(0), _int(self.HEADER), _int(AkiObject.LENGTH)]
         )
         obj_ptr = codegen.builder.load(obj_ptr)
         obj_ptr.akitype = codegen.types["u_size"]
@@ -609,99 +897,1567 @@ class AkiString(AkiObject, AkiType):
         return obj_ptr
 
 
-class AkiTypeMgr:
+class AkiVector(AkiType):
+    """
+    Aki SIMD vector type.
+    A fixed number of integer or float lanes,
+    operated on all at once.
+    """
 
-    # These do not rely on any particular architecture,
-    # and so are set once and never changed.
+    signed = None
 
-    base_types = {
-        "bool": AkiBool(),
-        "i1": AkiInt(1),
-        "i8": AkiInt(8),
-        "i16": AkiInt(16),
-        "i32": AkiInt(32),
-        "i64": AkiInt(64),
-        "int": AkiInt(32),
-        "u8": AkiUnsignedInt(8),
-        "u16": AkiUnsignedInt(16),
-        "u32": AkiUnsignedInt(32),
-        "u64": AkiUnsignedInt(64),
-        "uint": AkiUnsignedInt(32),
-        "f32": AkiFloat(),
-        "f64": AkiDouble(),
-        "float": AkiDouble(),
-        "func": AkiFunction,
-    }
+    # Only the lane-wise ops that the base type supports are used.
 
-    def __init__(self, module: Optional[ir.Module] = None, bytesize=8):
-        if module is None:
-            module = ir.Module()
-            module.triple = binding.Target.from_default_triple().triple
+    lane_ops = ("add", "sub", "mul", "div", "mod", "bin_and", "bin_or")
 
-        # Set internal module reference so types can access each other
+    def __init__(self, module):
+        self.module = module
 
-        # TODO: we might want to set these in the module,
-        # back-decorating is an antipattern
+    def new(self, codegen, node, base_type: AkiType, length):
+        if not isinstance(base_type, (AkiBaseInt, AkiBaseFloat)):
+            raise AkiTypeErr(
+                node,
+                codegen.text,
+                f'Vector lanes must be integer or float types, not "{base_type}"',
+            )
 
-        module.typemgr = self
+        if isinstance(length, Name):
+            try:
+                name_val = codegen._name(node, length.name)
+                length = Constant(length, name_val.initializer.constant, None)
+            except Exception:
+                pass
+
+        if not isinstance(length, Constant) or not isinstance(length.val, int):
+            raise AkiSyntaxErr(
+                length,
+                codegen.text,
+                f"Only constants (not computed values) allowed for vector lengths",
+            )
 
-        self.module = module
+        if length.val < 2 or length.val & (length.val - 1):
+            raise AkiSyntaxErr(
+                length, codegen.text, f"Vector length must be a power of two"
+            )
 
-        # Obtain pointer size from LLVM target
-        self._byte_width = ir.PointerType(ir.IntType(bytesize)).get_abi_size(
-            self.target_data()
+        return codegen.typemgr.intern(
+            ("vec", base_type.type_id, length.val), self._vector, base_type, length.val
         )
-        self._pointer_width = self._byte_width * bytesize
 
-        self.reset()
+    def _vector(self, base_type, length):
+        new = AkiVector(self.module)
+        new.base_type = base_type
+        new.length = length
+        new.signed = base_type.signed
+        new.bits = base_type.bits * new.length
+        new.llvm_type = ir.VectorType(base_type.llvm_type, new.length)
+        new.type_id = f"vec({base_type})[{length}]"
+        new.bin_ops = {k: v for k, v in base_type.bin_ops.items() if v in self.lane_ops}
+        return new
 
-        self.const_enum = 0
+    def default(self, codegen, node):
+        # A single value is broadcast to all lanes
+        return self.base_type.default(codegen, node)
 
-    # Do not move this, otherwise we can't serialize the type mgr
-    def target_data(self):
-        return binding.create_target_data(self.module.data_layout)
+    def _lanes(self, codegen, node, lhs, rhs, op_name, op):
+        return getattr(self.base_type, f"binop_{op}")(codegen, node, lhs, rhs, op_name)
 
-    def reset(self):
-        # Initialize the type map from the base type list,
-        # which never changes
+    def binop_add(self, codegen, node, lhs, rhs, op_name):
+        return self._lanes(codegen, node, lhs, rhs, op_name, "add")
 
-        self.custom_types = {}
+    def binop_sub(self, codegen, node, lhs, rhs, op_name):
+        return self._lanes(codegen, node, lhs, rhs, op_name, "sub")
 
-        self.enum_id_ctr = 0
-        self.enum_ids = {}
+    def binop_mul(self, codegen, node, lhs, rhs, op_name):
+        return self._lanes(codegen, node, lhs, rhs, op_name, "mul")
 
-        self.types = dict(self.base_types)
-        self.module.types = self.types
+    def binop_div(self, codegen, node, lhs, rhs, op_name):
+        return self._lanes(codegen, node, lhs, rhs, op_name, "div")
 
-        # Set byte and pointer sizes
-        self.types["byte"] = AkiUnsignedInt(self._byte_width)
-        self.types["u_mem"] = self.types["byte"]
-        self.types["u_size"] = AkiUnsignedInt(self._pointer_width)
+    def binop_mod(self, codegen, node, lhs, rhs, op_name):
+        return self._lanes(codegen, node, lhs, rhs, op_name, "mod")
 
-        # TODO: u_mem and u_size should be registered types
-        # they might not be u8 or u64 on all platforms!
+    def binop_bin_and(self, codegen, node, lhs, rhs, op_name):
+        return self._lanes(codegen, node, lhs, rhs, op_name, "bin_and")
 
-        # Set types that depend on pointer sizes
-        self._ptr = AkiPointer(self.module)
-        self.types["obj"] = AkiObject(self.module)
-        self.types["str"] = AkiString(self.module)
-        self.types["type"] = AkiTypeRef(self.module)
-        self.types["array"] = AkiArray(self.module)
+    def binop_bin_or(self, codegen, node, lhs, rhs, op_name):
+        return self._lanes(codegen, node, lhs, rhs, op_name, "bin_or")
 
-        # Default type is a 32-bit signed integer
-        self._default = self.types["i32"]
+    def unop_neg(self, codegen, node, operand):
+        lhs = codegen._codegen(Constant(node, self.default(codegen, node), self))
+        return self.binop_sub(codegen, node, lhs, operand, "vnegop")
 
-        for _ in self.types.values():
-            setattr(_, "enum_id", self.enum_id_ctr)
-            self.enum_ids[self.enum_id_ctr] = _
-            self.enum_id_ctr += 1
 
-    def as_ptr(self, *a, **ka):
-        new = self._ptr.new(*a, **ka)
-        # TODO: move this into the actual `new` method?
-        self.add_type(new.type_id, new, self.module)
+class AkiSlice(AkiType):
+    """
+    Aki slice type.
+    A view of elements stored elsewhere, in an array or a string:
+    a pointer to the first element, the number of elements,
+    and the stride between them, in elements.
+    Slices can be passed around without copying the elements.
+    """
+
+    signed = None
+
+    DATA = 0
+    LENGTH = 1
+    STRIDE = 2
+
+    def __init__(self, module):
+        self.module = module
+
+    def new(self, codegen, node, base_type: AkiType):
+        return codegen.typemgr.intern(
+            ("slice", base_type.type_id), self._slice, base_type
+        )
+
+    def _slice(self, base_type):
+        size_type = self.module.types["u_size"].llvm_type
+        new = AkiSlice(self.module)
+        new.base_type = base_type
+        new.llvm_type = ir.LiteralStructType(
+            [base_type.llvm_type.as_pointer(), size_type, size_type]
+        )
+        new.type_id = f"slice {base_type.type_id}"
+        return new
+
+    def default(self, codegen, node):
+        # A null pointer with no elements
+        return None
+
+    def op_index(self, codegen, node, expr):
+        accessors = node.accessors.accessors
+        if len(accessors) != 1:
+            raise AkiSyntaxErr(node, codegen.text, f"Slices have only one dimension")
+        index = codegen._codegen(accessors[0])
+        if not isinstance(index.akitype, AkiBaseInt):
+            raise AkiTypeErr(
+                accessors[0], codegen.text, f"Slice index must be an integer"
+            )
+        index = codegen._as_size(index)
+
+        builder = codegen.builder
+        data = builder.load(builder.gep(expr, [_int(0), _int(self.DATA)]))
+        stride = builder.load(builder.gep(expr, [_int(0), _int(self.STRIDE)]))
+        result = builder.gep(data, [builder.mul(index, stride)])
+        result.akitype = self.base_type
+        result.akinode = node
+        return result
+
+
+class AkiList(AkiType):
+    """
+    Aki list type.
+    A growable sequence of elements. The list's header is allocated
+    from the heap, and holds the number of elements, the capacity,
+    and a pointer to the elements:
+    [
+        [object header],
+        [length],
+        [capacity],
+        [pointer to elements]
+    ]
+    The elements are reallocated as the list grows, doubling
+    the capacity each time, but the header stays where it is.
+    Variables of this type hold a pointer to the header.
+    """
+
+    signed = None
+
+    HEADER = 0
+    LENGTH = 1
+    CAPACITY = 2
+    DATA = 3
+
+    # Number of elements allocated for a new list
+    START_CAPACITY = 8
+
+    def __init__(self, module):
+        self.module = module
+
+    def new(self, codegen, node, base_type: AkiType):
+        return codegen.typemgr.intern(
+            ("list", base_type.type_id), self._list, base_type
+        )
+
+    def _list(self, base_type):
+        size_type = self.module.types["u_size"].llvm_type
+        new = AkiList(self.module)
+        new.base_type = base_type
+        new.llvm_type_base = ir.LiteralStructType(
+            [
+                self.module.types["obj"].llvm_type,
+                size_type,
+                size_type,
+                base_type.llvm_type.as_pointer(),
+            ]
+        )
+        new.llvm_type = ir.PointerType(new.llvm_type_base)
+        new.type_id = f"list {base_type.type_id}"
         return new
 
+    def c(self):
+        return ctypes.c_void_p
+
+    def default(self, codegen, node):
+        # A null pointer, until the list is allocated
+        return None
+
+    def format_result(self, result):
+        if result is None:
+            result = 0
+        return f"<{self.type_id} @ {hex(result)}>"
+
+    def allocate(self, codegen, node):
+        """
+        Allocate a new, empty list.
+        """
+        builder = codegen.builder
+        size_type = codegen.types["u_size"].llvm_type
+
+        header_size = codegen.typemgr.layout(self.llvm_type_base).size
+        header = codegen._heap_alloc(node, ir.Constant(size_type, header_size))
+        header = builder.bitcast(header, self.llvm_type)
+
+        data_size = (
+            codegen.typemgr.layout(self.base_type.llvm_type).size * self.START_CAPACITY
+        )
+        data = codegen._heap_alloc(node, ir.Constant(size_type, data_size))
+        data = builder.bitcast(data, self.base_type.llvm_type.as_pointer())
+
+        obj = builder.gep(header, [_int(0), _int(self.HEADER)])
+        for index, value in (
+            (AkiObject.OBJECT_TYPE, ir.Constant(size_type, self.enum_id)),
+            (AkiObject.IS_ALLOCATED, ir.Constant(ir.IntType(1), 1)),
+        ):
+            builder.store(value, builder.gep(obj, [_int(0), _int(index)]))
+
+        for index, value in (
+            (self.CAPACITY, ir.Constant(size_type, self.START_CAPACITY)),
+            (self.DATA, data),
+        ):
+            builder.store(value, builder.gep(header, [_int(0), _int(index)]))
+
+        header.akitype = self
+        header.akinode = node
+        return header
+
+    def deallocate(self, codegen, node, header):
+        """
+        Free a list and its elements.
+        """
+        data = codegen.builder.load(self.field(codegen, header, self.DATA))
+        if codegen._is_heap_object(self.base_type):
+            codegen._each_element(
+                data,
+                codegen.builder.load(self.field(codegen, header, self.LENGTH)),
+                lambda _, index: codegen._release(node, _, self.base_type),
+            )
+        codegen._heap_free(node, data)
+        codegen._heap_free(node, header)
+
+    def field(self, codegen, header, index: int):
+        """
+        Get a pointer to one of the fields in the list's header.
+        """
+        return codegen.builder.gep(header, [_int(0), _int(index)])
+
+    def reserve(self, codegen, node, header, length):
+        """
+        Make sure the list has room for `length` elements,
+        reallocating the elements if it doesn't.
+        """
+        builder = codegen.builder
+        size_type = codegen.types["u_size"].llvm_type
+
+        capacity_ptr = self.field(codegen, header, self.CAPACITY)
+        capacity = builder.load(capacity_ptr)
+
+        with builder.if_then(builder.icmp_unsigned(">", length, capacity), False):
+
+            # Grow geometrically, so pushes take amortized constant time
+
+            doubled = builder.mul(capacity, ir.Constant(size_type, 2))
+            capacity = builder.select(
+                builder.icmp_unsigned(">", length, doubled), length, doubled
+            )
+            element_size = codegen.typemgr.layout(self.base_type.llvm_type).size
+            size = builder.mul(capacity, ir.Constant(size_type, element_size))
+
+            data_ptr = self.field(codegen, header, self.DATA)
+            data = codegen._heap_realloc(node, builder.load(data_ptr), size)
+            builder.store(
+                builder.bitcast(data, self.base_type.llvm_type.as_pointer()), data_ptr
+            )
+            builder.store(capacity, capacity_ptr)
+
+    def op_index(self, codegen, node, expr):
+        accessors = node.accessors.accessors
+        if len(accessors) != 1:
+            raise AkiSyntaxErr(node, codegen.text, f"Lists have only one dimension")
+        index = codegen._codegen(accessors[0])
+        if not isinstance(index.akitype, AkiBaseInt):
+            raise AkiTypeErr(
+                accessors[0], codegen.text, f"List index must be an integer"
+            )
+        index = codegen._as_size(index)
+
+        builder = codegen.builder
+        header = builder.load(expr)
+        data = builder.load(self.field(codegen, header, self.DATA))
+        result = builder.gep(data, [index])
+        result.akitype = self.base_type
+        result.akinode = node
+        return result
+
+
+class AkiMap(AkiType):
+    """
+    Aki map type.
+    A hash table from integer or string keys to values,
+    using open addressing with linear probing. The map's header
+    is allocated from the heap:
+    [
+        [object header],
+        [number of entries],
+        [number of slots used, including deleted entries],
+        [number of slots, always a power of two],
+        [pointer to a control byte for each slot],
+        [pointer to the slots, each a key followed by its value]
+    ]
+    The control bytes are scanned first when probing, so most
+    probes don't touch the slots. The table is rebuilt, twice
+    as large if need be, before it's three-quarters full.
+    Variables of this type hold a pointer to the header.
+    """
+
+    signed = None
+
+    HEADER = 0
+    COUNT = 1
+    USED = 2
+    CAPACITY = 3
+    CONTROL = 4
+    SLOTS = 5
+
+    # Control byte values
+    EMPTY = 0
+    FULL = 1
+    DELETED = 2
+
+    # Number of slots allocated for a new map
+    START_CAPACITY = 16
+
+    def __init__(self, module):
+        self.module = module
+
+    def new(self, codegen, node, key_type: AkiType, value_type: AkiType):
+        if not isinstance(key_type, (AkiBaseInt, AkiString)):
+            raise AkiTypeErr(
+                node,
+                codegen.text,
+                f'Map keys must be integers or strings, not "{key_type}"',
+            )
+        return codegen.typemgr.intern(
+            ("map", key_type.type_id, value_type.type_id),
+            self._map,
+            key_type,
+            value_type,
+        )
+
+    def _map(self, key_type, value_type):
+        size_type = self.module.types["u_size"].llvm_type
+        new = AkiMap(self.module)
+        new.key_type = key_type
+        new.value_type = value_type
+        new.slot_type = ir.LiteralStructType([key_type.llvm_type, value_type.llvm_type])
+        new.llvm_type_base = ir.LiteralStructType(
+            [
+                self.module.types["obj"].llvm_type,
+                size_type,
+                size_type,
+                size_type,
+                self.module.types["u_mem"].llvm_type.as_pointer(),
+                new.slot_type.as_pointer(),
+            ]
+        )
+        new.llvm_type = ir.PointerType(new.llvm_type_base)
+        new.type_id = f"map {key_type.type_id} {value_type.type_id}"
+        return new
+
+    def c(self):
+        return ctypes.c_void_p
+
+    def default(self, codegen, node):
+        # A null pointer, until the map is allocated
+        return None
+
+    def format_result(self, result):
+        if result is None:
+            result = 0
+        return f"<{self.type_id} @ {hex(result)}>"
+
+    def field(self, codegen, header, index: int):
+        """
+        Get a pointer to one of the fields in the map's header.
+        """
+        return codegen.builder.gep(header, [_int(0), _int(index)])
+
+    def _alloc_table(self, codegen, node, capacity):
+        """
+        Allocate the control bytes and slots for a table.
+        New control bytes are zeroed, which marks their slots as empty.
+        """
+        size_type = codegen.types["u_size"].llvm_type
+        slot_size = codegen.typemgr.layout(self.slot_type).size
+        control = codegen._heap_alloc(node, capacity)
+        slots = codegen._heap_alloc(
+            node, codegen.builder.mul(capacity, ir.Constant(size_type, slot_size))
+        )
+        return control, codegen.builder.bitcast(slots, self.slot_type.as_pointer())
+
+    def allocate(self, codegen, node):
+        """
+        Allocate a new, empty map.
+        """
+        builder = codegen.builder
+        size_type = codegen.types["u_size"].llvm_type
+
+        header_size = codegen.typemgr.layout(self.llvm_type_base).size
+        header = codegen._heap_alloc(node, ir.Constant(size_type, header_size))
+        header = builder.bitcast(header, self.llvm_type)
+
+        capacity = ir.Constant(size_type, self.START_CAPACITY)
+        control, slots = self._alloc_table(codegen, node, capacity)
+
+        obj = builder.gep(header, [_int(0), _int(self.HEADER)])
+        for index, value in (
+            (AkiObject.OBJECT_TYPE, ir.Constant(size_type, self.enum_id)),
+            (AkiObject.IS_ALLOCATED, ir.Constant(ir.IntType(1), 1)),
+        ):
+            builder.store(value, builder.gep(obj, [_int(0), _int(index)]))
+
+        for index, value in (
+            (self.CAPACITY, capacity),
+            (self.CONTROL, control),
+            (self.SLOTS, slots),
+        ):
+            builder.store(value, self.field(codegen, header, index))
+
+        header.akitype = self
+        header.akinode = node
+        return header
+
+    def deallocate(self, codegen, node, header):
+        """
+        Free a map and its table.
+        """
+        if self._holds_references(codegen):
+            capacity, _, control, slots = self._table(codegen, header)
+            codegen._each_element(
+                control,
+                capacity,
+                lambda byte, index: self._release_entry(
+                    codegen, node, slots, index, byte
+                ),
+            )
+        for index in (self.CONTROL, self.SLOTS):
+            codegen._heap_free(
+                node, codegen.builder.load(self.field(codegen, header, index))
+            )
+        codegen._heap_free(node, header)
+
+    def _holds_references(self, codegen):
+        """
+        Whether the map's keys or values are heap objects,
+        which the map holds references to.
+        """
+        return codegen._is_heap_object(self.key_type) or codegen._is_heap_object(
+            self.value_type
+        )
+
+    def _release_entry(self, codegen, node, slots, index, byte=None):
+        """
+        Release the key and the value in a slot, whichever are
+        heap objects, if the slot is in use.
+        """
+        builder = codegen.builder
+        if byte is None:
+            for field, akitype in ((0, self.key_type), (1, self.value_type)):
+                if codegen._is_heap_object(akitype):
+                    value = builder.load(builder.gep(slots, [index, _int(field)]))
+                    codegen._release(node, value, akitype)
+            return
+        with builder.if_then(
+            builder.icmp_unsigned("==", byte, self._control(byte, self.FULL))
+        ):
+            self._release_entry(codegen, node, slots, index)
+
+    def op_index(self, codegen, node, expr):
+        accessors = node.accessors.accessors
+        if len(accessors) != 1:
+            raise AkiSyntaxErr(node, codegen.text, f"Maps take only one key")
+        key = self.key(codegen, accessors[0])
+        header = codegen.builder.load(expr)
+        result = codegen.builder.call(
+            self.function(codegen, node, "slot"), [header, key]
+        )
+        result.akitype = self.value_type
+        result.akinode = node
+        return result
+
+    def key(self, codegen, node):
+        """
+        Codegen a key for this map.
+        """
+        key = codegen._codegen(node)
+        if getattr(key, "akitype", None) != self.key_type:
+            raise AkiTypeErr(
+                node,
+                codegen.text,
+                f'Key of type "{getattr(key, "akitype", None)}" can\'t be used with "{self}"',
+            )
+        return key
+
+    # The rest of the map's operations are in runtime functions,
+    # generated once per module for each map type.
+
+    def function(self, codegen, node, name: str):
+        """
+        Get one of the runtime functions for this map type:
+        `find`, `slot`, `delete`, or `rehash`.
+        """
+        size_type = codegen.types["u_size"].llvm_type
+        header_type = self.llvm_type
+        key_type = self.key_type.llvm_type
+        function_type = {
+            # Index of a key's slot, or NOT_FOUND
+            "find": ir.FunctionType(size_type, [header_type, key_type]),
+            # Pointer to a key's value, inserted if it isn't there
+            "slot": ir.FunctionType(
+                self.value_type.llvm_type.as_pointer(), [header_type, key_type]
+            ),
+            # Whether a key was there to remove
+            "delete": ir.FunctionType(ir.IntType(1), [header_type, key_type]),
+            # Rebuild the table with a new capacity
+            "rehash": ir.FunctionType(ir.VoidType(), [header_type, size_type]),
+        }[name]
+
+        return codegen._runtime_function(
+            node,
+            f".map.{name}.{self.type_id}",
+            function_type,
+            lambda func: getattr(self, f"_runtime_{name}")(codegen, node, func),
+        )
+
+    def not_found(self, codegen):
+        return ir.Constant(codegen.types["u_size"].llvm_type, -1)
+
+    def _hash(self, codegen, node, key):
+        """
+        Hash a key. Integers are mixed with the 64-bit finalizer
+        from MurmurHash3; strings use 64-bit FNV-1a.
+        """
+        builder = codegen.builder
+        i64 = ir.IntType(64)
+
+        def const(value):
+            return ir.Constant(i64, value - (1 << 64) if value >= 1 << 63 else value)
+
+        if isinstance(self.key_type, AkiString):
+            data, length = self.key_type.fields(codegen, key)
+
+            start_block = builder.block
+            loop_block = builder.append_basic_block("hash_loop")
+            exit_block = builder.append_basic_block("hash_exit")
+            zero = ir.Constant(length.type, 0)
+            builder.cbranch(
+                builder.icmp_unsigned("==", length, zero), exit_block, loop_block
+            )
+
+            builder.position_at_start(loop_block)
+            index = builder.phi(length.type)
+            value = builder.phi(i64)
+            index.add_incoming(zero, start_block)
+            value.add_incoming(const(0xCBF29CE484222325), start_block)
+            byte = builder.zext(builder.load(builder.gep(data, [index])), i64)
+            next_value = builder.mul(builder.xor(value, byte), const(0x100000001B3))
+            next_index = builder.add(index, ir.Constant(length.type, 1))
+            index.add_incoming(next_index, loop_block)
+            value.add_incoming(next_value, loop_block)
+            builder.cbranch(
+                builder.icmp_unsigned("<", next_index, length), loop_block, exit_block
+            )
+
+            builder.position_at_start(exit_block)
+            result = builder.phi(i64)
+            result.add_incoming(const(0xCBF29CE484222325), start_block)
+            result.add_incoming(next_value, loop_block)
+
+        else:
+            if key.type.width < 64:
+                key = (builder.sext if self.key_type.signed else builder.zext)(key, i64)
+            elif key.type.width > 64:
+                key = builder.trunc(key, i64)
+            result = key
+            for multiplier in (0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, None):
+                result = builder.xor(result, builder.lshr(result, const(33)))
+                if multiplier is not None:
+                    result = builder.mul(result, const(multiplier))
+
+        size_type = codegen.types["u_size"].llvm_type
+        if size_type.width < 64:
+            result = builder.trunc(result, size_type)
+        return result
+
+    def _equal(self, codegen, node, key, other):
+        """
+        Compare two keys. Strings are compared by their contents.
+        """
+        builder = codegen.builder
+        if not isinstance(self.key_type, AkiString):
+            return builder.icmp_unsigned("==", key, other)
+
+        return builder.call(
+            self.key_type.function(codegen, node, "equal"), [key, other]
+        )
+
+    def _probe(self, codegen, node, control, start, mask, stop):
+        """
+        Probe the control bytes from slot `start` until `stop(byte)`
+        is true. Returns the index of that slot and its control byte.
+        """
+        builder = codegen.builder
+        start_block = builder.block
+        probe_block = builder.append_basic_block("probe")
+        found_block = builder.append_basic_block("probe_found")
+        builder.branch(probe_block)
+
+        builder.position_at_start(probe_block)
+        index = builder.phi(start.type)
+        index.add_incoming(start, start_block)
+        byte = builder.load(builder.gep(control, [index]))
+        index.add_incoming(
+            builder.and_(builder.add(index, ir.Constant(start.type, 1)), mask),
+            probe_block,
+        )
+        builder.cbranch(stop(byte), found_block, probe_block)
+
+        builder.position_at_start(found_block)
+        return index, byte
+
+    def _table(self, codegen, header):
+        """
+        Load the capacity, mask, control bytes and slots of a table.
+        """
+        builder = codegen.builder
+        capacity = builder.load(self.field(codegen, header, self.CAPACITY))
+        mask = builder.sub(capacity, ir.Constant(capacity.type, 1))
+        control = builder.load(self.field(codegen, header, self.CONTROL))
+        slots = builder.load(self.field(codegen, header, self.SLOTS))
+        return capacity, mask, control, slots
+
+    def _control(self, byte, value):
+        return ir.Constant(byte.type, value)
+
+    def _runtime_find(self, codegen, node, func):
+        builder = codegen.builder
+        header, key = func.args
+        _, mask, control, slots = self._table(codegen, header)
+        start = builder.and_(self._hash(codegen, node, key), mask)
+
+        # Stop at the key's slot, or at an empty slot if it isn't there
+
+        probe_block = builder.append_basic_block("find_probe")
+        next_block = builder.append_basic_block("find_next")
+        missing_block = builder.append_basic_block("find_missing")
+        start_block = builder.block
+        builder.branch(probe_block)
+
+        builder.position_at_start(probe_block)
+        index = builder.phi(start.type)
+        index.add_incoming(start, start_block)
+        byte = builder.load(builder.gep(control, [index]))
+        with builder.if_then(
+            builder.icmp_unsigned("==", byte, self._control(byte, self.FULL))
+        ):
+            other = builder.load(builder.gep(slots, [index, _int(0)]))
+            with builder.if_then(self._equal(codegen, node, key, other)):
+                builder.ret(index)
+        builder.cbranch(
+            builder.icmp_unsigned("==", byte, self._control(byte, self.EMPTY)),
+            missing_block,
+            next_block,
+        )
+
+        builder.position_at_start(next_block)
+        index.add_incoming(
+            builder.and_(builder.add(index, ir.Constant(index.type, 1)), mask),
+            next_block,
+        )
+        builder.branch(probe_block)
+
+        builder.position_at_start(missing_block)
+        builder.ret(self.not_found(codegen))
+
+    def _runtime_slot(self, codegen, node, func):
+        builder = codegen.builder
+        header, key = func.args
+        size_type = header.type.pointee.elements[self.COUNT]
+
+        def size(value):
+            return ir.Constant(size_type, value)
+
+        count_ptr = self.field(codegen, header, self.COUNT)
+        used_ptr = self.field(codegen, header, self.USED)
+        capacity = builder.load(self.field(codegen, header, self.CAPACITY))
+
+        # Rebuild the table before it's three-quarters full.
+        # It only grows if most of the used slots are live entries;
+        # otherwise rebuilding it just clears out deleted entries.
+
+        used = builder.load(used_ptr)
+        full = builder.icmp_unsigned(
+            ">",
+            builder.mul(builder.add(used, size(1)), size(4)),
+            builder.mul(capacity, size(3)),
+        )
+        with builder.if_then(full, False):
+            count = builder.load(count_ptr)
+            grow = builder.icmp_unsigned(
+                ">", builder.mul(builder.add(count, size(1)), size(2)), capacity
+            )
+            builder.call(
+                self.function(codegen, node, "rehash"),
+                [
+                    header,
+                    builder.select(grow, builder.mul(capacity, size(2)), capacity),
+                ],
+            )
+
+        index = builder.call(self.function(codegen, node, "find"), [header, key])
+        _, mask, control, slots = self._table(codegen, header)
+        with builder.if_then(
+            builder.icmp_unsigned("!=", index, self.not_found(codegen))
+        ):
+            builder.ret(builder.gep(slots, [index, _int(1)]))
+
+        # Insert the key in the first slot that isn't in use
+
+        start = builder.and_(self._hash(codegen, node, key), mask)
+        index, byte = self._probe(
+            codegen,
+            node,
+            control,
+            start,
+            mask,
+            lambda byte: builder.icmp_unsigned(
+                "!=", byte, self._control(byte, self.FULL)
+            ),
+        )
+        builder.store(self._control(byte, self.FULL), builder.gep(control, [index]))
+        was_empty = builder.icmp_unsigned("==", byte, self._control(byte, self.EMPTY))
+        builder.store(
+            builder.add(builder.load(used_ptr), builder.zext(was_empty, size_type)),
+            used_ptr,
+        )
+        builder.store(builder.add(builder.load(count_ptr), size(1)), count_ptr)
+        builder.store(key, builder.gep(slots, [index, _int(0)]))
+        if codegen._is_heap_object(self.key_type):
+            codegen._retain(key)
+        value = builder.gep(slots, [index, _int(1)])
+        builder.store(ir.Constant(self.value_type.llvm_type, None), value)
+        builder.ret(value)
+
+    def _runtime_delete(self, codegen, node, func):
+        builder = codegen.builder
+        header, key = func.args
+        index = builder.call(self.function(codegen, node, "find"), [header, key])
+        with builder.if_then(
+            builder.icmp_unsigned("==", index, self.not_found(codegen))
+        ):
+            builder.ret(ir.Constant(ir.IntType(1), 0))
+
+        # The slot stays in use, so probes for other keys continue past it.
+        # Rebuilding the table drops it, so its key is released now.
+
+        _, _, control, slots = self._table(codegen, header)
+        if self._holds_references(codegen):
+            self._release_entry(codegen, node, slots, index)
+        byte = builder.gep(control, [index])
+        builder.store(ir.Constant(byte.type.pointee, self.DELETED), byte)
+        count_ptr = self.field(codegen, header, self.COUNT)
+        builder.store(
+            builder.sub(builder.load(count_ptr), ir.Constant(index.type, 1)), count_ptr
+        )
+        builder.ret(ir.Constant(ir.IntType(1), 1))
+
+    def _runtime_rehash(self, codegen, node, func):
+        builder = codegen.builder
+        header, new_capacity = func.args
+        capacity, _, control, slots = self._table(codegen, header)
+        new_mask = builder.sub(new_capacity, ir.Constant(new_capacity.type, 1))
+        new_control, new_slots = self._alloc_table(codegen, node, new_capacity)
+
+        # Move each entry to the first empty slot for it in the new table
+
+        zero = ir.Constant(capacity.type, 0)
+        start_block = builder.block
+        loop_block = builder.append_basic_block("rehash_loop")
+        next_block = builder.append_basic_block("rehash_next")
+        exit_block = builder.append_basic_block("rehash_exit")
+        builder.branch(loop_block)
+
+        builder.position_at_start(loop_block)
+        index = builder.phi(capacity.type)
+        index.add_incoming(zero, start_block)
+        byte = builder.load(builder.gep(control, [index]))
+        with builder.if_then(
+            builder.icmp_unsigned("==", byte, self._control(byte, self.FULL))
+        ):
+            slot = builder.load(builder.gep(slots, [index]))
+            key = builder.extract_value(slot, 0)
+            start = builder.and_(self._hash(codegen, node, key), new_mask)
+            new_index, _ = self._probe(
+                codegen,
+                node,
+                new_control,
+                start,
+                new_mask,
+                lambda byte: builder.icmp_unsigned(
+                    "==", byte, self._control(byte, self.EMPTY)
+                ),
+            )
+            builder.store(
+                self._control(byte, self.FULL), builder.gep(new_control, [new_index])
+            )
+            builder.store(slot, builder.gep(new_slots, [new_index]))
+        builder.branch(next_block)
+
+        builder.position_at_start(next_block)
+        next_index = builder.add(index, ir.Constant(index.type, 1))
+        index.add_incoming(next_index, next_block)
+        builder.cbranch(
+            builder.icmp_unsigned("<", next_index, capacity), loop_block, exit_block
+        )
+
+        builder.position_at_start(exit_block)
+        codegen._heap_free(node, control)
+        codegen._heap_free(node, slots)
+        for index, value in (
+            (self.CAPACITY, new_capacity),
+            (self.CONTROL, new_control),
+            (self.SLOTS, new_slots),
+            (self.USED, builder.load(self.field(codegen, header, self.COUNT))),
+        ):
+            builder.store(value, self.field(codegen, header, index))
+        builder.ret_void()
+
+
+class AkiStruct(AkiType):
+    """
+    Aki structure type.
+    A fixed set of named fields, stored as an LLVM identified struct.
+    """
+
+    signed = None
+
+    def __init__(self, module):
+        self.module = module
+
+    def new(self, codegen, node, packed=False, align=None, reorder=False):
+        typemgr = codegen.typemgr
+
+        fields = []
+        for _ in node.fields:
+            if _.name in (name for name, _ in fields):
+                raise AkiSyntaxErr(
+                    _,
+                    codegen.text,
+                    f'Field "{_.name}" is already defined in structure "{node.name}"',
+                )
+            fields.append((_.name, codegen._get_vartype(_.vartype)))
+
+        # Ordering the fields from the most to the least strictly aligned
+        # leaves no padding between them.
+        # Packed structures have no padding to begin with.
+
+        if reorder and not packed:
+            fields.sort(
+                key=lambda _: typemgr.layout(_[1].llvm_type).align, reverse=True
+            )
+
+        new = AkiStruct(codegen.module)
+        new.type_id = node.name
+        new.fields = {name: index for index, (name, _) in enumerate(fields)}
+        new.field_types = [akitype for _, akitype in fields]
+
+        elements = [_.llvm_type for _ in new.field_types]
+
+        # An explicitly aligned structure is padded out to a multiple
+        # of its alignment, so each element of an array of them is aligned.
+
+        if align is not None:
+            size = typemgr.layout(ir.LiteralStructType(elements, packed)).size
+            padding = -size % align
+            if padding:
+                elements.append(ir.ArrayType(types.IntType(8), padding))
+            new.align = align
+
+        # Identified types are shared by every module in the context,
+        # so each structure gets a unique name there.
+
+        context = codegen.module.context
+        new.llvm_type = context.get_identified_type(
+            context.scope.deduplicate(node.name)
+        )
+        new.llvm_type.packed = packed
+        new.llvm_type.set_body(*elements)
+        new.llvm_type.akitype = new
+
+        typemgr.add_type(new.type_id, new, codegen.module)
+
+        if align is not None:
+            layout = typemgr.layout(new.llvm_type)
+            typemgr.layouts[str(new.llvm_type)] = layout._replace(
+                align=max(align, layout.align)
+            )
+
+        return new
+
+    def default(self, codegen, node):
+        # All fields are zeroed
+        return None
+
+    def op_field(self, codegen, node, ptr):
+        """
+        Return a pointer to the field named by a `FieldRef` node,
+        from a pointer to a structure of this type.
+        """
+        index = self.fields.get(node.field, None)
+        if index is None:
+            raise AkiNameErr(
+                node,
+                codegen.text,
+                f'Structure "{self.type_id}" has no field "{node.field}"',
+            )
+        result = codegen.builder.gep(ptr, [_int(0), _int(index)])
+        result.akitype = self.field_types[index]
+        result.akinode = node
+        return result
+
+    def offset(self, codegen, field: str):
+        """
+        Return the byte offset of a field, or None if there is no such field.
+        """
+        index = self.fields.get(field, None)
+        if index is None:
+            return None
+        return codegen.typemgr.layout(self.llvm_type).offsets[index]
+
+
+class AkiString(AkiObject, AkiType):
+    """
+    Type for Aki strings.
+    A string is its header followed directly by its data,
+    which is always terminated with a NUL. The header's length
+    includes the NUL. String constants are stored as globals;
+    strings built at runtime are allocated from the heap.
+    """
+
+    signed = False
+    type_id = "str"
+
+    bin_ops = {"+": "add"}
+
+    def __init__(self, module):
+        self.module = module
+        self.llvm_type_base = module.context.get_identified_type(".str")
+        self.llvm_type_base.elements = [
+            # Header block
+            module.types["obj"].llvm_type,
+            # Data, stored directly after the header,
+            # so a string is a single block with no pointer to follow
+            ir.ArrayType(module.types["u_mem"].llvm_type, 0),
+        ]
+
+        self.llvm_type = ir.PointerType(self.llvm_type_base)
+
+    def c(self):
+        return ctypes.c_void_p
+
+    def default(self, codegen, node):
+        null_str = codegen._codegen(String(node, "", None)).get_reference()
+        return null_str
+
+    def binop_add(self, codegen, node, lhs, rhs, op_name):
+        result = codegen.builder.call(
+            self.function(codegen, node, "concat"), [lhs, rhs]
+        )
+        result.akitype = self
+        return codegen._temporary(node, result)
+
+    def compare(self, codegen, node, lhs, rhs):
+        """
+        Compare two strings by their contents.
+        Ordering is by byte values, with a string ordered
+        before any longer string it's the start of.
+        """
+        builder = codegen.builder
+        if node.op in ("==", "!="):
+            result = builder.call(self.function(codegen, node, "equal"), [lhs, rhs])
+            if node.op == "!=":
+                result = builder.not_(result)
+            return result
+        if node.op not in ("<", "<=", ">", ">="):
+            return None
+        order = builder.call(self.function(codegen, node, "compare"), [lhs, rhs])
+        return builder.icmp_signed(node.op, order, ir.Constant(order.type, 0))
+
+    def format_result(self, result):
+        data = result + self.module.typemgr.layout(self.llvm_type_base).offsets[1]
+        return f'"{str(ctypes.string_at(data),"utf8")}"'
+
+    def data(self, text):
+        data = bytearray((text + "\x00").encode("utf8"))
+        data_array = ir.ArrayType(self.module.types["byte"].llvm_type, len(data))
+        return data, data_array
+
+    def literal_type(self, data_array):
+        """
+        Get the type of a string with a known length,
+        which is the string type with its data array filled in.
+        """
+        return ir.LiteralStructType([self.module.types["obj"].llvm_type, data_array])
+
+    def c_data(self, codegen, node):
+        obj_ptr = codegen.builder.gep(node, [_int(0), _int(1), _int(0)])
+        obj_ptr.akitype = codegen.typemgr.as_ptr(codegen.types["u_mem"])
+        obj_ptr.akinode = node.akinode
+        return obj_ptr
+
+    def c_size(self, codegen, node, llvm_obj):
+        obj_ptr = codegen.builder.gep(
+            llvm_obj, [_int(0), _int(0), _int(AkiObject.LENGTH)]
+        )
+        obj_ptr = codegen.builder.load(obj_ptr)
+        obj_ptr.akitype = codegen.types["u_size"]
+        obj_ptr.akinode = llvm_obj.akinode
+        return obj_ptr
+
+    def fields(self, codegen, value):
+        """
+        Get the data pointer of a string, and its length
+        not counting the terminating NUL.
+        """
+        builder = codegen.builder
+        data = builder.gep(value, [_int(0), _int(1), _int(0)])
+        length = builder.load(
+            builder.gep(value, [_int(0), _int(0), _int(AkiObject.LENGTH)])
+        )
+        return data, builder.sub(length, ir.Constant(length.type, 1))
+
+    def allocate(self, codegen, node, length):
+        """
+        Allocate a string of `length` bytes, plus its NUL,
+        as a single block. The data starts out zeroed.
+        """
+        builder = codegen.builder
+        size_type = codegen.types["u_size"].llvm_type
+        header_size = codegen.typemgr.layout(self.llvm_type_base).offsets[1]
+        size = builder.add(length, ir.Constant(size_type, header_size + 1))
+        header = builder.bitcast(codegen._heap_alloc(node, size), self.llvm_type)
+
+        obj = builder.gep(header, [_int(0), _int(0)])
+        for index, value in (
+            (AkiObject.OBJECT_TYPE, ir.Constant(size_type, self.enum_id)),
+            (AkiObject.LENGTH, builder.add(length, ir.Constant(size_type, 1))),
+            (AkiObject.IS_ALLOCATED, ir.Constant(ir.IntType(1), 1)),
+        ):
+            builder.store(value, builder.gep(obj, [_int(0), _int(index)]))
+
+        header.akitype = self
+        header.akinode = node
+        return header
+
+    def deallocate(self, codegen, node, header):
+        """
+        Free a string. The header and data are a single allocation.
+        """
+        codegen._heap_free(node, header)
+
+    # String operations are runtime functions,
+    # generated once per module.
+
+    def function(self, codegen, node, name: str):
+        """
+        Get one of the runtime functions for strings:
+        `concat`, `equal`, `compare`, `find`, `from_int`, or `from_float`.
+        """
+        str_type = self.llvm_type
+        function_type = {
+            "concat": ir.FunctionType(str_type, [str_type, str_type]),
+            "equal": ir.FunctionType(ir.IntType(1), [str_type, str_type]),
+            # Negative, zero, or positive, as in C's `strcmp`
+            "compare": ir.FunctionType(ir.IntType(32), [str_type, str_type]),
+            # Index of the first match, or -1
+            "find": ir.FunctionType(ir.IntType(32), [str_type, str_type]),
+            # The integer, and whether it's signed
+            "from_int": ir.FunctionType(str_type, [ir.IntType(64), ir.IntType(1)]),
+            "from_float": ir.FunctionType(str_type, [ir.DoubleType()]),
+        }[name]
+
+        return codegen._runtime_function(
+            node,
+            f".str.{name}",
+            function_type,
+            lambda func: getattr(self, f"_runtime_{name}")(codegen, node, func),
+        )
+
+    def _loop(self, codegen, count, body, name):
+        """
+        Generate a loop over `index` from 0 to `count`,
+        which stops early if `body(index)` returns false.
+        Returns the last index reached, which is `count`
+        if the loop wasn't stopped, and the block it was reached from.
+        """
+        builder = codegen.builder
+        zero = ir.Constant(count.type, 0)
+        start_block = builder.block
+        loop_block = builder.append_basic_block(f"{name}_loop")
+        next_block = builder.append_basic_block(f"{name}_next")
+        exit_block = builder.append_basic_block(f"{name}_exit")
+        builder.cbranch(
+            builder.icmp_unsigned("==", count, zero), exit_block, loop_block
+        )
+
+        builder.position_at_start(loop_block)
+        index = builder.phi(count.type)
+        index.add_incoming(zero, start_block)
+        builder.cbranch(body(index), next_block, exit_block)
+        stop_block = builder.block
+
+        builder.position_at_start(next_block)
+        next_index = builder.add(index, ir.Constant(count.type, 1))
+        index.add_incoming(next_index, next_block)
+        builder.cbranch(
+            builder.icmp_unsigned("<", next_index, count), loop_block, exit_block
+        )
+
+        builder.position_at_start(exit_block)
+        result = builder.phi(count.type)
+        result.add_incoming(zero, start_block)
+        result.add_incoming(index, stop_block)
+        result.add_incoming(count, next_block)
+        return result
+
+    def _bytes_equal(self, codegen, data, other_data, length):
+        """
+        Compare `length` bytes at two locations.
+        """
+        builder = codegen.builder
+        index = self._loop(
+            codegen,
+            length,
+            lambda index: builder.icmp_unsigned(
+                "==",
+                builder.load(builder.gep(data, [index])),
+                builder.load(builder.gep(other_data, [index])),
+            ),
+            "equal",
+        )
+        return builder.icmp_unsigned("==", index, length)
+
+    def _runtime_concat(self, codegen, node, func):
+        builder = codegen.builder
+        data, length = self.fields(codegen, func.args[0])
+        other_data, other_length = self.fields(codegen, func.args[1])
+        result = self.allocate(codegen, node, builder.add(length, other_length))
+        result_data, _ = self.fields(codegen, result)
+        codegen._memcpy(result_data, data, length)
+        codegen._memcpy(builder.gep(result_data, [length]), other_data, other_length)
+        builder.ret(result)
+
+    def _runtime_equal(self, codegen, node, func):
+        builder = codegen.builder
+        lhs, rhs = func.args
+        with builder.if_then(builder.icmp_unsigned("==", lhs, rhs)):
+            builder.ret(ir.Constant(ir.IntType(1), 1))
+        data, length = self.fields(codegen, lhs)
+        other_data, other_length = self.fields(codegen, rhs)
+        with builder.if_then(builder.icmp_unsigned("!=", length, other_length)):
+            builder.ret(ir.Constant(ir.IntType(1), 0))
+        builder.ret(self._bytes_equal(codegen, data, other_data, length))
+
+    def _runtime_compare(self, codegen, node, func):
+        builder = codegen.builder
+        data, length = self.fields(codegen, func.args[0])
+        other_data, other_length = self.fields(codegen, func.args[1])
+        shorter = builder.select(
+            builder.icmp_unsigned("<", length, other_length), length, other_length
+        )
+
+        # Find the first byte that differs
+
+        index = self._loop(
+            codegen,
+            shorter,
+            lambda index: builder.icmp_unsigned(
+                "==",
+                builder.load(builder.gep(data, [index])),
+                builder.load(builder.gep(other_data, [index])),
+            ),
+            "compare",
+        )
+        i32 = ir.IntType(32)
+        with builder.if_then(builder.icmp_unsigned("<", index, shorter)):
+            byte = builder.zext(builder.load(builder.gep(data, [index])), i32)
+            other_byte = builder.zext(
+                builder.load(builder.gep(other_data, [index])), i32
+            )
+            builder.ret(builder.sub(byte, other_byte))
+
+        # Otherwise, the shorter string comes first
+
+        builder.ret(
+            builder.sub(
+                builder.zext(builder.icmp_unsigned(">", length, other_length), i32),
+                builder.zext(builder.icmp_unsigned("<", length, other_length), i32),
+            )
+        )
+
+    def _runtime_find(self, codegen, node, func):
+        builder = codegen.builder
+        i32 = ir.IntType(32)
+        data, length = self.fields(codegen, func.args[0])
+        other_data, other_length = self.fields(codegen, func.args[1])
+
+        with builder.if_then(builder.icmp_unsigned(">", other_length, length)):
+            builder.ret(ir.Constant(i32, -1))
+        with builder.if_then(
+            builder.icmp_unsigned("==", other_length, ir.Constant(length.type, 0))
+        ):
+            builder.ret(ir.Constant(i32, 0))
+
+        # Check each position where the first byte matches
+
+        first = builder.load(other_data)
+        positions = builder.add(
+            builder.sub(length, other_length), ir.Constant(length.type, 1)
+        )
+
+        def mismatch(index):
+            start = builder.gep(data, [index])
+            start_block = builder.block
+            check_block = builder.append_basic_block("find_check")
+            done_block = builder.append_basic_block("find_done")
+            builder.cbranch(
+                builder.icmp_unsigned("==", builder.load(start), first),
+                check_block,
+                done_block,
+            )
+            builder.position_at_start(check_block)
+            same = self._bytes_equal(codegen, start, other_data, other_length)
+            check_block = builder.block
+            builder.branch(done_block)
+            builder.position_at_start(done_block)
+            found = builder.phi(ir.IntType(1))
+            found.add_incoming(ir.Constant(ir.IntType(1), 0), start_block)
+            found.add_incoming(same, check_block)
+            return builder.not_(found)
+
+        index = self._loop(codegen, positions, mismatch, "find")
+        builder.ret(
+            builder.select(
+                builder.icmp_unsigned("<", index, positions),
+                builder.trunc(index, i32),
+                ir.Constant(i32, -1),
+            )
+        )
+
+    def _runtime_from_int(self, codegen, node, func):
+        builder = codegen.builder
+        i64 = ir.IntType(64)
+        value, signed = func.args
+
+        # Digits are written backwards from the end of a buffer
+
+        buffer_size = 24
+        buffer = codegen.fn.allocator.alloca(ir.ArrayType(ir.IntType(8), buffer_size))
+        negative = builder.and_(
+            signed, builder.icmp_signed("<", value, ir.Constant(i64, 0))
+        )
+        magnitude = builder.select(
+            negative, builder.sub(ir.Constant(i64, 0), value), value
+        )
+
+        start_block = builder.block
+        digit_block = builder.append_basic_block("digit")
+        sign_block = builder.append_basic_block("sign")
+        builder.branch(digit_block)
+
+        builder.position_at_start(digit_block)
+        remaining = builder.phi(i64)
+        position = builder.phi(i64)
+        remaining.add_incoming(magnitude, start_block)
+        position.add_incoming(ir.Constant(i64, buffer_size), start_block)
+        ten = ir.Constant(i64, 10)
+        next_position = builder.sub(position, ir.Constant(i64, 1))
+        digit = builder.add(
+            builder.trunc(builder.urem(remaining, ten), ir.IntType(8)),
+            ir.Constant(ir.IntType(8), ord("0")),
+        )
+        builder.store(digit, builder.gep(buffer, [_int(0), next_position]))
+        next_remaining = builder.udiv(remaining, ten)
+        remaining.add_incoming(next_remaining, digit_block)
+        position.add_incoming(next_position, digit_block)
+        builder.cbranch(
+            builder.icmp_unsigned("==", next_remaining, ir.Constant(i64, 0)),
+            sign_block,
+            digit_block,
+        )
+
+        builder.position_at_start(sign_block)
+        sign_position = builder.sub(next_position, ir.Constant(i64, 1))
+        builder.store(
+            ir.Constant(ir.IntType(8), ord("-")),
+            builder.gep(buffer, [_int(0), sign_position]),
+        )
+        start = builder.select(negative, sign_position, next_position)
+
+        size_type = codegen.types["u_size"].llvm_type
+        length = builder.sub(ir.Constant(i64, buffer_size), start)
+        if size_type.width != 64:
+            length = builder.trunc(length, size_type)
+        result = self.allocate(codegen, node, length)
+        result_data, _ = self.fields(codegen, result)
+        codegen._memcpy(result_data, builder.gep(buffer, [_int(0), start]), length)
+        builder.ret(result)
+
+    def _runtime_from_float(self, codegen, node, func):
+        builder = codegen.builder
+        size_type = codegen.types["u_size"].llvm_type
+        buffer_size = ir.Constant(size_type, 32)
+        buffer = codegen.fn.allocator.alloca(
+            ir.ArrayType(ir.IntType(8), buffer_size.constant)
+        )
+        buffer = builder.gep(buffer, [_int(0), _int(0)])
+        length = codegen._format(node, buffer, buffer_size, "%g", func.args[0])
+        length = builder.zext(length, size_type)
+        result = self.allocate(codegen, node, length)
+        result_data, _ = self.fields(codegen, result)
+        codegen._memcpy(result_data, buffer, length)
+        builder.ret(result)
+
+
+class AkiTypeMgr:
+
+    # These do not rely on any particular architecture,
+    # and so are set once and never changed.
+
+    base_types = {
+        "bool": AkiBool(),
+        "i1": AkiInt(1),
+        "i8": AkiInt(8),
+        "i16": AkiInt(16),
+        "i32": AkiInt(32),
+        "i64": AkiInt(64),
+        "int": AkiInt(32),
+        "u8": AkiUnsignedInt(8),
+        "u16": AkiUnsignedInt(16),
+        "u32": AkiUnsignedInt(32),
+        "u64": AkiUnsignedInt(64),
+        "uint": AkiUnsignedInt(32),
+        "f32": AkiFloat(),
+        "f64": AkiDouble(),
+        "float": AkiDouble(),
+        "func": AkiFunction,
+    }
+
+    def __init__(self, module: Optional[ir.Module] = None, bytesize=8):
+        if module is None:
+            module = ir.Module()
+            module.triple = binding.Target.from_default_triple().triple
+
+        # Set internal module reference so types can access each other
+
+        # TODO: we might want to set these in the module,
+        # back-decorating is an antipattern
+
+        module.typemgr = self
+
+        self.module = module
+
+        # LLVM target data for the module, created when first needed,
+        # and the layouts computed from it, by LLVM type signature.
+
+        self._target_data = None
+        self.layouts: dict = {}
+
+        # Obtain pointer size from LLVM target
+        self._byte_width = self.layout(ir.PointerType(ir.IntType(bytesize))).size
+        self._pointer_width = self._byte_width * bytesize
+
+        self.reset()
+
+        self.const_enum = 0
+
+    def __getstate__(self):
+        # The target data is an LLVM object, which can't be serialized,
+        # so it's recreated on demand after unpickling.
+        state = dict(self.__dict__)
+        state["_target_data"] = None
+        return state
+
+    def target_data(self):
+        """
+        Return the LLVM target data for the module, created only once.
+        """
+        if self._target_data is None:
+            layout = self.module.data_layout
+            if not layout:
+                # Without an explicit layout we use the host's,
+                # as the JIT does.
+                layout = str(
+                    binding.Target.from_default_triple()
+                    .create_target_machine()
+                    .target_data
+                )
+            self._target_data = binding.create_target_data(layout)
+        return self._target_data
+
+    def layout(self, llvm_type):
+        """
+        Return the layout of an LLVM type, computing it only once.
+        """
+        key = str(llvm_type)
+        layout = self.layouts.get(key, None)
+        if layout is not None:
+            return layout
+
+        target_data = self.target_data()
+        ptr = llvm_type._get_ll_pointer_type(target_data)
+        offsets = ()
+        if isinstance(llvm_type, types.BaseStructType):
+            offsets = tuple(
+                target_data.get_element_offset(ptr.element_type, _)
+                for _ in range(len(llvm_type.elements))
+            )
+        layout = self.layouts[key] = AkiLayout(
+            target_data.get_pointee_abi_size(ptr),
+            target_data.get_pointee_abi_alignment(ptr),
+            offsets,
+        )
+        return layout
+
+    def _add_layout(self, type_ref):
+        """
+        Precompute the layout for a registered type, if it has one.
+        """
+        llvm_type = getattr(type_ref, "llvm_type", None)
+        if not isinstance(llvm_type, ir.Type) or isinstance(
+            llvm_type, (types.FunctionType, types.VoidType)
+        ):
+            return
+        if getattr(llvm_type, "is_opaque", False):
+            return
+        self.layout(llvm_type)
+
+    def reset(self):
+        # Initialize the type map from the base type list,
+        # which never changes
+
+        self.custom_types = {}
+
+        # Structural types (pointers, arrays, functions, vectors),
+        # by a key built from their component types.
+        # Each is created only once, so they can be compared by identity.
+
+        self.interned = {}
+
+        # Functions with versions for different argument types, by name,
+        # and the names of the versions generated for each signature.
+
+        self.generics = {}
+        self.specializations = {}
+
+        self.enum_id_ctr = 0
+        self.enum_ids = {}
+
+        self.types = dict(self.base_types)
+        self.module.types = self.types
+
+        # Set byte and pointer sizes
+        self.types["byte"] = AkiUnsignedInt(self._byte_width)
+        self.types["u_mem"] = self.types["byte"]
+        self.types["u_size"] = AkiUnsignedInt(self._pointer_width)
+
+        # TODO: u_mem and u_size should be registered types
+        # they might not be u8 or u64 on all platforms!
+
+        # Set types that depend on pointer sizes
+        self._ptr = AkiPointer(self.module)
+        self.types["obj"] = AkiObject(self.module)
+        self.types["str"] = AkiString(self.module)
+        self.types["type"] = AkiTypeRef(self.module)
+        self.types["array"] = AkiArray(self.module)
+        self.types["vec"] = AkiVector(self.module)
+        self.types["struct"] = AkiStruct(self.module)
+        self.types["slice"] = AkiSlice(self.module)
+        self.types["list"] = AkiList(self.module)
+        self.types["map"] = AkiMap(self.module)
+
+        # Default type is a 32-bit signed integer
+        self._default = self.types["i32"]
+
+        for _ in self.types.values():
+            setattr(_, "enum_id", self.enum_id_ctr)
+            self.enum_ids[self.enum_id_ctr] = _
+            self.enum_id_ctr += 1
+            self._add_layout(_)
+
+    def intern(self, key: tuple, factory, *a):
+        """
+        Return the one instance of the structural type described by `key`.
+        `factory(*a)` is only called to create it the first time.
+        """
+        type_ref = self.interned.get(key, None)
+        if type_ref is not None:
+            return type_ref
+
+        type_ref = factory(*a)
+
+        # Variants of a type with the same name, like literal pointers,
+        # share the enum ID of the first one registered.
+        existing = self.custom_types.get(type_ref.type_id, None)
+        if existing is None:
+            self.add_type(type_ref.type_id, type_ref, self.module)
+        else:
+            type_ref.enum_id = existing.enum_id
+
+        self.interned[key] = type_ref
+        return type_ref
+
+    def as_ptr(self, base_type: AkiType, literal_ptr=False):
+        return self.intern(
+            ("ptr", base_type.type_id, literal_ptr),
+            self._ptr.new,
+            base_type,
+            literal_ptr,
+        )
+
+    def as_func(self, arguments: list, return_type: AkiType):
+        """
+        Return the function type for a list of decorated argument nodes
+        and a return type.
+        """
+        return self.intern(
+            ("func", tuple(_.akitype.type_id for _ in arguments), return_type.type_id),
+            AkiFunction,
+            arguments,
+            return_type,
+        )
+
     def add_type(self, type_name: str, type_ref: AkiType, module_ref):
         if type_name in self.custom_types:
             return self.custom_types[type_name]
@@ -709,4 +2465,5 @@ class AkiTypeMgr:
         setattr(type_ref, "enum_id", self.enum_id_ctr)
         self.enum_ids[self.enum_id_ctr] = type_ref
         self.enum_id_ctr += 1
+        self._add_layout(type_ref)
         return type_ref
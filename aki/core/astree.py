@@ -18,6 +18,19 @@ class ASTNode:
     def flatten(self):
         return [self.__class__.__name__, "flatten unimplemented"]
 
+    def walk(self):
+        """
+        Yield this node and all of its child nodes, depth-first.
+        """
+        yield self
+        for _ in self.__dict__.values():
+            if isinstance(_, ASTNode):
+                yield from _.walk()
+            elif isinstance(_, (list, tuple)):
+                for child in _:
+                    if isinstance(child, ASTNode):
+                        yield from child.walk()
+
 
 class Expression(ASTNode):
     """
@@ -109,6 +122,63 @@ class VarTypeAccessor(VarTypeNode):
         ]
 
 
+class VarTypeVector(VarTypeNode):
+    def __init__(self, p, vartype: VarTypeNode, length):
+        super().__init__(p)
+        self.vartype = vartype
+        self.length = length
+
+    def __eq__(self, other):
+        return self.vartype == other.vartype and self.length == other.length
+
+    def flatten(self):
+        return [self.__class__.__name__, self.vartype.flatten(), self.length.flatten()]
+
+
+class VarTypeSlice(VarTypeNode):
+    def __init__(self, p, vartype: VarTypeNode):
+        super().__init__(p)
+        self.vartype = vartype
+
+    def __eq__(self, other):
+        return self.vartype == other.vartype
+
+    def flatten(self):
+        return [self.__class__.__name__, self.vartype.flatten()]
+
+
+class VarTypeList(VarTypeNode):
+    def __init__(self, p, vartype: VarTypeNode):
+        super().__init__(p)
+        self.vartype = vartype
+
+    def __eq__(self, other):
+        return self.vartype == other.vartype
+
+    def flatten(self):
+        return [self.__class__.__name__, self.vartype.flatten()]
+
+
+class VarTypeMap(VarTypeNode):
+    def __init__(self, p, key_vartype: VarTypeNode, value_vartype: VarTypeNode):
+        super().__init__(p)
+        self.key_vartype = key_vartype
+        self.value_vartype = value_vartype
+
+    def __eq__(self, other):
+        return (
+            self.key_vartype == other.key_vartype
+            and self.value_vartype == other.value_vartype
+        )
+
+    def flatten(self):
+        return [
+            self.__class__.__name__,
+            self.key_vartype.flatten(),
+            self.value_vartype.flatten(),
+        ]
+
+
 class Name(Expression):
     """
     Variable reference.
@@ -160,6 +230,27 @@ class ConstList(TopLevel, VarList):
     pass
 
 
+class StructDeclaration(TopLevel, ASTNode):
+    """
+    `struct` declaration, with a list of typed fields.
+    """
+
+    def __init__(self, p, name: str, fields: list):
+        super().__init__(p)
+        self.name = name
+        self.fields = fields
+
+    def __eq__(self, other):
+        return self.name == other.name and self.fields == other.fields
+
+    def flatten(self):
+        return [
+            self.__class__.__name__,
+            self.name,
+            [_.flatten() for _ in self.fields],
+        ]
+
+
 class Argument(ASTNode):
     """
     Function argument, with optional type declaration.
@@ -390,6 +481,36 @@ class External(Function):
     pass
 
 
+class MultiFunction(TopLevel, ASTNode):
+    """
+    Function with versions for different argument types.
+    Each `with` version has a fixed signature. The `default` version,
+    if any, is specialized for the argument types of each call
+    that none of the `with` versions match.
+    """
+
+    def __init__(self, p, name: str, variants: list, default):
+        super().__init__(p)
+        self.name = name
+        self.variants = variants
+        self.default = default
+
+    def __eq__(self, other):
+        return (
+            self.name == other.name
+            and self.variants == other.variants
+            and self.default == other.default
+        )
+
+    def flatten(self):
+        return [
+            self.__class__.__name__,
+            self.name,
+            [_.flatten() for _ in self.variants],
+            self.default.flatten() if self.default else None,
+        ]
+
+
 class Call(Expression, Prototype):
     """
     Function call.
@@ -437,12 +558,13 @@ class LLVMNode(Expression):
         self.vartype = vartype
 
         # LLVM node
-        # This MUST have .akitype and .akinode data
-
-        assert isinstance(self.llvm_node, ir.Instruction)
+        # This MUST have .akitype data. If it has no .akinode,
+        # the node it came from is used.
 
         self.llvm_node = llvm_node
-        assert self.llvm_node.akinode
+        assert isinstance(self.llvm_node, ir.Value)
+        if getattr(self.llvm_node, "akinode", None) is None:
+            self.llvm_node.akinode = node
         assert self.llvm_node.akitype
 
         # Name (optional)
@@ -530,6 +652,22 @@ class Accessor(Expression):
         return [self.__class__.__name__, [_.flatten() for _ in self.accessors]]
 
 
+class AnyDimension(Expression):
+    """
+    A `*` in an array type's dimensions,
+    for arrays whose dimensions are only known at runtime.
+    """
+
+    def __init__(self, p):
+        super().__init__(p)
+
+    def flatten(self):
+        return [self.__class__.__name__]
+
+    def __eq__(self, other):
+        return self.__class__ == other.__class__
+
+
 class AccessorExpr(Expression):
     def __init__(self, p, expr, accessors):
         super().__init__(p)
@@ -547,6 +685,24 @@ class AccessorExpr(Expression):
         ]
 
 
+class FieldRef(Expression):
+    """
+    Reference to a named field in a structure.
+    """
+
+    def __init__(self, p, expr, field: str):
+        super().__init__(p)
+        self.expr = expr
+        self.field = field
+        self.name = f"{getattr(expr, 'name', '')}.{field}"
+
+    def __eq__(self, other):
+        return self.expr == other.expr and self.field == other.field
+
+    def flatten(self):
+        return [self.__class__.__name__, self.expr.flatten(), self.field]
+
+
 class ObjectRef(Expression):
     """
     Target of an assignment operation.
@@ -1,4 +1,9 @@
 from llvmlite import ir, binding
+import copy
+import ctypes
+import hashlib
+import os
+from bisect import bisect_left
 from core.akitypes import (
     AkiType,
     AkiBool,
@@ -7,14 +12,28 @@ from core.akitypes import (
     AkiTypeMgr,
     AkiPointer,
     AkiBaseInt,
+    AkiBaseFloat,
+    AkiVector,
+    AkiStruct,
+    AkiSlice,
+    AkiList,
+    AkiMap,
+    AkiArray,
+    AkiBitArray,
+    AkiHeapArray,
+    AkiString,
     _int,
 )
 
 from core.astree import (
+    ASTNode,
     VarTypeNode,
     VarTypeName,
     VarTypeFunc,
     VarTypePtr,
+    VarTypeAccessor,
+    VarTypeList,
+    VarTypeMap,
     BinOpComparison,
     Constant,
     IfExpr,
@@ -29,13 +48,26 @@ from core.astree import (
     Function,
     ExpressionBlock,
     External,
+    MultiFunction,
     Call,
+    Return,
+    WhenExpr,
+    UnsafeBlock,
     AccessorExpr,
+    AnyDimension,
+    FieldRef,
     ObjectValue,
     ObjectRef,
     TopLevel,
     UniList,
+    StructDeclaration,
     Decorator,
+    InlineDecorator,
+    LoopExpr,
+    WhileExpr,
+    BinOp,
+    UnOp,
+    Break,
     String,
 )
 from core.error import (
@@ -47,6 +79,7 @@ from core.error import (
     LocalException,
 )
 from core.repl import CMD, REP
+from core import constants
 from typing import Optional, Any
 
 
@@ -78,15 +111,100 @@ class FuncState:
         # Exit block.
         self.exit_block = None
 
+        # First block of the function body,
+        # also the target for self-recursive tail calls.
+        self.body_block = None
+
         # Early exit value.
         self.early_exit = None
 
+        # Lexical scope stack. Each scope is a list of the
+        # names of the variables declared in it.
+        self.scopes = []
+
+        # Stack slots released by exited scopes,
+        # keyed by LLVM type, available for reuse.
+        self.free_slots = {}
+
+        # Number of profiled branches generated so far,
+        # used to give each one a stable profile key.
+        self.branches = 0
+
+        # Debug info subprogram for the function, if any.
+        self.debug_scope = None
+
+        # Stack slots that own a reference to a heap object:
+        # variables of heap types, and temporaries for objects
+        # returned from calls. Each is released when it goes
+        # out of scope, or when the function exits.
+        self.owners = []
+
+        # Set for parallel loop workers, where heap objects
+        # may be shared with other threads.
+        self.threaded = False
+
 
 class AkiCodeGen:
     """
     Code generation module for Akilang.
     """
 
+    # Fast-math flags for floating-point operations,
+    # used when the `fastmath` setting or decorator is in effect.
+    # `contract` also allows multiply/add pairs to be fused.
+
+    FASTMATH_FLAGS = ("nnan", "ninf", "reassoc", "contract")
+
+    # Memory effects for functions, from most to least restrictive.
+    # "const" functions touch no memory outside their own stack frame,
+    # "pure" functions may also read it, and `None` means any effect.
+
+    EFFECTS = ("const", "pure", None)
+
+    # Functions whose profiled entry count is at least this fraction
+    # of the most-called function's count are treated as hot.
+
+    PROFILE_HOT_RATIO = 0.1
+
+    # Branch weights for a condition marked `@likely` or `@unlikely`,
+    # the same as LLVM gives a branch on `llvm.expect`.
+
+    LIKELY_BRANCH_WEIGHTS = (2000, 1)
+
+    EFFECT_ATTRIBUTES = {
+        "const": ("readnone", "nounwind"),
+        "pure": ("readonly", "nounwind"),
+    }
+
+    # Memory effects of builtins. Builtins not listed here are "pure".
+    # List and map builtins that write to their container
+    # can have any effect.
+
+    BUILTIN_EFFECTS = {
+        "type": "const",
+        "size": "const",
+        "sizeof": "const",
+        "offsetof": "const",
+        "cast": "const",
+        "ref": "const",
+        "extract": "const",
+        "insert": "const",
+        "shuffle": "const",
+        "reduce_add": "const",
+        "reduce_mul": "const",
+        "len": "const",
+        "push": None,
+        "pop": None,
+        "append": None,
+        "delete": None,
+        "keys": None,
+        "values": None,
+        "str": None,
+        "bits_and": None,
+        "bits_or": None,
+        "bits_xor": None,
+    }
+
     def __init__(
         self,
         module: Optional[ir.Module] = None,
@@ -119,17 +237,77 @@ class AkiCodeGen:
         # Other codegen modules to check for namespaces.
         # Resolved top to bottom.
 
-        self.other_modules = other_modules
+        self.other_modules = list(other_modules)
+
+        # Cache of names resolved from other modules.
+        # A `None` entry means the name was not found anywhere.
+
+        self.resolved_names: dict = {}
 
         self.evaluator = None
 
+        # Names of the globals already compiled into the engine,
+        # from any module. Set by whatever owns the engine,
+        # so string literals can be shared between modules.
+
+        self.compiled_globals: set = set()
+
         self.decorator_stack: list = []
         self.decorator_context: dict = {}
 
+        # Module-level fast-math setting,
+        # which the `fastmath` decorator overrides per function.
+
+        self.fastmath = False
+
+        # Number of threads for `parallel` loops.
+        # 0 means one per CPU core.
+
+        self.threads = 0
+
+        # Profile-guided optimization.
+        # When `profile` is set, functions and branches are instrumented
+        # with counters, kept here by profile key.
+        # `profile_data` holds counts from an earlier instrumented run.
+
+        self.profile = False
+        self.profile_counters: dict = {}
+        self.profile_data: dict = {}
+
+        # Tiered compilation.
+        # When `tiered` is set, each function gets a call counter
+        # and a dispatch slot for an optimized copy, kept here by name.
+
+        self.tiered = False
+        self.tiers: dict = {}
+
+        # Debug info.
+        # When `debug` is set, functions are given DWARF metadata
+        # that maps their instructions to lines in `source_file`.
+
+        self.debug = False
+        self.source_file = None
+        self.debug_file = None
+        self.debug_unit = None
+        self.debug_lines = (None, [])
+
         self.anon_counter = 0
 
         self.repl = None
 
+    def add_module(self, module):
+        """
+        Add another module to check for namespaces.
+        """
+        self.other_modules.append(module)
+        self.reset_names()
+
+    def reset_names(self):
+        """
+        Invalidate all names resolved from other modules.
+        """
+        self.resolved_names = {}
+
     def _const_counter(self):
         self.typemgr.const_enum += 1
         return self.typemgr.const_enum
@@ -162,6 +340,18 @@ class AkiCodeGen:
             _ = self._get_vartype(node)
             return self._codegen_Name(node)
         method = f"_codegen_{node.__class__.__name__}"
+
+        # Instructions are tagged with the source location
+        # of the node that generated them.
+
+        if self.fn is not None and self.fn.debug_scope is not None:
+            builder = self.builder
+            location = builder.debug_metadata
+            builder.debug_metadata = self._debug_location(node, location)
+            result = getattr(self, method)(node)
+            builder.debug_metadata = location
+            return result
+
         result = getattr(self, method)(node)
         return result
 
@@ -218,55 +408,452 @@ class AkiCodeGen:
         # if name is not None:
         #     return name
 
-        # Next, look in other modules:
+        # Next, look in other modules,
+        # by way of the resolved-name cache:
+
+        if name_to_find in self.resolved_names:
+            name = self.resolved_names[name_to_find]
+        else:
+            name = self._resolve_external_name(name_to_find)
+            self.resolved_names[name_to_find] = name
+
+        if name is None:
+            raise AkiNameErr(
+                node, self.text, f'Name "{CMD}{name_to_find}{REP}" not found'
+            )
+
+        return name
+
+    def _resolve_external_name(self, name_to_find):
+        """
+        Find a name in the other modules, and link it into this one.
+        Returns `None` if no other module has the name.
+        """
+
         for _ in self.other_modules:
             # name = _.module.globals.get(name_to_find, None)
             name = _.globals.get(name_to_find, None)
-            if name is not None:
+            if name is None:
+                continue
 
-                # if this is just a regular variable,
-                # then copy it into the module.
+            # if this is just a regular variable,
+            # then copy it into the module.
 
-                if isinstance(name, ir.GlobalVariable):
-                    self.module.globals[name_to_find] = name
-                    return name
+            if isinstance(name, ir.GlobalVariable):
+                self.module.globals[name_to_find] = name
+                return name
 
-                # otherwise, this is a function.
-                # emit function reference for this module
-                link = ir.Function(self.module, name.ftype, name.name)
+            # otherwise, this is a function.
+            # emit function reference for this module
+            link = ir.Function(self.module, name.ftype, name.name)
+            link.calling_convention = name.calling_convention
+            self._set_effect(link, getattr(name.akinode, "effect", None))
 
-                # copy aki data for function
-                link.akinode = name.akinode
-                link.akitype = name.akitype
-                for n_arg, l_arg in zip(name.args, link.args):
-                    l_arg.akinode = n_arg.akinode
-                return name
+            # copy aki data for function
+            link.akinode = name.akinode
+            link.akitype = name.akitype
+            for n_arg, l_arg in zip(name.args, link.args):
+                l_arg.akinode = n_arg.akinode
+            return link
 
-        if name is None:
-            raise AkiNameErr(
-                node, self.text, f'Name "{CMD}{name_to_find}{REP}" not found'
-            )
+        return None
 
-    def _alloca(self, node, llvm_type, name, size=None, is_heap=False):
+    def _alloca(self, node, llvm_type, name, size=None, is_heap=False, is_scoped=False):
         """
         Allocate space for a variable.
-        Right now this is stack-only; eventually it'll include
-        heap allocations, too.
-        We must also later make distinctions between allocations that are for
-        a REFERENCE (e.g., a pointer to a string construction) and for an
-        UNDERLYING VALUE (e.g., the heap-allocated string itself). That way
-        we can track and dispose those by way of scopes.
+        If `is_scoped` is set and we are inside a lexical scope,
+        the variable's lifetime is bounded by that scope, and its
+        stack slot may be shared with variables from earlier,
+        already-exited scopes.
+        If `is_heap` is set, the variable holds a reference
+        to a heap object, and owns that reference. Its slot starts out
+        null and is never shared, so the reference can be released
+        when the variable goes out of scope or the function exits,
+        whichever path is taken.
         """
 
-        allocation = self.fn.allocator.alloca(llvm_type, size, name)
+        if is_heap:
+            allocation = self.fn.allocator.alloca(llvm_type, size, name)
+            self.fn.allocator.store(ir.Constant(llvm_type, None), allocation)
+            self.fn.owners.append(allocation)
+            if is_scoped and self.fn.scopes:
+                self.fn.scopes[-1].append(name)
+            return allocation
+
+        if not is_scoped or not self.fn.scopes or size is not None:
+            return self.fn.allocator.alloca(llvm_type, size, name)
+
+        free_slots = self.fn.free_slots.get(str(llvm_type), None)
+        if free_slots:
+            allocation = free_slots.pop()
+        else:
+            allocation = self.fn.allocator.alloca(llvm_type, size, name)
+
+        self._lifetime(allocation, "start")
+        self.fn.scopes[-1].append(name)
         return allocation
 
+    def _heap_alloc(self, node, size):
+        """
+        Allocate `size` bytes from the heap, with the stdlib allocator.
+        The memory starts out zeroed.
+        """
+        size.akitype = self.types["u_size"]
+        return self._codegen(Call(node, "alloc", [LLVMNode(node, None, size)], None))
+
+    def _heap_realloc(self, node, ptr, size):
+        """
+        Resize a heap allocation to `size` bytes, with the stdlib allocator.
+        Any memory added to the allocation starts out zeroed.
+        """
+        u_mem_ptr = self.typemgr.as_ptr(self.types["u_mem"])
+        ptr = self.builder.bitcast(ptr, u_mem_ptr.llvm_type)
+        ptr.akitype = u_mem_ptr
+        size.akitype = self.types["u_size"]
+        return self._codegen(
+            Call(
+                node,
+                "realloc",
+                [LLVMNode(node, None, ptr), LLVMNode(node, None, size)],
+                None,
+            )
+        )
+
+    def _is_heap_object(self, akitype):
+        """
+        Determine if values of a type are references to heap objects,
+        which are freed when the last variable referring to them
+        lets go of them.
+        """
+        return isinstance(akitype, (AkiHeapArray, AkiList, AkiMap, AkiString))
+
+    def _retain(self, value):
+        """
+        Add a reference to a heap object, unless it's null
+        or a constant, like a string literal.
+        """
+        builder = self.builder
+        with builder.if_then(self._is_allocated(value)):
+            count = builder.gep(value, [_int(0), _int(0), _int(AkiObject.REFCOUNT)])
+            one = ir.Constant(count.type.pointee, 1)
+            if self.fn.threaded:
+                builder.atomic_rmw("add", count, one, "monotonic")
+            else:
+                builder.store(builder.add(builder.load(count), one), count)
+
+    def _release(self, node, value, akitype=None):
+        """
+        Drop a reference to a heap object,
+        freeing it if that was the last reference.
+        """
+        if akitype is None:
+            akitype = value.akitype
+        threaded = self.fn.threaded
+
+        def generate(func):
+            builder = self.builder
+            obj = func.args[0]
+            obj.akitype = akitype
+            with builder.if_then(builder.not_(self._is_allocated(obj))):
+                builder.ret_void()
+            count = builder.gep(obj, [_int(0), _int(0), _int(AkiObject.REFCOUNT)])
+            one = ir.Constant(count.type.pointee, 1)
+            if threaded:
+                last = builder.icmp_unsigned(
+                    "==", builder.atomic_rmw("sub", count, one, "acq_rel"), one
+                )
+            else:
+                remaining = builder.sub(builder.load(count), one)
+                builder.store(remaining, count)
+                last = builder.icmp_unsigned(
+                    "==", remaining, ir.Constant(remaining.type, 0)
+                )
+            with builder.if_then(last):
+                akitype.deallocate(self, node, obj)
+            builder.ret_void()
+
+        release = self._runtime_function(
+            node,
+            f".release.{'atomic.' if threaded else ''}{akitype.type_id}",
+            ir.FunctionType(ir.VoidType(), [akitype.llvm_type]),
+            generate,
+        )
+        self.builder.call(release, [value])
+
+    def _each_element(self, data, count, action):
+        """
+        Generate a loop that calls `action(element, index)`
+        for each of the first `count` elements at `data`.
+        """
+        builder = self.builder
+        zero = ir.Constant(count.type, 0)
+        start_block = builder.block
+        loop_block = builder.append_basic_block("element_loop")
+        exit_block = builder.append_basic_block("element_exit")
+        builder.cbranch(
+            builder.icmp_unsigned("==", count, zero), exit_block, loop_block
+        )
+
+        builder.position_at_start(loop_block)
+        index = builder.phi(count.type)
+        index.add_incoming(zero, start_block)
+        action(builder.load(builder.gep(data, [index])), index)
+        next_index = builder.add(index, ir.Constant(count.type, 1))
+        index.add_incoming(next_index, builder.block)
+        builder.cbranch(
+            builder.icmp_unsigned("<", next_index, count), loop_block, exit_block
+        )
+
+        builder.position_at_start(exit_block)
+
+    def _is_null(self, value):
+        return self.builder.icmp_unsigned("==", value, ir.Constant(value.type, None))
+
+    def _is_allocated(self, value):
+        """
+        Determine if a reference is to a heap object whose references
+        are counted. Null references, and objects stored as constants,
+        are left alone.
+        """
+        builder = self.builder
+        if value.type != self.types["str"].llvm_type:
+            return builder.not_(self._is_null(value))
+
+        start_block = builder.block
+        check_block = builder.append_basic_block("allocated_check")
+        exit_block = builder.append_basic_block("allocated_exit")
+        builder.cbranch(self._is_null(value), exit_block, check_block)
+
+        builder.position_at_start(check_block)
+        allocated = builder.load(
+            builder.gep(value, [_int(0), _int(0), _int(AkiObject.IS_ALLOCATED)])
+        )
+        builder.branch(exit_block)
+
+        builder.position_at_start(exit_block)
+        result = builder.phi(ir.IntType(1))
+        result.add_incoming(ir.Constant(ir.IntType(1), 0), start_block)
+        result.add_incoming(allocated, check_block)
+        return result
+
+    def _memcpy(self, dest, src, size):
+        """
+        Copy `size` bytes from `src` to `dest`, which don't overlap.
+        """
+        builder = self.builder
+        ptr_type = self.types["u_mem"].llvm_type.as_pointer()
+        size_type = self.types["u_size"].llvm_type
+        memcpy = self.module.declare_intrinsic(
+            "llvm.memcpy",
+            [ptr_type, ptr_type, size_type],
+            ir.FunctionType(
+                ir.VoidType(), [ptr_type, ptr_type, size_type, ir.IntType(1)]
+            ),
+        )
+        builder.call(
+            memcpy,
+            [
+                builder.bitcast(dest, ptr_type),
+                builder.bitcast(src, ptr_type),
+                size,
+                ir.Constant(ir.IntType(1), 0),
+            ],
+        )
+
+    def _format(self, node, buffer, size, format, value):
+        """
+        Format a value into a buffer of `size` bytes,
+        with the stdlib's `_snprintf`. Returns the length of the result.
+        """
+        format_str = self._codegen(String(node, format, None))
+        format_ptr = self.builder.bitcast(
+            self.builder.gep(format_str, [_int(0), _int(1), _int(0)]),
+            self.typemgr.as_ptr(self.types["u8"]).llvm_type,
+        )
+        format_ptr.akitype = self.typemgr.as_ptr(self.types["u8"])
+        buffer.akitype = self.typemgr.as_ptr(self.types["u_mem"])
+        size.akitype = self.types["u_size"]
+        value.akitype = self.types["f64"]
+        return self._codegen(
+            Call(
+                node,
+                "_snprintf",
+                [
+                    LLVMNode(node, None, buffer),
+                    LLVMNode(node, None, size),
+                    LLVMNode(node, None, format_ptr),
+                    LLVMNode(node, None, value),
+                ],
+                None,
+            )
+        )
+
+    def _store_reference(self, node, value, ptr, adopt=False):
+        """
+        Store a reference to a heap object in a slot that owns it,
+        releasing the reference the slot held before.
+        If `adopt` is set, the value already carries a reference
+        for the slot, as the result of a call does.
+        """
+        if not adopt:
+            self._retain(value)
+        old = self.builder.load(ptr)
+        old.akitype = value.akitype
+        self.builder.store(value, ptr)
+        self._release(node, old)
+
+    def _release_owner(self, node, allocation):
+        """
+        Release the reference held by a slot, and clear the slot.
+        """
+        value = self.builder.load(allocation)
+        value.akitype = allocation.akitype
+        self._release(node, value)
+        self.builder.store(ir.Constant(value.type, None), allocation)
+
+    def _release_owners(self, node):
+        """
+        Release the references held by all the function's slots
+        at its exit. Slots for variables from exited scopes
+        have already been cleared.
+        """
+        for _ in self.fn.owners:
+            self._release_owner(node, _)
+
+    def _temporary(self, node, value, adopt=False):
+        """
+        Keep a heap object alive with a hidden slot that owns it,
+        for an object that isn't otherwise held by a variable,
+        like the result of a call. The slot is released when the function
+        exits, or when the same code stores a new object in it.
+        """
+        if self.builder.block.is_terminated or not self._is_heap_object(
+            getattr(value, "akitype", None)
+        ):
+            return value
+        temp = self._alloca(node, value.type, ".temp", is_heap=True)
+        temp.akitype = value.akitype
+        self._store_reference(node, value, temp, adopt)
+        return value
+
+    def _heap_free(self, node, ptr):
+        """
+        Return a heap allocation to the stdlib allocator.
+        """
+        u_mem_ptr = self.typemgr.as_ptr(self.types["u_mem"])
+        ptr = self.builder.bitcast(ptr, u_mem_ptr.llvm_type)
+        ptr.akitype = u_mem_ptr
+        return self._codegen(Call(node, "free", [LLVMNode(node, None, ptr)], None))
+
+    def _runtime_function(self, node, name, function_type, generate):
+        """
+        Get an internal function that implements part of the runtime
+        for a type, such as a lookup for a `map`.
+        The first time it's used in a module, the function is generated
+        by `generate(function)`, with the builder positioned in its body.
+        """
+        func = self.module.globals.get(name, None)
+        if func is not None and func.ftype == function_type:
+            return func
+
+        func = ir.Function(
+            self.module, function_type, self.module.get_unique_name(name)
+        )
+        func.linkage = "internal"
+
+        # Save the state of the enclosing function.
+
+        outer = self.fn, self.builder, self.entry_block
+
+        self.fn = FuncState()
+        self.fn.fn = func
+        self.entry_block = func.append_basic_block("entry")
+        self.fn.allocator = ir.IRBuilder(self.entry_block)
+        self.fn.body_block = func.append_basic_block("body")
+        self.builder = ir.IRBuilder(self.fn.body_block)
+
+        if self.debug:
+            self.fn.debug_scope = self._debug_subprogram(func, node)
+            self.builder.debug_metadata = self._debug_location(node, None)
+
+        try:
+            generate(func)
+            self.fn.allocator.branch(self.fn.body_block)
+        finally:
+            self.fn, self.builder, self.entry_block = outer
+
+        return func
+
+    def _lifetime(self, allocation, marker):
+        """
+        Emit an `llvm.lifetime.start` or `llvm.lifetime.end` marker
+        for a stack slot at the current builder position.
+        """
+
+        ptr_type = self.types["u_mem"].llvm_type.as_pointer()
+        intrinsic = self.module.declare_intrinsic(
+            f"llvm.lifetime.{marker}",
+            [ptr_type],
+            ir.FunctionType(ir.VoidType(), [ir.IntType(64), ptr_type]),
+        )
+        size = self.typemgr.layout(allocation.type.pointee).size
+        self.builder.call(
+            intrinsic,
+            [
+                ir.Constant(ir.IntType(64), size),
+                self.builder.bitcast(allocation, ptr_type),
+            ],
+        )
+
+    def _scope_enter(self):
+        """
+        Open a new lexical scope for variable declarations.
+        """
+        self.fn.scopes.append([])
+
+    def _scope_exit(self):
+        """
+        Close the innermost lexical scope.
+        Each variable declared in it is removed from the symbol table,
+        its lifetime is ended, and its stack slot is released for reuse.
+        Variables that own heap objects release them instead.
+        Returns the released stack slots.
+        """
+
+        released = []
+
+        for name in reversed(self.fn.scopes.pop()):
+            allocation = self.fn.symtab[name]
+            if allocation in self.fn.owners:
+                if not self.builder.block.is_terminated:
+                    self._release_owner(allocation.akinode, allocation)
+            else:
+                if not self.builder.block.is_terminated:
+                    self._lifetime(allocation, "end")
+                self.fn.free_slots.setdefault(str(allocation.type.pointee), []).append(
+                    allocation
+                )
+            self._delete_var(name)
+            released.append(allocation)
+
+        return released
+
+    def _lifetime_end(self, allocations):
+        """
+        End the lifetimes of stack slots released by a scope
+        that can also be left early, e.g., by a `break`.
+        Ending an already-ended lifetime is a no-op,
+        as is releasing an already-cleared slot.
+        """
+        for _ in allocations:
+            if _ in self.fn.owners:
+                self._release_owner(_.akinode, _)
+            else:
+                self._lifetime(_, "end")
+
     def _delete_var(self, name):
         """
         Deletes a variable from the local scope.
-        Eventually this will be where we make decisions about
-        deallocating heap-allocated objects when they
-        pass out of scope, etc.
         """
 
         del self.fn.symtab[name]
@@ -319,6 +906,35 @@ class AkiCodeGen:
         )
         return array_type
 
+    def _get_vartype_VarTypeVector(self, node):
+        """
+        Node visitor for `VarTypeVector` nodes.
+        """
+        base_type = self._get_vartype(node.vartype)
+        return self.types["vec"].new(self, node, base_type, node.length)
+
+    def _get_vartype_VarTypeSlice(self, node):
+        """
+        Node visitor for `VarTypeSlice` nodes.
+        """
+        base_type = self._get_vartype(node.vartype)
+        return self.types["slice"].new(self, node, base_type)
+
+    def _get_vartype_VarTypeList(self, node):
+        """
+        Node visitor for `VarTypeList` nodes.
+        """
+        base_type = self._get_vartype(node.vartype)
+        return self.types["list"].new(self, node, base_type)
+
+    def _get_vartype_VarTypeMap(self, node):
+        """
+        Node visitor for `VarTypeMap` nodes.
+        """
+        key_type = self._get_vartype(node.key_vartype)
+        value_type = self._get_vartype(node.value_vartype)
+        return self.types["map"].new(self, node, key_type, value_type)
+
     def _get_vartype_VarTypePtr(self, node):
         """
         Node visitor for `VarTypePtr` nodes.
@@ -337,7 +953,7 @@ class AkiCodeGen:
 
         node.return_type.akitype = self._get_vartype(node.return_type)
 
-        aki_node = AkiFunction(node.arguments, node.return_type.akitype)
+        aki_node = self.typemgr.as_func(node.arguments, node.return_type.akitype)
         node.name = aki_node.type_id
 
         return aki_node
@@ -419,6 +1035,23 @@ class AkiCodeGen:
                 f'Name "{CMD}{name}{REP}" conflicts with an existing defined type',
             )
 
+        if name in self.typemgr.generics:
+            raise AkiNameErr(
+                node,
+                self.text,
+                f'Name "{CMD}{name}{REP}" already used in this module as a function',
+            )
+
+    def _fastmath_flags(self):
+        """
+        Return the fast-math flags to apply to a floating-point operation
+        in the current context.
+        """
+        fastmath = self.decorator_context.get("fastmath", None)
+        if fastmath is None:
+            fastmath = self.fastmath
+        return self.FASTMATH_FLAGS if fastmath else ()
+
     def _scalar_as_bool(self, node, expr):
         """
         Takes an LLVM instruction result of a scalar type
@@ -484,6 +1117,9 @@ class AkiCodeGen:
         self.decorator_stack.pop()
         return result
 
+    def _codegen_InlineDecorator(self, node):
+        return self._codegen_Decorator(node)
+
     def _codegen_Prototype(self, node):
         """
         Generate a function prototype for the LLVM module
@@ -591,6 +1227,8 @@ class AkiCodeGen:
 
         # Set function attributes
 
+        self._set_effect(proto, getattr(node, "effect", None))
+
         inline = self.decorator_context.get("inline", None)
 
         if inline is not None:
@@ -601,7 +1239,9 @@ class AkiCodeGen:
 
         # Set variable types for function
 
-        function_type = AkiFunction([_.vartype for _ in node_args], return_type)
+        function_type = self.typemgr.as_func(
+            [_.vartype for _ in node_args], return_type
+        )
 
         proto.akinode = node
         proto.akitype = function_type
@@ -622,6 +1262,30 @@ class AkiCodeGen:
 
     def _codegen_Return(self, node):
         val = self._codegen(node.return_val)
+        self._check_return_type(node, val)
+        self.builder.store(val, self.fn.return_value)
+        self.builder.branch(self.fn.exit_block)
+        self._unreachable_block()
+        return val
+
+        # Technically, `return` returns a value, but this is included
+        # more for completeness on our end than because it's ever actually
+        # used in a program's flow.
+
+    def _unreachable_block(self):
+        """
+        After a jump out of the middle of an expression,
+        continue in a new block that nothing branches to,
+        so the rest of the expression has somewhere to go.
+        The optimizer removes it.
+        """
+        self.builder.position_at_start(self.builder.append_basic_block(".unreachable"))
+
+    def _check_return_type(self, node, val):
+        """
+        Verify the type of a value returned early from a function,
+        either by way of `return` or a tail call.
+        """
 
         try:
 
@@ -652,70 +1316,512 @@ class AkiCodeGen:
                 f"Return value type ({CMD}{val.akitype}{REP}) does not match function signature return type ({CMD}{self.fn.return_value.akitype}{REP})",
             )
 
-        self.builder.store(val, self.fn.return_value)
-        self.builder.branch(self.fn.exit_block)
-        return val
-
-        # Technically, `return` returns a value, but this is included
-        # more for completeness on our end than because it's ever actually
-        # used in a program's flow.
+    def _set_effect(self, func, effect):
+        """
+        Add the LLVM attributes for a memory effect to a function.
+        """
+        for _ in self.EFFECT_ATTRIBUTES.get(effect, ()):
+            func.attributes.add(_)
 
-    def _codegen_Function(self, node):
+    def _infer_effect(self, node):
         """
-        Generate an LLVM function from a `Function` AST node.
+        Infer the memory effect of a function from its body.
+        Any function it calls must already have been defined,
+        so the effects of those functions are already known.
         """
-        # we may not use this, but I'm putting it here provisionally
-        # if self.module.name is not None and not self.module.name.startswith('.')and not isinstance(node, External):
-        #     node.prototype.name = self.module.name + '.' + node.prototype.name
 
-        self.init_func_handlers()
+        effect = 0
+
+        # Heap objects passed in or returned have their references counted,
+        # and looking up a key in a map can insert it.
+
+        if self._is_heap_vartype(node.prototype.return_type) or any(
+            self._is_heap_vartype(_.vartype) for _ in node.prototype.arguments
+        ):
+            return None
+
+        # Elements and fields of local arrays and structures
+        # are in our own frame. Anything else that's indexed,
+        # like an argument or a local pointer or slice, may not be.
+
+        own = set()
+        for _ in node.body.walk():
+            if isinstance(_, VarList):
+                own.update(
+                    v.name
+                    for v in _.vars
+                    if type(v.vartype) is VarTypeName
+                    or (
+                        isinstance(v.vartype, VarTypeAccessor)
+                        and not self._is_heap_vartype(v.vartype)
+                    )
+                )
 
-        # Generate function prototype.
-        func = self._codegen(node.prototype)
+        for _ in node.body.walk():
+            if isinstance(_, Assignment):
+                target = _.lhs.expr
+                while isinstance(target, (AccessorExpr, FieldRef)):
+                    target = target.expr
+                name = getattr(target, "name", None)
+                if self._is_global_var(name):
+                    return None
 
-        if self.fn.varargs and not isinstance(node, External):
-            raise AkiSyntaxErr(
-                self.fn.varargs.index,
-                self.text,
-                f"Non-external functions don't yet support variable arguments",
-            )
+                # Elements or fields of anything but a local array
+                # or structure, like an argument or a copy of one,
+                # may be in the caller's memory.
+                if target is not _.lhs.expr and name not in own:
+                    return None
 
-        # Store an original function reference in the prototype.
-        # This is so we can refer to it later if we use
-        # a function pointer.
-        func.akitype.original_function = func
+            # Lists, maps, and arrays with computed dimensions,
+            # are allocated from the heap.
 
-        self.fn.fn = func
+            elif self._is_heap_vartype(_):
+                return None
 
-        if isinstance(node, External):
-            for a, b in zip(func.args, node.prototype.arguments):
-                # make sure the variable name is not in use
-                self._check_var_name(b, b.name)
-                # set the akinode attribute for the original argument,
-                # so it can be referenced if we need to throw an error
-                a.akitype = b.vartype.akitype
-                a.akinode = b
-            return func
+            elif isinstance(_, Name):
+                if self._is_global_var(_.name):
+                    effect = max(effect, self.EFFECTS.index("pure"))
 
-        # Generate entry block and function body.
+            elif isinstance(_, (AccessorExpr, FieldRef)):
+                target = _
+                while isinstance(target, (AccessorExpr, FieldRef)):
+                    target = target.expr
+                if getattr(target, "name", None) not in own:
+                    effect = max(effect, self.EFFECTS.index("pure"))
 
-        self.entry_block = func.append_basic_block("entry")
-        self.fn.allocator = ir.IRBuilder(self.entry_block)
+            elif isinstance(_, Call):
+                effect = max(effect, self.EFFECTS.index(self._call_effect(_)))
 
-        # Add prototype arguments to function symbol table
-        # and add references in function.
-        # Use isinstance(ir.Argument) to determine if the
-        # var being looked up is a func arg.
+            # Parallel loops start threads.
 
-        for a, b in zip(func.args, node.prototype.arguments):
-            # make sure the variable name is not in use
-            self._check_var_name(b, b.name)
-            # create an allocation for the variable
-            var_alloc = self._alloca(b, b.vartype.llvm_type, b.name)
-            # set its Aki attributes
-            a.akitype = b.vartype.akitype
-            var_alloc.akitype = b.vartype.akitype
-            var_alloc.akinode = b
+            elif isinstance(_, Decorator) and _.name == "parallel":
+                return None
+
+            if self.EFFECTS[effect] is None:
+                return None
+
+        return self.EFFECTS[effect]
+
+    def _is_heap_vartype(self, node):
+        """
+        Determine if a type node is for a heap object,
+        before the type itself is known.
+        """
+        return isinstance(node, (VarTypeList, VarTypeMap)) or (
+            isinstance(node, VarTypeAccessor)
+            and not all(isinstance(_, Constant) for _ in node.accessors.accessors)
+        )
+
+    def _is_global_var(self, name):
+        """
+        Determine if a name refers to a non-constant `uni` variable,
+        in this module or another one.
+        Local names can't shadow these, so the name alone is enough.
+        """
+        for module in [self.module] + self.other_modules:
+            var = module.globals.get(name, None)
+            if var is not None:
+                return isinstance(var, ir.GlobalVariable) and not var.global_constant
+        return False
+
+    def _call_effect(self, node):
+        """
+        Determine the memory effect of a call from a `Call` node.
+        """
+
+        if getattr(self, f"_builtins_{node.name}", None):
+            return self.BUILTIN_EFFECTS.get(node.name, "pure")
+
+        # Direct recursion doesn't change the function's effect.
+
+        if node.name == self.fn.fn.name:
+            return "const"
+
+        try:
+            callee = self._name(node, node.name)
+        except AkiNameErr:
+            return None
+
+        # Function pointers, externs, and functions
+        # without a known effect could do anything.
+
+        if not isinstance(callee, ir.Function):
+            return None
+        return getattr(callee.akinode, "effect", None)
+
+    def _profile_count(self, key, amount=None, builder=None):
+        """
+        Add to the profile counter for a key (by default, 1),
+        at the current builder position unless another builder is given.
+        Counters live in Python-owned memory, and are updated atomically
+        so counts from parallel loops aren't lost.
+        """
+        counter = self.profile_counters.get(key, None)
+        if counter is None:
+            counter = self.profile_counters[key] = ctypes.c_int64(0)
+        i64 = ir.IntType(64)
+        address = ir.Constant(i64, ctypes.addressof(counter)).inttoptr(i64.as_pointer())
+        if amount is None:
+            amount = ir.Constant(i64, 1)
+        (builder or self.builder).atomic_rmw("add", address, amount, "monotonic")
+
+    def _profile_function(self, func):
+        """
+        Count entries to a function, or apply the entry count
+        from an earlier profile: its entry count metadata,
+        and a hot or cold attribute.
+        """
+        key = f"{func.name}:entry"
+
+        # Entries are counted in the entry block, since self tail calls
+        # jump back to the body.
+
+        if self.profile:
+            self._profile_count(key, builder=self.fn.allocator)
+
+        count = self.profile_data.get(key, None)
+        if count is None:
+            return
+
+        func.set_metadata(
+            "prof",
+            self.module.add_metadata(
+                [
+                    ir.MetaDataString(self.module, "function_entry_count"),
+                    ir.Constant(ir.IntType(64), count),
+                ]
+            ),
+        )
+
+        entries = [v for k, v in self.profile_data.items() if k.endswith(":entry")]
+        if count == 0:
+            func.attributes.add("cold")
+        elif count >= max(entries) * self.PROFILE_HOT_RATIO:
+            func.attributes.add("inlinehint")
+
+    def _tier_function(self, func):
+        """
+        Finish the entry block of a function for tiered compilation.
+        Calls are counted until an optimized copy of the function
+        is placed in its dispatch slot, and are passed on to that copy
+        from then on. The count is updated atomically,
+        since it's read by the tiering thread and calls can come from threads.
+        """
+        counter, slot = self.tiers[func.name] = (ctypes.c_int64(0), ctypes.c_void_p(0))
+
+        i64 = ir.IntType(64)
+        i8_ptr = ir.IntType(8).as_pointer()
+        builder = self.fn.allocator
+
+        slot_ptr = ir.Constant(i64, ctypes.addressof(slot)).inttoptr(
+            i8_ptr.as_pointer()
+        )
+        target = builder.load_atomic(slot_ptr, "monotonic", 8, ".tier_target")
+
+        count_block = func.append_basic_block("tier_count")
+        check_block = func.append_basic_block("tier_check")
+        dispatch_block = func.append_basic_block("tier_dispatch")
+
+        builder.cbranch(
+            builder.icmp_unsigned("==", target, ir.Constant(i8_ptr, None)),
+            count_block,
+            check_block,
+        )
+
+        builder.position_at_start(count_block)
+        counter_ptr = ir.Constant(i64, ctypes.addressof(counter)).inttoptr(
+            i64.as_pointer()
+        )
+        builder.atomic_rmw("add", counter_ptr, ir.Constant(i64, 1), "monotonic")
+        builder.branch(self.fn.body_block)
+
+        # The optimized copy runs this same code,
+        # and finds itself in the slot.
+
+        builder.position_at_start(check_block)
+        builder.cbranch(
+            builder.icmp_unsigned("==", target, builder.bitcast(func, i8_ptr)),
+            self.fn.body_block,
+            dispatch_block,
+        )
+
+        builder.position_at_start(dispatch_block)
+        result = builder.call(
+            builder.bitcast(target, func.type),
+            func.args,
+            cconv=func.calling_convention,
+            tail=True,
+        )
+        builder.ret(result)
+
+    def _debug_line(self, node):
+        """
+        Return the line and column of a node in the source text.
+        Nodes created by the compiler take their position
+        from the node they were made from, if any.
+        """
+        index = node.index
+        while isinstance(index, ASTNode):
+            index = index.index
+        if index is None:
+            return None
+
+        text, newlines = self.debug_lines
+        if text is not self.text:
+            newlines = [n for n, _ in enumerate(self.text) if _ == "\n"]
+            self.debug_lines = (self.text, newlines)
+        line = bisect_left(newlines, index)
+        return line + 1, index - (newlines[line - 1] if line else -1)
+
+    def _debug_subprogram(self, func, node):
+        """
+        Create the debug info subprogram for a function,
+        and the compile unit for the module if needed.
+        """
+        if self.debug_unit is None:
+            path = self.source_file or f"<{self.module.name or 'main'}>"
+            self.debug_file = self.module.add_debug_info(
+                "DIFile",
+                {
+                    "filename": os.path.basename(path),
+                    "directory": os.path.dirname(os.path.abspath(path)),
+                },
+            )
+            self.debug_unit = self.module.add_debug_info(
+                "DICompileUnit",
+                {
+                    "language": ir.DIToken("DW_LANG_C"),
+                    "file": self.debug_file,
+                    "producer": f"{constants.PRODUCT} {constants.VERSION}",
+                    "runtimeVersion": 0,
+                    "isOptimized": False,
+                    "emissionKind": ir.DIToken("FullDebug"),
+                },
+                is_distinct=True,
+            )
+            self.module.add_named_metadata("llvm.dbg.cu", self.debug_unit)
+            for flag, value in (("Dwarf Version", 4), ("Debug Info Version", 3)):
+                self.module.add_named_metadata(
+                    "llvm.module.flags",
+                    [
+                        ir.Constant(ir.IntType(32), 2),
+                        ir.MetaDataString(self.module, flag),
+                        ir.Constant(ir.IntType(32), value),
+                    ],
+                )
+
+        line, _ = self._debug_line(node) or (1, 1)
+        subprogram = self.module.add_debug_info(
+            "DISubprogram",
+            {
+                "name": func.name,
+                "scope": self.debug_file,
+                "file": self.debug_file,
+                "line": line,
+                "type": self.module.add_debug_info(
+                    "DISubroutineType", {"types": self.module.add_metadata([])}
+                ),
+                "isLocal": func.linkage == "internal",
+                "isDefinition": True,
+                "scopeLine": line,
+                "unit": self.debug_unit,
+            },
+            is_distinct=True,
+        )
+
+        # llvmlite can't write more than one metadata attachment
+        # on a function definition, so an entry count from a profile
+        # gives way to the debug info.
+
+        func.metadata.pop("prof", None)
+        func.set_metadata("dbg", subprogram)
+        return subprogram
+
+    def _debug_location(self, node, default):
+        """
+        Create the debug info location for a node
+        in the current function.
+        Nodes with no position keep the location in effect.
+        """
+        position = self._debug_line(node)
+        if position is None:
+            return default
+        line, col = position
+        return self.module.add_debug_info(
+            "DILocation", {"line": line, "column": col, "scope": self.fn.debug_scope}
+        )
+
+    def _branch_weights(self, weights):
+        """
+        Create `!prof` branch weight metadata from profile counts,
+        scaled to fit the 32-bit weights LLVM expects.
+        """
+        scale = max(1, -(-max(weights) // 0xFFFFFFFF))
+        return self.module.add_metadata(
+            [ir.MetaDataString(self.module, "branch_weights")]
+            + [ir.Constant(ir.IntType(32), _ // scale) for _ in weights]
+        )
+
+    def _cbranch(self, node, cond, true_block, false_block, expect=None):
+        """
+        Generate a conditional branch, with profile counters
+        for both edges if profiling, and branch weights
+        if we have counts from an earlier profile.
+        Otherwise, `expect` gives the condition's likely value, if any.
+        """
+        self.fn.branches += 1
+        key = f"{self.fn.fn.name}:{self.fn.branches}:{node.index}"
+        keys = [f"{key}:true", f"{key}:false"]
+
+        if self.profile:
+            i64 = ir.IntType(64)
+            taken = self.builder.zext(cond, i64)
+            self._profile_count(keys[0], taken)
+            self._profile_count(keys[1], self.builder.sub(ir.Constant(i64, 1), taken))
+
+        branch = self.builder.cbranch(cond, true_block, false_block)
+
+        weights = [self.profile_data.get(_, None) for _ in keys]
+        if None in weights and expect is not None:
+            weights = self.LIKELY_BRANCH_WEIGHTS[:: 1 if expect else -1]
+        if None not in weights:
+            branch.set_metadata("prof", self._branch_weights(weights))
+
+        return branch
+
+    def _loop_metadata(self, branch, unroll):
+        """
+        Attach `llvm.loop` metadata to the branch that closes a loop,
+        from the `unroll` or `nounroll` decorator on the loop.
+        A loop ID is a node that refers to itself, so it's made directly:
+        `add_metadata` would give back an identical node from another loop.
+        """
+        if unroll.name == "nounroll":
+            option = [ir.MetaDataString(self.module, "llvm.loop.unroll.disable")]
+        elif unroll.args:
+            option = [
+                ir.MetaDataString(self.module, "llvm.loop.unroll.count"),
+                ir.Constant(ir.IntType(32), unroll.args[0].val),
+            ]
+        else:
+            option = [ir.MetaDataString(self.module, "llvm.loop.unroll.enable")]
+
+        loop_id = ir.values.MDValue(
+            self.module, [], name=str(len(self.module.metadata))
+        )
+        loop_id.operands = (loop_id, self.module.add_metadata(option))
+        branch.set_metadata("llvm.loop", loop_id)
+
+    def _mark_tail_calls(self, node):
+        """
+        Flag the `Call` nodes in a function body whose results
+        are returned directly from the function,
+        so they can be emitted as tail calls.
+        """
+
+        # A callee could be handed a pointer into one of our locals,
+        # so we can't reuse our stack frame if anything takes
+        # the address of one: `ref`, a `slice` of a local array,
+        # or the `c_data` of one.
+
+        for _ in node.body.walk():
+            if isinstance(_, Call) and _.name in ("ref", "slice", "c_data"):
+                return
+
+        tails = [node.body]
+        tails.extend(_.return_val for _ in node.body.walk() if isinstance(_, Return))
+
+        while tails:
+            _ = tails.pop()
+            if isinstance(_, Call):
+                _.tail_call = True
+            elif isinstance(_, ExpressionBlock):
+                if _.body:
+                    tails.append(_.body[-1])
+            elif isinstance(_, IfExpr) and not isinstance(_, WhenExpr):
+                tails.append(_.then_expr)
+                tails.append(_.else_expr)
+            elif isinstance(_, WithExpr):
+                tails.append(_.body)
+            elif isinstance(_, UnsafeBlock):
+                tails.append(_.expr_block)
+
+    def _codegen_Function(self, node):
+        """
+        Generate an LLVM function from a `Function` AST node.
+        """
+        # we may not use this, but I'm putting it here provisionally
+        # if self.module.name is not None and not self.module.name.startswith('.')and not isinstance(node, External):
+        #     node.prototype.name = self.module.name + '.' + node.prototype.name
+
+        self.init_func_handlers()
+
+        # Generate function prototype.
+        func = self._codegen(node.prototype)
+
+        if self.fn.varargs and not isinstance(node, External):
+            raise AkiSyntaxErr(
+                self.fn.varargs.index,
+                self.text,
+                f"Non-external functions don't yet support variable arguments",
+            )
+
+        self.fn.fn = func
+
+        # Set the function's memory effect,
+        # either by way of a decorator or by inference from its body.
+
+        if not isinstance(node, External):
+            effect = self.decorator_context.get("effect", None)
+            if effect is None:
+                effect = self._infer_effect(node)
+            # Instrumented and tiered functions update their counters,
+            # so they always have side effects.
+            if self.profile or self.tiered:
+                effect = None
+            node.prototype.effect = effect
+            self._set_effect(func, effect)
+
+        if isinstance(node, External):
+            for a, b in zip(func.args, node.prototype.arguments):
+                # make sure the variable name is not in use
+                self._check_var_name(b, b.name)
+                # set the akinode attribute for the original argument,
+                # so it can be referenced if we need to throw an error
+                a.akitype = b.vartype.akitype
+                a.akinode = b
+            return func
+
+        # Generate entry block and function body.
+
+        self.entry_block = func.append_basic_block("entry")
+        self.fn.allocator = ir.IRBuilder(self.entry_block)
+
+        # Add prototype arguments to function symbol table
+        # and add references in function.
+        # Use isinstance(ir.Argument) to determine if the
+        # var being looked up is a func arg.
+
+        # Arguments only borrow their heap objects from the caller,
+        # unless they're assigned new ones. Then they own a reference,
+        # and take one for the object they were passed.
+
+        assigned = {
+            _.lhs.expr.name
+            for _ in node.body.walk()
+            if isinstance(_, Assignment) and isinstance(_.lhs.expr, Name)
+        }
+        owned_args = []
+
+        for a, b in zip(func.args, node.prototype.arguments):
+            # make sure the variable name is not in use
+            self._check_var_name(b, b.name)
+            # create an allocation for the variable
+            var_alloc = self._alloca(b, b.vartype.llvm_type, b.name)
+            # set its Aki attributes
+            a.akitype = b.vartype.akitype
+            var_alloc.akitype = b.vartype.akitype
+            var_alloc.akinode = b
             # set the akinode attribute for the original argument,
             # so it can be referenced if we need to throw an error
             a.akinode = b
@@ -723,6 +1829,9 @@ class AkiCodeGen:
             self.fn.symtab[b.name] = var_alloc
             # store the default value to the variable
             self.fn.allocator.store(a, var_alloc)
+            if b.name in assigned and self._is_heap_object(a.akitype):
+                self.fn.owners.append(var_alloc)
+                owned_args.append(a)
 
         # Add return value holder.
 
@@ -740,18 +1849,25 @@ class AkiCodeGen:
 
         self.fn.exit_block = func.append_basic_block("exit")
 
-        self.body_block = func.append_basic_block("body")
-        self.builder = ir.IRBuilder(self.body_block)
-        self.builder.position_at_start(self.body_block)
+        self.fn.body_block = func.append_basic_block("body")
+        self.builder = ir.IRBuilder(self.fn.body_block)
+        self.builder.position_at_start(self.fn.body_block)
+
+        self._profile_function(func)
+
+        for _ in owned_args:
+            self._retain(_)
+
+        if self.debug:
+            self.fn.debug_scope = self._debug_subprogram(func, node)
 
+        self._mark_tail_calls(node)
         result = self._codegen(node.body)
 
         # If we have an empty function body,
         # load the default value for the return type
         # and return that.
 
-        assert isinstance(result, ir.Instruction)
-
         if result is None:
             if self.fn.early_exit:
                 result = self._codegen(
@@ -790,15 +1906,11 @@ class AkiCodeGen:
             # Set the return type on the function's own signature
             func.ftype.return_type = r_type.llvm_type
 
-            # Set the Aki type node for the function
-            func.akitype.return_type = r_type
-
-            # The llvm_type node on the akitype node also needs to be set
-            func.akitype.llvm_type = func.type
-
-            # I know, the above is terrible and I deserve to be
-            # thrown into a pit of voles for writing it.
-            # I swear to Ptah I will fix it someday.
+            # Set the Aki type node for the function.
+            # Function types are interned and shared between functions,
+            # so we look up the type for the new signature
+            # instead of modifying the old one.
+            func.akitype = self.typemgr.as_func(func.akitype.arguments, r_type)
 
         # If the function prototype and return type still don't agree,
         # throw an exception
@@ -816,12 +1928,41 @@ class AkiCodeGen:
         # branch to exit, return the return value.
         self.builder.branch(self.fn.exit_block)
         self.builder.position_at_start(self.fn.exit_block)
-        self.builder.ret(self.builder.load(self.fn.return_value, ".ret"))
+
+        # The epilogue has no node of its own, so it takes the function's
+        # line; calls to the release helpers need a location to verify.
+
+        if self.fn.debug_scope is not None:
+            self.builder.debug_metadata = self._debug_location(node, None)
+        result = self.builder.load(self.fn.return_value, ".ret")
+        result.akitype = self.fn.return_value.akitype
+
+        # A heap object being returned gets a reference for the caller
+        # before the function lets go of its own objects.
+
+        if self._is_heap_object(self.fn.return_value.akitype):
+            self._retain(result)
+        self._release_owners(node)
+        self.builder.ret(result)
+
+        # Strings aren't known to be heap objects until their types are,
+        # so an inferred effect is dropped if the function turned out
+        # to count references.
+
+        if self.decorator_context.get("effect", None) is None and (
+            self.fn.owners or self._is_heap_object(self.fn.return_value.akitype)
+        ):
+            for _ in self.EFFECT_ATTRIBUTES.get(node.prototype.effect, ()):
+                func.attributes.discard(_)
+            node.prototype.effect = None
 
         # Add a branch from the allocator to the body block.
         # We have to do this after generating the body to ensure
         # it comes after all the other allocation instructions.
-        self.fn.allocator.branch(self.body_block)
+        if self.tiered:
+            self._tier_function(func)
+        else:
+            self.fn.allocator.branch(self.fn.body_block)
 
         # Reset function state handlers.
         self.fn = None
@@ -837,6 +1978,141 @@ class AkiCodeGen:
 
         return func
 
+    def _codegen_MultiFunction(self, node):
+        """
+        Register a function with versions for different argument types
+        from a `MultiFunction` node. The `with` versions are generated now;
+        the `default` version is generated as each call needs it.
+        """
+        self._check_var_name(node, node.name, True)
+
+        signatures = []
+        for _ in node.variants:
+            signature = tuple(
+                self._get_vartype(a.vartype) for a in _.prototype.arguments
+            )
+            if signature in signatures:
+                raise AkiSyntaxErr(
+                    _,
+                    self.text,
+                    f'Function "{CMD}{node.name}{REP}" has more than one version for these argument types',
+                )
+            signatures.append(signature)
+
+        self.typemgr.generics[node.name] = (node, self.text)
+
+        for variant, signature in zip(node.variants, signatures):
+            self._specialize(node, variant, signature)
+
+    def _specialize(self, node, variant, signature: tuple):
+        """
+        Generate a version of a function for a signature,
+        unless it's already been generated, and return its name.
+        Arguments without a declared type take the type from the signature.
+        """
+        name = f"{node.name}[{','.join(_.type_id for _ in signature)}]"
+        key = (node.name, tuple(_.type_id for _ in signature))
+
+        # A version generated for another module is linked in,
+        # if that module is still around.
+
+        if key in self.typemgr.specializations:
+            try:
+                self._name(node, name)
+                return name
+            except AkiNameErr:
+                pass
+        self.typemgr.specializations[key] = name
+
+        func = copy.deepcopy(variant)
+        func.prototype.name = name
+        for arg, akitype in zip(func.prototype.arguments, signature):
+            if arg.vartype is None:
+                arg.vartype = akitype
+
+        # Generate the function as if it were declared on its own,
+        # with the text of its declaration for any error messages.
+
+        outer = (
+            self.fn,
+            getattr(self, "builder", None),
+            getattr(self, "entry_block", None),
+            self.text,
+        )
+        outer_decorators = self.decorator_context
+        self.decorator_context = {}
+        self.text = self.typemgr.generics[node.name][1]
+        try:
+            self._codegen(func)
+        except AkiBaseErr:
+            del self.typemgr.specializations[key]
+            self.module.globals.pop(name, None)
+            raise
+        finally:
+            self.fn, self.builder, self.entry_block, self.text = outer
+            self.decorator_context = outer_decorators
+
+        return name
+
+    def _codegen_generic_call(self, node, generic):
+        """
+        Generate a call to a function with versions for different
+        argument types, choosing or generating the version for the types
+        of the arguments in the call.
+        """
+        args = [self._codegen(_) for _ in node.arguments]
+        for arg, value in zip(node.arguments, args):
+            self._is_type(arg, value, AkiType)
+        signature = tuple(_.akitype for _ in args)
+
+        # A `with` version matches if the arguments have its types,
+        # and any arguments not in the call have defaults.
+
+        for variant in generic.variants:
+            arguments = variant.prototype.arguments
+            declared = tuple(self._get_vartype(_.vartype) for _ in arguments)
+            if len(signature) <= len(declared) and (
+                declared[: len(signature)] == signature
+                and all(_.default_value for _ in arguments[len(signature) :])
+            ):
+                name = self._specialize(generic, variant, declared)
+                break
+
+        else:
+            if generic.default is None:
+                raise AkiTypeErr(
+                    node,
+                    self.text,
+                    f'No version of "{CMD}{node.name}{REP}" takes arguments of types ({CMD}{", ".join(str(_) for _ in signature)}{REP})',
+                )
+            arguments = generic.default.prototype.arguments
+            if len(signature) > len(arguments):
+                raise AkiSyntaxErr(
+                    node,
+                    self.text,
+                    f'Function call to "{CMD}{node.name}{REP}" expected {CMD}{len(arguments)}{REP} arguments but got {CMD}{len(signature)}{REP}',
+                )
+            for arg, arg_node, value in zip(arguments, node.arguments, args):
+                if (
+                    arg.vartype is not None
+                    and self._get_vartype(arg.vartype) != value.akitype
+                ):
+                    raise AkiTypeErr(
+                        arg_node,
+                        self.text,
+                        f'Value "{CMD}{arg.name}{REP}" must be of type "{CMD}{self._get_vartype(arg.vartype)}{REP}", not "{CMD}{value.akitype}{REP}"',
+                    )
+            name = self._specialize(generic, generic.default, signature)
+
+        call = Call(
+            node.index,
+            name,
+            [LLVMNode(a, None, v) for a, v in zip(node.arguments, args)],
+            None,
+        )
+        call.tail_call = getattr(node, "tail_call", False)
+        return self._codegen(call)
+
     #################################################################
     # Blocks
     #################################################################
@@ -863,10 +2139,10 @@ class AkiCodeGen:
         Codegen a `with` block.
         """
 
+        self._scope_enter()
         self._codegen(node.varlist)
-        body = self._codegen(node.body)
-        for _ in node.varlist.vars:
-            self._delete_var(_.name)
+        body = self._temporary(node, self._codegen(node.body))
+        self._scope_exit()
         return body
 
     #################################################################
@@ -879,6 +2155,23 @@ class AkiCodeGen:
     def _codegen_UniList(self, node):
         return self._codegen_VarList(node, True)
 
+    def _codegen_StructDeclaration(self, node):
+        """
+        Register a structure type from a `StructDeclaration` node.
+        """
+        if self._get_type_by_name(node.name) is not None:
+            raise AkiTypeErr(
+                node, self.text, f'Type "{CMD}{node.name}{REP}" is already defined'
+            )
+
+        return self.types["struct"].new(
+            self,
+            node,
+            packed=self.decorator_context.get("packed", False),
+            align=self.decorator_context.get("align", None),
+            reorder=self.decorator_context.get("reorder", False),
+        )
+
     def _codegen_VarList(self, node, is_uni: bool = False, is_const: bool = False):
         """
         Codegen the variables in a `VarList` node.
@@ -901,8 +2194,39 @@ class AkiCodeGen:
                     _.vartype = Name(_.index, self.typemgr._default.type_id)
 
                 _.akitype = self._get_vartype(_.vartype)
-                _.val = Constant(_.index, _.akitype.default(self, node), _.vartype)
-                value = _.val
+
+                # Arrays with computed dimensions are allocated here,
+                # unless they're declared with `*` for every dimension
+
+                if isinstance(_.akitype, AkiHeapArray) and not all(
+                    isinstance(d, AnyDimension) for d in _.vartype.accessors.accessors
+                ):
+                    if is_uni:
+                        raise AkiTypeErr(
+                            _.vartype,
+                            self.text,
+                            "Global arrays can't have computed dimensions",
+                        )
+                    value = LLVMNode(
+                        _,
+                        _.vartype,
+                        _.akitype.allocate(self, _, _.vartype.accessors.accessors),
+                    )
+                elif isinstance(_.akitype, AkiList):
+                    if is_uni:
+                        raise AkiTypeErr(
+                            _.vartype, self.text, "Lists can't be global variables"
+                        )
+                    value = LLVMNode(_, _.vartype, _.akitype.allocate(self, _))
+                elif isinstance(_.akitype, AkiMap):
+                    if is_uni:
+                        raise AkiTypeErr(
+                            _.vartype, self.text, "Maps can't be global variables"
+                        )
+                    value = LLVMNode(_, _.vartype, _.akitype.allocate(self, _))
+                else:
+                    _.val = Constant(_.index, _.akitype.default(self, node), _.vartype)
+                    value = _.val
 
             else:
 
@@ -936,7 +2260,17 @@ class AkiCodeGen:
                 if is_const:
                     var_ptr.global_constant = True
             else:
-                var_ptr = self._alloca(_, _.akitype.llvm_type, _.name)
+                var_ptr = self._alloca(
+                    _,
+                    _.akitype.llvm_type,
+                    _.name,
+                    is_heap=self._is_heap_object(_.akitype),
+                    is_scoped=True,
+                )
+
+            # Structures can ask for more than their natural alignment
+            if _.akitype.align is not None:
+                var_ptr.align = _.akitype.align
 
             # Store its node attributes
             var_ptr.akitype = _.akitype
@@ -978,6 +2312,12 @@ class AkiCodeGen:
         if builtin:
             return builtin(node)
 
+        # check if this is a function with versions for different types
+
+        generic = self.typemgr.generics.get(node.name, None)
+        if generic is not None:
+            return self._codegen_generic_call(node, generic[0])
+
         # check if this is a request for a type
         # this will eventually go somewhere else
 
@@ -1015,37 +2355,10 @@ class AkiCodeGen:
             # If this is a function pointer ...
 
             if isinstance(call_func, ir.AllocaInstr):
+                return self._codegen_pointer_call(node, call_func)
 
-                # get the actual function reference
-                func_type_id = call_func.akitype.type_id
-                load_call_func = self.builder.load(call_func)
-
-                # set the name to use for the call
-                final_call_func = load_call_func
-
-                # set the description to use in the call
-                call_func_name = node.name
-
-                # use the type ID for the function to get a signature
-                # that we can use for checking the arguments.
-                # Note that this means checks for things like mandatory
-                # arguments are NOT going to work, because that isn't
-                # part of the type signature as we currently have it
-                # (although eventually it will be)
-
-                original_call_func = self._get_type_by_name(
-                    func_type_id
-                ).original_function
-                if original_call_func is None:
-                    raise AkiTypeErr(
-                        node,
-                        self.text,
-                        f'"{CMD}{node.name}{REP}" is "{CMD}{call_func.akitype}{REP}", not a function',
-                    )
-                call_func = original_call_func
-            else:
-                call_func_name = call_func.name
-                final_call_func = call_func
+            call_func_name = call_func.name
+            final_call_func = call_func
 
             # If we have too many arguments,
             # and we're not processing a vararg function, give up
@@ -1115,45 +2428,153 @@ class AkiCodeGen:
                 f'Function call to "{CMD}{node.name}{REP}" expected {CMD}{len(call_func.args)}{REP} arguments but got {CMD}{len(node.arguments)}{REP}\n{args}',
             )
 
-        call = self.builder.call(final_call_func, args, call_func_name + ".call")
+        # Heap objects owned by this function are released on the way out,
+        # after any call, so there are no tail calls once there are any.
+
+        tail_call = getattr(node, "tail_call", False) and not self.fn.owners
+
+        # A direct self-recursive call in tail position
+        # becomes a jump back to the top of the function body.
+
+        if tail_call and final_call_func is self.fn.fn:
+            return self._codegen_self_tail_call(node, call_func, args)
+
+        call = self.builder.call(
+            final_call_func, args, call_func_name + ".call", tail=tail_call
+        )
         call.akitype = call_func.akitype.return_type
         call.akinode = call_func.akinode
-        return call
 
-    def _codegen_Break(self, node):
+        # Results of tail calls are returned immediately,
+        # so the call is directly followed by the `ret`.
+
+        if tail_call:
+            self._check_return_type(node, call)
+            self.builder.ret(call)
+            self._unreachable_block()
+            return call
+
+        # A heap object returned from a call comes with a reference
+        # for the caller, which is kept until it's stored elsewhere.
+
+        return self._temporary(node, call, adopt=True)
+
+    def _codegen_pointer_call(self, node, ptr):
         """
-        Codegen a `break` action.
+        Generate a call through a function pointer variable.
+        Any function with the pointer's signature could be called,
+        so the arguments are checked against the signature alone,
+        and none of them can be left out for a default.
         """
+        akitype = ptr.akitype
+        if not isinstance(akitype, AkiFunction):
+            raise AkiTypeErr(
+                node,
+                self.text,
+                f'"{CMD}{node.name}{REP}" is "{CMD}{akitype}{REP}", not a function',
+            )
 
-        if not self.fn.breakpoints:
+        arg_types = [_.akitype for _ in akitype.arguments]
+        if len(node.arguments) != len(arg_types):
+            args = "\n".join(
+                [f"arg {index+1} = {CMD}{_}{REP}" for index, _ in enumerate(arg_types)]
+            )
             raise AkiSyntaxErr(
-                node, self.text, f'"break" not called within a loop block'
+                node,
+                self.text,
+                f'Function call to "{CMD}{node.name}{REP}" expected {CMD}{len(arg_types)}{REP} arguments but got {CMD}{len(node.arguments)}{REP}\n{args}',
             )
 
-        self.builder.branch(self.fn.breakpoints[-1])
+        args = []
+        for index, (arg, arg_type) in enumerate(zip(node.arguments, arg_types)):
+            arg_val = self._codegen(arg)
+            if arg_val.type != arg_type.llvm_type:
+                raise AkiTypeErr(
+                    arg,
+                    self.text,
+                    f'Value "{CMD}{arg.name}{REP}" of type "{CMD}{arg_val.akitype}{REP}" does not match {CMD}{node.name}{REP} argument {CMD}{index+1}{REP} of type "{CMD}{arg_type}{REP}"',
+                )
+            args.append(arg_val)
 
-    def _codegen_WhileExpr(self, node):
+        tail_call = getattr(node, "tail_call", False) and not self.fn.owners
+
+        call = self.builder.call(
+            self.builder.load(ptr), args, node.name + ".call", tail=tail_call
+        )
+        call.akitype = akitype.return_type
+        call.akinode = ptr.akinode
+
+        if tail_call:
+            self._check_return_type(node, call)
+            self.builder.ret(call)
+            self._unreachable_block()
+            return call
+
+        return self._temporary(node, call, adopt=True)
+
+    def _codegen_self_tail_call(self, node, call_func, args):
         """
-        Codegen a `while` expression.
-        This is essentially a loop with only a conditional block.
-        We will eventually merge this with the `loop` codegen.
+        Generate a self-recursive tail call as a loop:
+        the new argument values replace the old ones,
+        and we branch back to the start of the function body.
         """
 
-        loop_cond = self.builder.append_basic_block("loop_cond")
+        for arg_val, arg in zip(args, call_func.akinode.arguments):
+            self.builder.store(arg_val, self.fn.symtab[arg.name])
+        self.builder.branch(self.fn.body_block)
+        self._unreachable_block()
+
+        # The call never yields a value at this point in the code,
+        # but the expression it's part of still needs one.
+
+        result = ir.Constant(call_func.ftype.return_type, ir.Undefined)
+        result.akitype = call_func.akitype.return_type
+        result.akinode = call_func.akinode
+        return result
+
+    def _codegen_Break(self, node):
+        """
+        Codegen a `break` action.
+        """
+
+        if not self.fn.breakpoints:
+            raise AkiSyntaxErr(
+                node, self.text, f'"break" not called within a loop block'
+            )
+
+        self.builder.branch(self.fn.breakpoints[-1])
+        self._unreachable_block()
+
+    def _codegen_WhileExpr(self, node):
+        """
+        Codegen a `while` expression.
+        This is essentially a loop with only a conditional block.
+        We will eventually merge this with the `loop` codegen.
+        """
+
+        unroll = self.decorator_context.get("unroll", None)
+        self.decorator_context["unroll"] = None
+
+        loop_cond = self.builder.append_basic_block("loop_cond")
         loop_body = self.builder.append_basic_block("loop_body")
         loop_exit = self.builder.append_basic_block("loop_exit")
 
         self.builder.branch(loop_cond)
         self.builder.position_at_start(loop_cond)
         while_test = self._codegen(node.while_value)
-        self.builder.cbranch(while_test, loop_body, loop_exit)
+        self._cbranch(node, while_test, loop_body, loop_exit)
         self.builder.position_at_start(loop_body)
         self.fn.breakpoints.append(loop_exit)
-        while_body = self._codegen(node.while_expr)
+        self._scope_enter()
+        while_body = self._temporary(node, self._codegen(node.while_expr))
         while_result = self.fn.allocator.alloca(while_body.type)
         self.builder.store(while_body, while_result)
-        self.builder.branch(loop_cond)
+        body_slots = self._scope_exit()
+        branch = self.builder.branch(loop_cond)
+        if unroll is not None:
+            self._loop_metadata(branch, unroll)
         self.builder.position_at_start(loop_exit)
+        self._lifetime_end(body_slots)
         self.fn.breakpoints.pop()
 
         while_result = self.builder.load(while_result)
@@ -1169,7 +2590,28 @@ class AkiCodeGen:
         Codegen a `loop` expression.
         """
 
-        local_symtab = {}
+        # Loop hints only apply to this loop, not loops nested in it.
+
+        unroll = self.decorator_context.get("unroll", None)
+        self.decorator_context["unroll"] = None
+
+        parallel = self.decorator_context.get("parallel", None)
+        if parallel is not None:
+            if unroll is not None:
+                raise AkiSyntaxErr(
+                    unroll,
+                    self.text,
+                    f'"{CMD}{unroll.name}{REP}" can\'t be used on a "{CMD}parallel{REP}" loop',
+                )
+            # Loops nested in a parallel loop run as normal loops.
+            self.decorator_context["parallel"] = None
+            result = self._codegen_parallel_loop(node, parallel)
+            self.decorator_context["parallel"] = parallel
+            return result
+
+        # The loop gets its own scope for any loop variables.
+
+        self._scope_enter()
 
         # If there are no elements in the loop declaration,
         # assume an infinite loop
@@ -1205,14 +2647,11 @@ class AkiCodeGen:
             self.builder.position_at_start(loop_init)
 
             # if the first element is a varlist,
-            # instantiate each variable in the symbol table,
-            # and keep a copy for ourselves so we can
-            # delete it later.
+            # instantiate each variable in the loop's own scope,
+            # so it's removed when the loop exits.
 
             if isinstance(start, VarList):
                 self._codegen(start)
-                for _ in start.vars:
-                    local_symtab[_.name] = self.fn.symtab[_.name]
 
             # If the first element is just an assignment node,
             # then codegen assignments to the function symbol table.
@@ -1240,14 +2679,19 @@ class AkiCodeGen:
             loop = self.builder.append_basic_block("loop")
             loop_exit = self.builder.append_basic_block("loop_exit")
             self.fn.breakpoints.append(loop_exit)
-            self.builder.cbranch(loop_condition, loop, loop_exit)
+            self._cbranch(node, loop_condition, loop, loop_exit)
             self.builder.position_at_start(loop)
-            loop_body = self._codegen(node.body)
+            # Variables declared in the loop body are scoped
+            # to a single iteration of the loop.
+            self._scope_enter()
+            loop_body = self._temporary(node, self._codegen(node.body))
             loop_result = self.fn.allocator.alloca(loop_body.type)
             self.builder.store(loop_body, loop_result)
+            body_slots = self._scope_exit()
             self._codegen(Assignment(step, "+", ObjectRef(step, step.lhs), step))
-            self.builder.branch(loop_test)
+            branch = self.builder.branch(loop_test)
             self.builder.position_at_start(loop_exit)
+            self._lifetime_end(body_slots)
             self.fn.breakpoints.pop()
 
         else:
@@ -1259,17 +2703,24 @@ class AkiCodeGen:
             self.fn.breakpoints.append(loop_exit)
             self.builder.branch(loop)
             self.builder.position_at_start(loop)
-            loop_body = self._codegen(node.body)
+            # Variables declared in the loop body are scoped
+            # to a single iteration of the loop.
+            self._scope_enter()
+            loop_body = self._temporary(node, self._codegen(node.body))
             loop_result = self.fn.allocator.alloca(loop_body.type)
             self.builder.store(loop_body, loop_result)
-            self.builder.branch(loop)
+            body_slots = self._scope_exit()
+            branch = self.builder.branch(loop)
             self.builder.position_at_start(loop_exit)
+            self._lifetime_end(body_slots)
             self.fn.breakpoints.pop()
 
+        if unroll is not None:
+            self._loop_metadata(branch, unroll)
+
         # Remove local objects from symbol table
 
-        for _ in local_symtab:
-            self._delete_var(_)
+        self._scope_exit()
 
         # Load and decorate results
 
@@ -1280,6 +2731,472 @@ class AkiCodeGen:
         loop_result.akinode.name = '"loop" expr'
         return loop_result
 
+    def _parallel_options(self, decorator):
+        """
+        Read the options for a `parallel` loop from its decorator.
+        Any argument that isn't a scheduling option
+        names a variable to reduce with an operator.
+        """
+
+        options = {
+            "schedule": "static",
+            "chunk": None,
+            "threads": self.threads or os.cpu_count() or 1,
+        }
+        reductions = {}
+
+        for _ in decorator.args:
+            if not isinstance(_, Argument):
+                raise AkiSyntaxErr(
+                    _, self.text, f'Options for "{CMD}parallel{REP}" must be named'
+                )
+            value = _.default_value
+            if _.name == "schedule":
+                if not isinstance(value, String) or value.val not in (
+                    "static",
+                    "dynamic",
+                ):
+                    raise AkiSyntaxErr(
+                        _,
+                        self.text,
+                        f'"{CMD}schedule{REP}" must be "{CMD}static{REP}" or "{CMD}dynamic{REP}"',
+                    )
+                options["schedule"] = value.val
+            elif _.name in ("chunk", "threads"):
+                if not isinstance(value, Constant) or not (
+                    isinstance(value.val, int) and value.val > 0
+                ):
+                    raise AkiSyntaxErr(
+                        _,
+                        self.text,
+                        f'"{CMD}{_.name}{REP}" must be a constant greater than zero',
+                    )
+                options[_.name] = value.val
+            else:
+                if not isinstance(value, String) or value.val not in ("+", "*"):
+                    raise AkiSyntaxErr(
+                        _,
+                        self.text,
+                        f'Reduction for "{CMD}{_.name}{REP}" must be "{CMD}+{REP}" or "{CMD}*{REP}"',
+                    )
+                reductions[_.name] = value.val
+
+        return options, reductions
+
+    def _codegen_parallel_loop(self, node, decorator):
+        """
+        Codegen a `loop` whose iterations are split across threads.
+        The loop body is outlined into a worker function, which each
+        thread runs on its share of the iterations. The calling thread
+        runs the first share itself, then waits for the others.
+        Local variables used in the body are shared by reference,
+        except for reduction variables: each thread accumulates its own
+        copy, and the copies are combined when all threads are done.
+        The result of the loop is the number of iterations run.
+        """
+
+        options, reductions = self._parallel_options(decorator)
+        threads = options["threads"]
+
+        # Only loops of the form `loop (var i=start, i<stop, i+step)`
+        # have a trip count that can be divided up in advance.
+
+        start, stop, step = node.conditions or (None, None, None)
+
+        if not isinstance(start, VarList) or len(start.vars) != 1:
+            raise AkiSyntaxErr(
+                node,
+                self.text,
+                f'"{CMD}parallel{REP}" loops must declare a single loop variable',
+            )
+
+        loop_var = start.vars[0].name
+
+        if not (
+            isinstance(stop, BinOpComparison)
+            and stop.op == "<"
+            and isinstance(stop.lhs, Name)
+            and stop.lhs.name == loop_var
+        ):
+            raise AkiSyntaxErr(
+                stop,
+                self.text,
+                f'"{CMD}parallel{REP}" loops must test "{CMD}{loop_var} < ...{REP}"',
+            )
+
+        if not (
+            isinstance(step, BinOp)
+            and step.op == "+"
+            and isinstance(step.lhs, Name)
+            and step.lhs.name == loop_var
+            and isinstance(step.rhs, Constant)
+            and int(step.rhs.val) > 0
+        ):
+            raise AkiSyntaxErr(
+                step,
+                self.text,
+                f'"{CMD}parallel{REP}" loops must step by a constant "{CMD}{loop_var} + n{REP}"',
+            )
+
+        for _ in node.body.walk():
+            if isinstance(_, (Break, Return)):
+                raise AkiSyntaxErr(
+                    _,
+                    self.text,
+                    f'"{CMD}break{REP}" and "{CMD}return{REP}" can\'t be used in a "{CMD}parallel{REP}" loop',
+                )
+
+        # Compute the trip count in the caller.
+
+        self._scope_enter()
+        self._codegen(start)
+        start_val = self._codegen(Name(start, loop_var))
+        index_type = start_val.akitype
+
+        if not isinstance(index_type, AkiBaseInt):
+            raise AkiTypeErr(
+                start.vars[0],
+                self.text,
+                f'"{CMD}parallel{REP}" loop variable must be an integer',
+            )
+
+        stop_val = self._codegen(stop.rhs)
+        if stop_val.akitype != index_type:
+            raise AkiTypeErr(
+                stop.rhs,
+                self.text,
+                f"Loop limit ({CMD}{stop_val.akitype}{REP}) does not match loop variable ({CMD}{index_type}{REP})",
+            )
+
+        # Iterations are counted as `u_size`, whatever the type
+        # of the loop variable, so the count can't overflow it.
+
+        compare = getattr(self.builder, index_type.comp_ins)
+        size_type = self.types["u_size"].llvm_type
+        stride = ir.Constant(size_type, int(step.rhs.val))
+        zero = ir.Constant(size_type, 0)
+        one = ir.Constant(size_type, 1)
+
+        span = self.builder.sub(self._as_size(stop_val), self._as_size(start_val))
+        trips = self.builder.udiv(
+            self.builder.add(span, self.builder.sub(stride, one)), stride
+        )
+        trips = self.builder.select(compare("<", start_val, stop_val), trips, zero)
+
+        # Each chunk is a run of consecutive iterations.
+        # With static scheduling, the chunks are dealt out to threads
+        # in turn; by default each thread gets one chunk.
+        # With dynamic scheduling, threads take the next free chunk
+        # as they finish the previous one.
+
+        if options["chunk"] is not None:
+            chunk = ir.Constant(size_type, options["chunk"])
+        elif options["schedule"] == "dynamic":
+            chunk = one
+        else:
+            chunk = self.builder.udiv(
+                self.builder.add(trips, ir.Constant(size_type, threads - 1)),
+                ir.Constant(size_type, threads),
+            )
+            chunk = self.builder.select(
+                self.builder.icmp_unsigned(">", chunk, zero), chunk, one
+            )
+
+        self._scope_exit()
+
+        # Find the variables the body shares with the enclosing function.
+
+        for _ in reductions:
+            if _ not in self.fn.symtab:
+                raise AkiNameErr(
+                    decorator,
+                    self.text,
+                    f'Reduction variable "{CMD}{_}{REP}" must be a local variable',
+                )
+
+        shared = []
+        for _ in node.body.walk():
+            if (
+                isinstance(_, (Name, Call))
+                and _.name in self.fn.symtab
+                and _.name != loop_var
+                and _.name not in reductions
+                and _.name not in shared
+            ):
+                shared.append(_.name)
+
+        shared_vars = [self.fn.symtab[_] for _ in shared]
+        reduction_vars = [self.fn.symtab[_] for _ in reductions]
+
+        # The context shared by all threads:
+        # start, trip count, chunk size, next free chunk,
+        # pointers to shared variables,
+        # and pointers to each reduction's per-thread results.
+
+        context_type = ir.LiteralStructType(
+            [index_type.llvm_type]
+            + [size_type] * 3
+            + [_.type for _ in shared_vars]
+            + [
+                ir.ArrayType(_.type.pointee, threads).as_pointer()
+                for _ in reduction_vars
+            ]
+        )
+        thread_arg_type = ir.LiteralStructType(
+            [context_type.as_pointer(), ir.IntType(32)]
+        )
+
+        worker = self._parallel_worker(
+            node,
+            options,
+            loop_var,
+            index_type,
+            context_type,
+            thread_arg_type,
+            shared,
+            shared_vars,
+            reductions,
+            reduction_vars,
+            int(step.rhs.val),
+        )
+
+        context = self._alloca(node, context_type, ".parallel.context")
+        for index, value in enumerate([start_val, trips, chunk, zero] + shared_vars):
+            self.builder.store(value, self.builder.gep(context, [_int(0), _int(index)]))
+
+        partials = []
+        for index, _ in enumerate(reduction_vars):
+            partial = self._alloca(
+                node, ir.ArrayType(_.type.pointee, threads), ".parallel.partial"
+            )
+            self.builder.store(
+                partial,
+                self.builder.gep(
+                    context, [_int(0), _int(4 + len(shared_vars) + index)]
+                ),
+            )
+            partials.append(partial)
+
+        thread_args = self._alloca(
+            node, ir.ArrayType(thread_arg_type, threads), ".parallel.args"
+        )
+        u_mem_ptr = self.types["u_mem"].llvm_type.as_pointer()
+
+        def thread_arg(thread):
+            arg = self.builder.gep(thread_args, [_int(0), _int(thread)])
+            self.builder.store(context, self.builder.gep(arg, [_int(0), _int(0)]))
+            self.builder.store(_int(thread), self.builder.gep(arg, [_int(0), _int(1)]))
+            arg = self.builder.bitcast(arg, u_mem_ptr)
+            arg.akitype = self.typemgr.as_ptr(self.types["u_mem"])
+            return LLVMNode(node, None, arg)
+
+        worker_ptr = self.builder.bitcast(worker, u_mem_ptr)
+        worker_ptr.akitype = self.typemgr.as_ptr(self.types["u_mem"])
+        worker_ptr = LLVMNode(node, None, worker_ptr)
+
+        handles = [
+            self._codegen(Call(node, "thread_start", [worker_ptr, thread_arg(_)], None))
+            for _ in range(1, threads)
+        ]
+        self.builder.call(worker, [thread_arg(0).llvm_node])
+        for _ in handles:
+            self._codegen(Call(node, "thread_join", [LLVMNode(node, None, _)], None))
+
+        # Combine the per-thread results of each reduction.
+
+        for var, partial, op in zip(reduction_vars, partials, reductions.values()):
+            akitype = var.akitype
+            math_op = getattr(akitype, "bin_ops", {}).get(op, None)
+            if math_op is None:
+                raise AkiOpError(
+                    decorator,
+                    self.text,
+                    f'Binary operator "{CMD}{op}{REP}" not found for type "{CMD}{akitype}{REP}"',
+                )
+            instr_call = getattr(akitype.__class__, f"binop_{math_op}")
+            value = self.builder.load(var)
+            for _ in range(threads):
+                result = self.builder.load(
+                    self.builder.gep(partial, [_int(0), _int(_)])
+                )
+                value = instr_call(akitype, self, node, value, result, op)
+            self.builder.store(value, var)
+
+        # The count is returned as the type of the loop variable.
+
+        if index_type.llvm_type.width < size_type.width:
+            trips = self.builder.trunc(trips, index_type.llvm_type)
+        trips.akitype = index_type
+        trips.akinode = node
+        node.vartype = index_type.type_id
+        node.name = '"loop" expr'
+        return trips
+
+    def _parallel_worker(
+        self,
+        node,
+        options,
+        loop_var,
+        index_type,
+        context_type,
+        thread_arg_type,
+        shared,
+        shared_vars,
+        reductions,
+        reduction_vars,
+        step,
+    ):
+        """
+        Outline the body of a `parallel` loop into a worker function,
+        which runs chunks of iterations until none are left.
+        """
+
+        # Save the state of the enclosing function.
+
+        outer = self.fn, self.builder, self.entry_block
+
+        u_mem_ptr = self.types["u_mem"].llvm_type.as_pointer()
+        worker = ir.Function(
+            self.module,
+            ir.FunctionType(ir.IntType(32), [u_mem_ptr]),
+            f"{self.fn.fn.name}.parallel.{self._const_counter()}",
+        )
+        worker.linkage = "internal"
+
+        self.fn = FuncState()
+        self.fn.fn = worker
+        self.fn.threaded = True
+        self.entry_block = worker.append_basic_block("entry")
+        self.fn.allocator = ir.IRBuilder(self.entry_block)
+        self.fn.body_block = worker.append_basic_block("body")
+        self.builder = ir.IRBuilder(self.fn.body_block)
+
+        if self.debug:
+            self.fn.debug_scope = self._debug_subprogram(worker, node)
+            self.builder.debug_metadata = self._debug_location(node, None)
+
+        llvm_type = index_type.llvm_type
+        size_type = self.types["u_size"].llvm_type
+        compare = self.builder.icmp_unsigned
+
+        thread_arg = self.builder.bitcast(worker.args[0], thread_arg_type.as_pointer())
+        context = self.builder.load(self.builder.gep(thread_arg, [_int(0), _int(0)]))
+        thread = self.builder.load(self.builder.gep(thread_arg, [_int(0), _int(1)]))
+
+        def field(index):
+            return self.builder.gep(context, [_int(0), _int(index)])
+
+        start = self.builder.load(field(0))
+        trips = self.builder.load(field(1))
+        chunk = self.builder.load(field(2))
+
+        # Shared variables are accessed through pointers
+        # to the enclosing function's variables.
+
+        for index, (name, var) in enumerate(zip(shared, shared_vars)):
+            ref = self.builder.load(field(4 + index))
+            ref.akitype = var.akitype
+            ref.akinode = var.akinode
+            self.fn.symtab[name] = ref
+
+        # Reductions accumulate into a variable private to the thread.
+
+        private_vars = []
+        for name, var in zip(reductions, reduction_vars):
+            identity = 0 if reductions[name] == "+" else 1
+            private = self.fn.allocator.alloca(var.type.pointee, None, name)
+            self.builder.store(ir.Constant(var.type.pointee, identity), private)
+            private.akitype = var.akitype
+            private.akinode = var.akinode
+            self.fn.symtab[name] = private
+            private_vars.append(private)
+
+        index_var = self.fn.allocator.alloca(llvm_type, None, loop_var)
+        index_var.akitype = index_type
+        index_var.akinode = node.conditions[0].vars[0]
+        self.fn.symtab[loop_var] = index_var
+
+        # Chunk loop: find the next chunk for this thread.
+        # Chunks and iterations are counted as `u_size`.
+
+        current = self.fn.allocator.alloca(size_type, None, ".chunk")
+        if options["schedule"] == "static":
+            thread_index = self.builder.zext(thread, size_type)
+            self.builder.store(self.builder.mul(thread_index, chunk), current)
+            chunk_stride = self.builder.mul(
+                chunk, ir.Constant(size_type, options["threads"])
+            )
+
+        chunk_test = self.builder.append_basic_block("chunk_test")
+        chunk_body = self.builder.append_basic_block("chunk_body")
+        iter_test = self.builder.append_basic_block("iter_test")
+        iter_body = self.builder.append_basic_block("iter_body")
+        iter_exit = self.builder.append_basic_block("iter_exit")
+        chunk_exit = self.builder.append_basic_block("chunk_exit")
+
+        self.builder.branch(chunk_test)
+        self.builder.position_at_start(chunk_test)
+        if options["schedule"] == "static":
+            chunk_start = self.builder.load(current)
+        else:
+            chunk_start = self.builder.atomic_rmw("add", field(3), chunk, "monotonic")
+        self.builder.cbranch(compare("<", chunk_start, trips), chunk_body, chunk_exit)
+
+        self.builder.position_at_start(chunk_body)
+        chunk_end = self.builder.add(chunk_start, chunk)
+        chunk_end = self.builder.select(
+            compare("<", chunk_end, trips), chunk_end, trips
+        )
+        counter = self.fn.allocator.alloca(size_type, None, ".iter")
+        self.builder.store(chunk_start, counter)
+        self.builder.branch(iter_test)
+
+        # Iteration loop: run the body for each iteration in the chunk.
+
+        self.builder.position_at_start(iter_test)
+        iteration = self.builder.load(counter)
+        self.builder.cbranch(compare("<", iteration, chunk_end), iter_body, iter_exit)
+
+        self.builder.position_at_start(iter_body)
+        if llvm_type.width < size_type.width:
+            iteration = self.builder.trunc(iteration, llvm_type)
+        self.builder.store(
+            self.builder.add(
+                start, self.builder.mul(iteration, ir.Constant(llvm_type, step))
+            ),
+            index_var,
+        )
+        self._scope_enter()
+        self._codegen(node.body)
+        body_slots = self._scope_exit()
+        self.builder.store(
+            self.builder.add(self.builder.load(counter), ir.Constant(size_type, 1)),
+            counter,
+        )
+        self.builder.branch(iter_test)
+
+        self.builder.position_at_start(iter_exit)
+        self._lifetime_end(body_slots)
+        if options["schedule"] == "static":
+            self.builder.store(self.builder.add(chunk_start, chunk_stride), current)
+        self.builder.branch(chunk_test)
+
+        # Store this thread's reduction results.
+
+        self.builder.position_at_start(chunk_exit)
+        for index, private in enumerate(private_vars):
+            partial = self.builder.load(field(4 + len(shared) + index))
+            self.builder.store(
+                self.builder.load(private),
+                self.builder.gep(partial, [_int(0), thread]),
+            )
+        self._release_owners(node)
+        self.builder.ret(_int(0))
+        self.fn.allocator.branch(self.fn.body_block)
+
+        self.fn, self.builder, self.entry_block = outer
+        return worker
+
     def _codegen_IfExpr(self, node, is_when_expr=False):
         """
         Codegen an `if` or `when` expression, where then and else return values are of the same type. The `then/else` nodes are raw AST nodes.
@@ -1287,6 +3204,9 @@ class AkiCodeGen:
         to get a vartype.
         """
 
+        expect = self.decorator_context.get("expect", None)
+        self.decorator_context["expect"] = None
+
         if_expr = self._codegen(node.if_expr)
 
         if not self._is_type(node.if_expr, if_expr, AkiBool):
@@ -1300,9 +3220,9 @@ class AkiCodeGen:
         exit_block = self.builder.append_basic_block(".endif")
 
         if node.else_expr:
-            self.builder.cbranch(if_expr, then_block, else_block)
+            self._cbranch(node, if_expr, then_block, else_block, expect)
         else:
-            self.builder.cbranch(if_expr, then_block, exit_block)
+            self._cbranch(node, if_expr, then_block, exit_block, expect)
 
         self.builder.position_at_start(then_block)
 
@@ -1366,9 +3286,19 @@ class AkiCodeGen:
         switch_node = self.builder.switch(value, default_block)
         exit_block = self.builder.append_basic_block(".select_exit")
 
+        # Each case (and the default) is profiled
+        # by counting entries to its block.
+
+        self.fn.branches += 1
+        key = f"{self.fn.fn.name}:{self.fn.branches}:{node.index}"
+        keys = [f"{key}:default"]
+
         for index, _ in enumerate(node.case_list):
             case_block = self.builder.append_basic_block(f".select_{index}")
             self.builder.position_at_start(case_block)
+            keys.append(f"{key}:{index}")
+            if self.profile:
+                self._profile_count(keys[-1])
             case_value = self._codegen(_.case_value)
             if not isinstance(case_value, ir.Constant) and not isinstance(
                 case_value.type, ir.IntType
@@ -1389,7 +3319,13 @@ class AkiCodeGen:
             self._codegen(_.case_expr)
             self.builder.branch(exit_block)
 
+        weights = [self.profile_data.get(_, None) for _ in keys]
+        if None not in weights:
+            switch_node.set_metadata("prof", self._branch_weights(weights))
+
         self.builder.position_at_start(default_block)
+        if self.profile:
+            self._profile_count(keys[0])
         if node.default_case:
             self._codegen(node.default_case.case_expr)
         self.builder.branch(exit_block)
@@ -1472,13 +3408,22 @@ class AkiCodeGen:
         # Find and add appropriate instruction
 
         try:
-            instr_name = lhs_atype.comp_ins
-            if instr_name is None:
-                raise LocalException
-            instr_type = getattr(self.builder, instr_name)
-            op_name = lhs_atype.comp_ops.get(node.op, None)
-            if op_name is None:
-                raise LocalException
+            # Types like strings that compare by their contents
+            # generate their own comparisons.
+            compare = getattr(lhs_atype, "compare", None)
+            if compare is not None:
+                instr = compare(self, node, lhs, rhs)
+                if instr is None:
+                    raise LocalException
+            else:
+                instr_name = lhs_atype.comp_ins
+                if instr_name is None:
+                    raise LocalException
+                instr_type = getattr(self.builder, instr_name)
+                op_name = lhs_atype.comp_ops.get(node.op, None)
+                if op_name is None:
+                    raise LocalException
+                instr = instr_type(node.op, lhs, rhs, op_name)
 
         except LocalException:
             raise AkiOpError(
@@ -1487,8 +3432,6 @@ class AkiCodeGen:
                 f'Comparison operator "{CMD}{node.op}{REP}" not supported for type "{CMD}{lhs_atype}{REP}"',
             )
 
-        instr = instr_type(node.op, lhs, rhs, op_name)
-
         instr.akitype = self.types["bool"]
         instr.akinode = node
         instr.akinode.name = f'op "{node.op}"'
@@ -1542,20 +3485,70 @@ class AkiCodeGen:
 
     def _codegen_AccessorExpr(self, node, load=True):
         # XXX: this should be a direct extraction codegen
-        expr = self._name(node.expr, node.expr.name)
+        name = getattr(node.expr, "name", "expression")
+        if isinstance(node.expr, Name):
+            expr = self._name(node.expr, name)
+        elif isinstance(node.expr, (AccessorExpr, FieldRef)):
+            expr = self._codegen(ObjectRef(node.expr.index, node.expr))
+        else:
+            # Any other value has to be stored to be indexed
+            value = self._codegen(node.expr)
+            expr = self._alloca(node.expr, value.type, ".index")
+            self.builder.store(value, expr)
+            expr.akitype = value.akitype
         index = getattr(expr.akitype, "op_index", None)
         if index is None:
             raise AkiTypeErr(
                 node.expr, self.text, "No index operator found for this type"
             )
         result = index(self, node, expr)
+        if load:
+            t = result.akitype
+            if hasattr(result, "bit"):
+                result = result.bit_array.load_element(self, result)
+            else:
+                result = self.builder.load(result)
+            result.akitype = t
+            result.akinode = node
+            result.akinode.vartype = result.akitype.type_id
+        result.akinode.name = name + "[]"
+        return result
+
+    def _codegen_FieldRef(self, node, load=True):
+        """
+        Generate a reference to a structure field from a `FieldRef` node.
+        A pointer to a structure can be used in place of the structure.
+        """
+        if isinstance(node.expr, Name):
+            ptr = self._name(node.expr, node.expr.name)
+        elif isinstance(node.expr, (AccessorExpr, FieldRef)):
+            ptr = self._codegen(ObjectRef(node.expr.index, node.expr))
+        else:
+            # Any other value has to be stored to be addressed
+            value = self._codegen(node.expr)
+            ptr = self._alloca(node.expr, value.type, ".field")
+            self.builder.store(value, ptr)
+            ptr.akitype = value.akitype
+
+        akitype = ptr.akitype
+        if isinstance(akitype, AkiPointer) and isinstance(akitype.base_type, AkiStruct):
+            ptr = self.builder.load(ptr)
+            akitype = akitype.base_type
+
+        if not isinstance(akitype, AkiStruct):
+            raise AkiTypeErr(
+                node.expr,
+                self.text,
+                f'"{CMD}{getattr(node.expr, "name", "expression")}{REP}" ({CMD}{akitype}{REP}) is not a structure',
+            )
+
+        result = akitype.op_field(self, node, ptr)
         if load:
             t = result.akitype
             result = self.builder.load(result)
             result.akitype = t
             result.akinode = node
             result.akinode.vartype = result.akitype.type_id
-        result.akinode.name = node.expr.name + "[]"
         return result
 
     #################################################################
@@ -1567,6 +3560,8 @@ class AkiCodeGen:
             return self._name(node.expr, node.expr.name)
         if isinstance(node.expr, AccessorExpr):
             return self._codegen_AccessorExpr(node.expr, False)
+        if isinstance(node.expr, FieldRef):
+            return self._codegen_FieldRef(node.expr, False)
         raise AkiOpError(
             node,
             self.text,
@@ -1601,6 +3596,24 @@ class AkiCodeGen:
             )
 
         self._type_check_op(node, ptr, val)
+
+        # Variables, elements, and fields that hold heap objects
+        # own a reference to them, and let go of the old one.
+        # Arguments that are never assigned to only borrow their objects
+        # from the caller.
+
+        if self._is_heap_object(val.akitype) and (
+            ptr in self.fn.owners or not isinstance(ptr, ir.AllocaInstr)
+        ):
+            self._store_reference(node, val, ptr)
+            return val
+
+        # Elements of boolean arrays are bits within a word
+
+        if hasattr(ptr, "bit"):
+            ptr.bit_array.store_element(self, ptr, val)
+            return val
+
         self.builder.store(val, ptr)
 
         return val
@@ -1680,55 +3693,41 @@ class AkiCodeGen:
     def _codegen_String(self, node):
         """
         Generates a *compile-time* string constant.
+        Identical literals share one constant, named for its contents.
+        If another module has already compiled it, it's only declared here.
         """
 
-        const_counter = self._const_counter()
-
         akitype = self._get_vartype(node.vartype)
-        data, data_array = self.types["str"].data(node.val)
-
-        # TODO: I'm considering moving this into .data
-        # to keep this module leaner
-        # we may also need access to it there so that we can
-        # generate empty strings
-
-        string = ir.GlobalVariable(
-            self.module, data_array, f".str.data.{const_counter}"
-        )
-        string.initializer = ir.Constant(data_array, data)
-
-        string.global_constant = True
-        string.unnamed_addr = True
+        str_type = self.types["str"]
+        data, data_array = str_type.data(node.val)
 
-        data_object = ir.GlobalVariable(
-            self.module, self.types["str"].llvm_type_base, f".str.{const_counter}"
-        )
+        # The header and the data are a single constant,
+        # which is used through the sized-down string type
 
-        data_object.initializer = ir.Constant(
-            self.types["str"].llvm_type_base,
+        literal_type = str_type.literal_type(data_array)
+        initializer = ir.Constant(
+            literal_type,
             (
-                (self.types["str"].enum_id, len(data_array), 0, 0),
-                string.bitcast(self.typemgr.as_ptr(self.types["u_mem"]).llvm_type),
+                (str_type.enum_id, len(data_array), 0, 0),
+                ir.Constant(data_array, data),
             ),
         )
-
+        digest = hashlib.blake2b(str(initializer).encode("utf8"), digest_size=8)
+        name = f".str.{digest.hexdigest()}"
+
+        string = self.module.globals.get(name, None)
+        if string is None:
+            string = ir.GlobalVariable(self.module, literal_type, name)
+            if name not in self.compiled_globals:
+                string.initializer = initializer
+            string.global_constant = True
+            string.unnamed_addr = True
+
+        data_object = string.bitcast(str_type.llvm_type)
         data_object.akitype = akitype
         data_object.akinode = node
         return data_object
 
-    def _builtin_str_init(self, node):
-        pass
-        # if the node is a constant,
-        # codegen_string and return that
-        # if not,
-        # then we need to check the type of the input
-        # and use that
-        # e.g., an existing string we just point to the old one
-        # a number, we do number-to-string conversion by way of
-        # a library call
-        # meaning we need to have some way to loop in library calls
-        # by name from the stdlib
-
     #################################################################
     # Builtins
     #################################################################
@@ -1800,9 +3799,8 @@ class AkiCodeGen:
         c1 = self._codegen(node_ref)
         c2 = self._get_vartype(target_type)
 
-        target_data = self.typemgr.target_data()
-        c1_size = c1.type.get_abi_size(target_data)
-        c2_size = c2.llvm_type.get_abi_size(target_data)
+        c1_size = self.typemgr.layout(c1.type).size
+        c2_size = self.typemgr.layout(c2.llvm_type).size
 
         try:
 
@@ -1871,9 +3869,40 @@ class AkiCodeGen:
         self._argcheck(node, 1)
         node_ref = node.arguments[0]
         item = self._codegen(node_ref)
-        byte_width = item.type.get_abi_size(self.typemgr.target_data())
+        byte_width = self.typemgr.layout(item.type).size
         return self._codegen(Constant(node, byte_width, self.typemgr._default))
 
+    def _builtins_sizeof(self, node):
+        """
+        Get the size, in bytes, of a type, as laid out on the target.
+        """
+        self._argcheck(node, 1)
+        akitype = self._get_vartype(node.arguments[0])
+        size = self.typemgr.layout(akitype.llvm_type).size
+        return self._codegen(Constant(node, size, self.types["u_size"]))
+
+    def _builtins_offsetof(self, node):
+        """
+        Get the offset, in bytes, of a field from the start of a structure.
+        """
+        self._argcheck(node, 2)
+        struct_ref, field_ref = node.arguments
+        akitype = self._get_vartype(struct_ref)
+        if not isinstance(akitype, AkiStruct):
+            raise AkiTypeErr(
+                struct_ref, self.text, f'"{CMD}{akitype}{REP}" is not a structure'
+            )
+        offset = None
+        if isinstance(field_ref, Name):
+            offset = akitype.offset(self, field_ref.name)
+        if offset is None:
+            raise AkiNameErr(
+                field_ref,
+                self.text,
+                f'Structure "{CMD}{akitype.type_id}{REP}" has no field "{CMD}{getattr(field_ref, "name", None)}{REP}"',
+            )
+        return self._codegen(Constant(node, offset, self.types["u_size"]))
+
     def _builtins_c_size(self, node):
         """
         Get the size, in bytes, of the C-compatible data for a given object.
@@ -1906,11 +3935,16 @@ class AkiCodeGen:
             ref = self._name(node, node_ref.name)
         elif isinstance(node_ref, AccessorExpr):
             ref = self._codegen_AccessorExpr(node_ref, False)
+            if hasattr(ref, "bit"):
+                raise AkiTypeErr(
+                    node_ref,
+                    self.text,
+                    f"Elements of boolean arrays can't be referenced, since they're stored as bits",
+                )
             node_ref.vartype = ref.akitype.type_id
             # XXX: This creates a pointer to an ARRAY and not
             # an ARRAY OBJECT.
-            # IOW, this won't work correctly until we have
-            # slicing.
+            # To refer to part of an array, use `slice` instead.
         else:
             n1 = self._codegen(node_ref)
             raise AkiTypeErr(
@@ -1927,10 +3961,6 @@ class AkiCodeGen:
             r2.akinode = node_ref
             r2.akitype = self.typemgr.as_ptr(r1.akitype)
             r2.akitype.llvm_type.pointee.akitype = r1.akitype
-            # TODO: This should be created when we allocate the pointer, IMO
-            r2.akitype.llvm_type.pointee.akitype.original_function = (
-                r1.akitype.original_function
-            )
 
             return r2
 
@@ -1976,18 +4006,1107 @@ class AkiCodeGen:
         f1.akitype = ref.akitype.llvm_type.pointee.akitype
         return f1
 
-    #################################################################
-    # Decorators
-    #################################################################
+    def _vector_arg(self, node, arg):
+        """
+        Codegen a builtin's argument that must be a vector.
+        """
+        vector = self._codegen(arg)
+        if not self._is_type(arg, vector, AkiVector):
+            raise AkiTypeErr(
+                arg,
+                self.text,
+                f'"{CMD}{node.name}{REP}" requires a vector, not "{CMD}{vector.akitype}{REP}"',
+            )
+        return vector
 
-    def _decorator_inline_enter(self):
-        self.decorator_context["inline"] = True
+    def _lane_arg(self, node, arg, vector):
+        """
+        Codegen a builtin's lane index argument for a vector.
+        """
+        index = self._codegen(arg)
+        if not isinstance(index.akitype, AkiBaseInt):
+            raise AkiTypeErr(
+                arg,
+                self.text,
+                f'Lane index for "{CMD}{node.name}{REP}" must be an integer',
+            )
+        if isinstance(index, ir.Constant) and not (
+            0 <= index.constant < vector.akitype.length
+        ):
+            raise AkiTypeErr(
+                arg,
+                self.text,
+                f"Lane index {CMD}{index.constant}{REP} is out of range for {CMD}{vector.akitype}{REP}",
+            )
+        return index
 
-    def _decorator_inline_exit(self):
-        self.decorator_context["inline"] = None
+    def _lane_result(self, node, result, akitype):
+        """
+        Decorate the result of a vector builtin with its Aki type.
+        """
+        result.akitype = akitype
+        result.akinode = node
+        result.akinode.vartype = akitype.type_id
+        return result
 
-    def _decorator_noinline_enter(self):
-        self.decorator_context["inline"] = False
+    def _builtins_extract(self, node):
+        """
+        Extract a single lane from a vector.
+        """
+        self._argcheck(node, 2)
+        vector = self._vector_arg(node, node.arguments[0])
+        index = self._lane_arg(node, node.arguments[1], vector)
+        result = self.builder.extract_element(vector, index)
+        return self._lane_result(node, result, vector.akitype.base_type)
 
-    def _decorator_noinline_exit(self):
-        return self._decorator_inline_exit()
+    def _builtins_insert(self, node):
+        """
+        Return a copy of a vector with a single lane replaced.
+        """
+        self._argcheck(node, 3)
+        vector = self._vector_arg(node, node.arguments[0])
+        index = self._lane_arg(node, node.arguments[1], vector)
+        value = self._codegen(node.arguments[2])
+        if value.akitype != vector.akitype.base_type:
+            raise AkiTypeErr(
+                node.arguments[2],
+                self.text,
+                f'Value of type "{CMD}{value.akitype}{REP}" can\'t be inserted into "{CMD}{vector.akitype}{REP}"',
+            )
+        result = self.builder.insert_element(vector, value, index)
+        return self._lane_result(node, result, vector.akitype)
+
+    def _builtins_shuffle(self, node):
+        """
+        Build a new vector from the lanes of two vectors of the same type.
+        Lanes are selected by a list of constant indices,
+        where the lanes of the second vector follow those of the first.
+        """
+        if len(node.arguments) < 4:
+            raise AkiSyntaxErr(
+                node,
+                self.text,
+                f'"{CMD}{node.name}{REP}" requires two vectors and at least two lane indices',
+            )
+        v1 = self._vector_arg(node, node.arguments[0])
+        v2 = self._vector_arg(node, node.arguments[1])
+        if v1.akitype != v2.akitype:
+            raise AkiTypeErr(
+                node.arguments[1],
+                self.text,
+                f'Vectors for "{CMD}{node.name}{REP}" must be the same type ("{CMD}{v1.akitype}{REP}" and "{CMD}{v2.akitype}{REP}")',
+            )
+
+        mask = []
+        for _ in node.arguments[2:]:
+            if not isinstance(_, Constant) or not (0 <= _.val < v1.akitype.length * 2):
+                raise AkiTypeErr(
+                    _,
+                    self.text,
+                    f'Lane indices for "{CMD}{node.name}{REP}" must be constants from 0 to {v1.akitype.length * 2 - 1}',
+                )
+            mask.append(_.val)
+
+        akitype = self.types["vec"].new(
+            self, node, v1.akitype.base_type, Constant(node, len(mask), None)
+        )
+        result = self.builder.shuffle_vector(
+            v1, v2, ir.Constant(ir.VectorType(ir.IntType(32), len(mask)), mask)
+        )
+        return self._lane_result(node, result, akitype)
+
+    def _reduce_vector(self, node, op):
+        """
+        Combine all the lanes of a vector with a binary op.
+        Each step splits the vector in half and combines the halves,
+        so a vector of n lanes takes log2(n) vector ops.
+        """
+        self._argcheck(node, 1)
+        vector = self._vector_arg(node, node.arguments[0])
+        akitype = vector.akitype
+        math_op = akitype.bin_ops.get(op, None)
+        if math_op is None:
+            raise AkiOpError(
+                node,
+                self.text,
+                f'Binary operator "{CMD}{op}{REP}" not found for type "{CMD}{akitype}{REP}"',
+            )
+        instr_call = getattr(akitype.base_type.__class__, f"binop_{math_op}")
+
+        length = akitype.length
+        while length > 1:
+            length //= 2
+            mask_type = ir.VectorType(ir.IntType(32), length)
+            lo = self.builder.shuffle_vector(
+                vector, vector, ir.Constant(mask_type, list(range(length)))
+            )
+            hi = self.builder.shuffle_vector(
+                vector, vector, ir.Constant(mask_type, list(range(length, length * 2)))
+            )
+            vector = instr_call(akitype.base_type, self, node, lo, hi, op)
+
+        result = self.builder.extract_element(vector, _int(0))
+        return self._lane_result(node, result, akitype.base_type)
+
+    def _builtins_reduce_add(self, node):
+        """
+        Sum all the lanes of a vector.
+        """
+        return self._reduce_vector(node, "+")
+
+    def _builtins_reduce_mul(self, node):
+        """
+        Multiply all the lanes of a vector.
+        """
+        return self._reduce_vector(node, "*")
+
+    def _bit_array_arg(self, node, arg):
+        """
+        Get a pointer to an array of booleans, or to part of one
+        by way of indexing only some of its dimensions, for a builtin.
+        """
+        ptr = None
+        if isinstance(arg, Name):
+            ptr = self._name(arg, arg.name)
+        elif isinstance(arg, AccessorExpr):
+            ptr = self._codegen_AccessorExpr(arg, False)
+        if not isinstance(getattr(ptr, "akitype", None), AkiBitArray):
+            raise AkiTypeErr(
+                arg,
+                self.text,
+                f'"{CMD}{node.name}{REP}" requires an array of booleans, or a row of one',
+            )
+        return ptr
+
+    def _count_bits(self, node, data, count, action=None):
+        """
+        Count the bits set in `count` words at `data`.
+        If `action(word, index)` is given, it's called for each word first,
+        and the bits are counted in the word it returns.
+        """
+        word_type = data.type.pointee
+        ctpop = self.module.declare_intrinsic("llvm.ctpop", [word_type])
+        total = self._alloca(node, word_type, ".popcount")
+        self.builder.store(ir.Constant(word_type, 0), total)
+
+        def count_word(word, index):
+            if action is not None:
+                word = action(word, index)
+            self.builder.store(
+                self.builder.add(
+                    self.builder.load(total), self.builder.call(ctpop, [word])
+                ),
+                total,
+            )
+
+        self._each_element(data, count, count_word)
+        result = self._as_size(self.builder.load(total))
+        result.akitype = self.types["u_size"]
+        result.akinode = node
+        result.akinode.vartype = result.akitype.type_id
+        return result
+
+    def _builtins_popcount(self, node):
+        """
+        Count the elements that are set in an array of booleans,
+        or in part of one, as in `popcount(a[row])`.
+        """
+        self._argcheck(node, 1)
+        ptr = self._bit_array_arg(node, node.arguments[0])
+        data, count = ptr.akitype.words(self, ptr)
+        return self._count_bits(node, data, count)
+
+    def _bitwise_arrays(self, node, op):
+        """
+        Combine one array of booleans into another of the same dimensions,
+        a word at a time. Returns the number of elements set in the result.
+        """
+        self._argcheck(node, 2)
+        dest, src = [self._bit_array_arg(node, _) for _ in node.arguments]
+        if dest.akitype.shape != src.akitype.shape:
+            raise AkiTypeErr(
+                node.arguments[1],
+                self.text,
+                f'"{CMD}{node.name}{REP}" requires arrays with the same dimensions, not "{CMD}{dest.akitype}{REP}" and "{CMD}{src.akitype}{REP}"',
+            )
+        builder = self.builder
+        data, count = dest.akitype.words(self, dest)
+        src_data, _ = src.akitype.words(self, src)
+
+        def combine(word, index):
+            result = op(word, builder.load(builder.gep(src_data, [index])))
+            builder.store(result, builder.gep(data, [index]))
+            return result
+
+        return self._count_bits(node, data, count, combine)
+
+    def _builtins_bits_and(self, node):
+        """
+        Clear each element of an array of booleans
+        that isn't set in another, as in `bits_and(a, b)`.
+        """
+        return self._bitwise_arrays(node, self.builder.and_)
+
+    def _builtins_bits_or(self, node):
+        """
+        Set each element of an array of booleans that's set in another.
+        """
+        return self._bitwise_arrays(node, self.builder.or_)
+
+    def _builtins_bits_xor(self, node):
+        """
+        Flip each element of an array of booleans that's set in another.
+        """
+        return self._bitwise_arrays(node, self.builder.xor)
+
+    def _as_size(self, value):
+        """
+        Convert an integer value to a `u_size` value.
+        """
+        size_type = self.types["u_size"].llvm_type
+        if isinstance(value, ir.Constant):
+            return ir.Constant(size_type, value.constant)
+        if value.type.width < size_type.width:
+            if value.akitype.signed:
+                return self.builder.sext(value, size_type)
+            return self.builder.zext(value, size_type)
+        if value.type.width > size_type.width:
+            return self.builder.trunc(value, size_type)
+        return value
+
+    def _size_arg(self, node, arg):
+        """
+        Codegen a builtin's integer argument as a `u_size` value.
+        """
+        value = self._codegen(arg)
+        if not isinstance(value.akitype, AkiBaseInt):
+            raise AkiTypeErr(
+                arg,
+                self.text,
+                f'Arguments for "{CMD}{node.name}{REP}" must be integers',
+            )
+        return self._as_size(value)
+
+    def _slice_source(self, node, source):
+        """
+        Get the data pointer, length, stride, and element type
+        of something a slice can be taken from.
+        If it's a list, the list is returned as well,
+        since its elements move when it grows.
+        """
+        size_type = self.types["u_size"].llvm_type
+
+        # Arrays are addressed in place, rather than loaded
+
+        if isinstance(source, Name):
+            ptr = self._name(source, source.name)
+            if isinstance(ptr.akitype, AkiBitArray):
+                raise AkiTypeErr(
+                    source,
+                    self.text,
+                    f"Arrays of booleans can't be sliced, since they're stored as bits",
+                )
+            if isinstance(ptr.akitype, AkiArray):
+                if ptr.akitype.dimensions != 1:
+                    raise AkiTypeErr(
+                        source,
+                        self.text,
+                        f"Only one-dimensional arrays can be sliced",
+                    )
+                return (
+                    self.builder.gep(ptr, [_int(0), _int(0)]),
+                    ir.Constant(size_type, ptr.akitype.llvm_type.count),
+                    ir.Constant(size_type, 1),
+                    ptr.akitype.base_type,
+                    None,
+                )
+
+        value = self._codegen(source)
+
+        if isinstance(value.akitype, AkiHeapArray):
+            if value.akitype.dimensions != 1:
+                raise AkiTypeErr(
+                    source, self.text, f"Only one-dimensional arrays can be sliced"
+                )
+            return (
+                self.builder.gep(value, [_int(0), _int(AkiHeapArray.DATA), _int(0)]),
+                value.akitype.dimension(self, source, value, 0),
+                ir.Constant(size_type, 1),
+                value.akitype.base_type,
+                None,
+            )
+
+        if isinstance(value.akitype, AkiList):
+            return (
+                self.builder.load(value.akitype.field(self, value, AkiList.DATA)),
+                self.builder.load(value.akitype.field(self, value, AkiList.LENGTH)),
+                ir.Constant(size_type, 1),
+                value.akitype.base_type,
+                value,
+            )
+
+        if isinstance(value.akitype, AkiSlice):
+            return (
+                self.builder.extract_value(value, AkiSlice.DATA),
+                self.builder.extract_value(value, AkiSlice.LENGTH),
+                self.builder.extract_value(value, AkiSlice.STRIDE),
+                value.akitype.base_type,
+                None,
+            )
+
+        if isinstance(value.akitype, AkiString):
+            # The string's length includes its terminating NUL
+            length = value.akitype.c_size(self, source, value)
+            return (
+                value.akitype.c_data(self, value),
+                self.builder.sub(length, ir.Constant(size_type, 1)),
+                ir.Constant(size_type, 1),
+                self.types["byte"],
+                None,
+            )
+
+        raise AkiTypeErr(
+            source,
+            self.text,
+            f'"{CMD}{node.name}{REP}" requires an array, string, list, or slice, not "{CMD}{value.akitype}{REP}"',
+        )
+
+    def _builtins_slice(self, node):
+        """
+        Create a slice of the elements from `start` up to `end`
+        in an array, string, or slice, without copying them:
+        `slice(x, start, end)`, or `slice(x, start, end, step)`
+        for every `step`th element.
+        The range is cut short at the end of `x`,
+        and a step below one at runtime is taken as one.
+        """
+        if len(node.arguments) not in (3, 4):
+            raise AkiSyntaxErr(
+                node, self.text, f'"{CMD}slice{REP}" requires 3 or 4 arguments'
+            )
+
+        size_type = self.types["u_size"].llvm_type
+        one = ir.Constant(size_type, 1)
+
+        data, length, stride, base_type, _ = self._slice_source(node, node.arguments[0])
+        start = self._size_arg(node, node.arguments[1])
+        end = self._size_arg(node, node.arguments[2])
+        step = one
+        if len(node.arguments) == 4:
+            arg = node.arguments[3]
+            step = self._size_arg(node, arg)
+            negated = (
+                isinstance(arg, UnOp)
+                and arg.op == "-"
+                and isinstance(arg.lhs, Constant)
+            )
+            if negated or isinstance(step, ir.Constant) and step.constant <= 0:
+                raise AkiSyntaxErr(
+                    node.arguments[3],
+                    self.text,
+                    f'Step for "{CMD}slice{REP}" must be positive',
+                )
+
+        builder = self.builder
+
+        # A step that is only known at runtime is kept positive
+        # the same way the range is clamped.
+
+        if not isinstance(step, ir.Constant):
+            step = builder.select(builder.icmp_signed("<", step, one), one, step)
+
+        end = builder.select(builder.icmp_unsigned("<", end, length), end, length)
+        start = builder.select(builder.icmp_unsigned("<", start, end), start, end)
+
+        # Number of elements in the slice, rounded up
+        count = builder.udiv(
+            builder.add(builder.sub(end, start), builder.sub(step, one)), step
+        )
+
+        slice_type = self.types["slice"].new(self, node, base_type)
+        result = ir.Constant(slice_type.llvm_type, ir.Undefined)
+        for index, field in (
+            (AkiSlice.DATA, builder.gep(data, [builder.mul(start, stride)])),
+            (AkiSlice.LENGTH, count),
+            (AkiSlice.STRIDE, builder.mul(stride, step)),
+        ):
+            result = builder.insert_value(result, field, index)
+
+        result.akitype = slice_type
+        result.akinode = node
+        result.akinode.vartype = slice_type.type_id
+        return result
+
+    def _builtins_len(self, node):
+        """
+        Get the number of elements in a slice, list, or map, the number of bytes
+        in a string, or the size of an array with computed dimensions:
+        `len(a)` for the first dimension, or `len(a, n)` for dimension `n`.
+        """
+        if len(node.arguments) not in (1, 2):
+            raise AkiSyntaxErr(
+                node, self.text, f'"{CMD}len{REP}" requires 1 or 2 arguments'
+            )
+        value = self._codegen(node.arguments[0])
+
+        if self._is_type(node.arguments[0], value, AkiHeapArray):
+            dimension = 0
+            if len(node.arguments) == 2:
+                arg = node.arguments[1]
+                dimension = arg.val if isinstance(arg, Constant) else None
+                if dimension not in range(value.akitype.dimensions):
+                    raise AkiSyntaxErr(
+                        arg,
+                        self.text,
+                        f"Dimension must be a constant from 0 to {value.akitype.dimensions-1}",
+                    )
+            result = value.akitype.dimension(self, node, value, dimension)
+            result.akinode.vartype = result.akitype.type_id
+            return result
+
+        if not isinstance(value.akitype, (AkiSlice, AkiList, AkiMap, AkiString)):
+            raise AkiTypeErr(
+                node.arguments[0],
+                self.text,
+                f'"{CMD}len{REP}" requires a slice, list, map, string, or array, not "{CMD}{value.akitype}{REP}"',
+            )
+        if len(node.arguments) == 2:
+            raise AkiSyntaxErr(
+                node.arguments[1],
+                self.text,
+                f"Slices, lists, maps, and strings have only one dimension",
+            )
+        if isinstance(value.akitype, AkiString):
+            _, result = value.akitype.fields(self, value)
+        elif isinstance(value.akitype, AkiMap):
+            result = self.builder.load(value.akitype.field(self, value, AkiMap.COUNT))
+        elif isinstance(value.akitype, AkiList):
+            result = self.builder.load(value.akitype.field(self, value, AkiList.LENGTH))
+        else:
+            result = self.builder.extract_value(value, AkiSlice.LENGTH)
+        result.akitype = self.types["u_size"]
+        result.akinode = node
+        result.akinode.vartype = result.akitype.type_id
+        return result
+
+    def _builtins_str(self, node):
+        """
+        Convert a number to a string, as in `str(x)`.
+        A string is returned as-is.
+        """
+        self._argcheck(node, 1)
+        value = self._codegen(node.arguments[0])
+        str_type = self.types["str"]
+        if self._is_type(node.arguments[0], value, AkiString):
+            return value
+
+        builder = self.builder
+        if isinstance(value.akitype, AkiBaseInt):
+            signed = value.akitype.signed
+            i64 = ir.IntType(64)
+            if value.type.width < 64:
+                value = (builder.sext if signed else builder.zext)(value, i64)
+            result = builder.call(
+                str_type.function(self, node, "from_int"),
+                [value, ir.Constant(ir.IntType(1), signed)],
+            )
+        elif isinstance(value.akitype, AkiBaseFloat):
+            if value.type != ir.DoubleType():
+                value = builder.fpext(value, ir.DoubleType())
+            result = builder.call(str_type.function(self, node, "from_float"), [value])
+        else:
+            raise AkiTypeErr(
+                node.arguments[0],
+                self.text,
+                f'"{CMD}str{REP}" requires a number or string, not "{CMD}{value.akitype}{REP}"',
+            )
+
+        result.akitype = str_type
+        result.akinode = node
+        result.akinode.vartype = str_type.type_id
+        return self._temporary(node, result)
+
+    def _builtins_find(self, node):
+        """
+        Find the first position of a string in another string,
+        as in `find(s, "abc")`. Returns -1 if it isn't found.
+        """
+        self._argcheck(node, 2)
+        args = [self._codegen(_) for _ in node.arguments]
+        for arg, value in zip(node.arguments, args):
+            if not self._is_type(arg, value, AkiString):
+                raise AkiTypeErr(
+                    arg,
+                    self.text,
+                    f'"{CMD}find{REP}" requires strings, not "{CMD}{value.akitype}{REP}"',
+                )
+        result = self.builder.call(self.types["str"].function(self, node, "find"), args)
+        result.akitype = self.types["i32"]
+        result.akinode = node
+        result.akinode.vartype = result.akitype.type_id
+        return result
+
+    def _list_arg(self, node, arg):
+        """
+        Codegen a builtin's argument that must be a list.
+        """
+        lst = self._codegen(arg)
+        if not self._is_type(arg, lst, AkiList):
+            raise AkiTypeErr(
+                arg,
+                self.text,
+                f'"{CMD}{node.name}{REP}" requires a list, not "{CMD}{lst.akitype}{REP}"',
+            )
+        return lst
+
+    def _list_length(self, node, result):
+        """
+        Decorate a new list length returned by a builtin.
+        """
+        result.akitype = self.types["u_size"]
+        result.akinode = node
+        result.akinode.vartype = result.akitype.type_id
+        return result
+
+    def _builtins_push(self, node):
+        """
+        Add an element to the end of a list, growing it if needed.
+        Returns the new length of the list.
+        """
+        self._argcheck(node, 2)
+        lst = self._list_arg(node, node.arguments[0])
+        akitype = lst.akitype
+        value = self._codegen(node.arguments[1])
+        if value.akitype != akitype.base_type:
+            raise AkiTypeErr(
+                node.arguments[1],
+                self.text,
+                f'Value of type "{CMD}{value.akitype}{REP}" can\'t be added to "{CMD}{akitype}{REP}"',
+            )
+
+        builder = self.builder
+        length_ptr = akitype.field(self, lst, AkiList.LENGTH)
+        length = builder.load(length_ptr)
+        new_length = builder.add(length, ir.Constant(length.type, 1))
+        akitype.reserve(self, node, lst, new_length)
+
+        data = builder.load(akitype.field(self, lst, AkiList.DATA))
+        if self._is_heap_object(value.akitype):
+            self._retain(value)
+        builder.store(value, builder.gep(data, [length]))
+        builder.store(new_length, length_ptr)
+        return self._list_length(node, new_length)
+
+    def _builtins_pop(self, node):
+        """
+        Remove the last element from a list, and return it.
+        Popping an empty list returns the element type's zero value.
+        """
+        self._argcheck(node, 1)
+        lst = self._list_arg(node, node.arguments[0])
+        akitype = lst.akitype
+
+        builder = self.builder
+        length_ptr = akitype.field(self, lst, AkiList.LENGTH)
+        length = builder.load(length_ptr)
+        empty = builder.icmp_unsigned("==", length, ir.Constant(length.type, 0))
+
+        # An empty list stays empty, and reads its first slot,
+        # which is always allocated.
+
+        new_length = builder.sub(length, builder.zext(builder.not_(empty), length.type))
+        data = builder.load(akitype.field(self, lst, AkiList.DATA))
+        value = builder.load(builder.gep(data, [new_length]))
+        builder.store(new_length, length_ptr)
+
+        result = builder.select(
+            empty, ir.Constant(akitype.base_type.llvm_type, None), value
+        )
+        result.akitype = akitype.base_type
+        result.akinode = node
+        result.akinode.vartype = result.akitype.type_id
+
+        # The list's reference to the element goes with it
+
+        return self._temporary(node, result, adopt=True)
+
+    def _builtins_append(self, node):
+        """
+        Add all the elements of an array, list, slice, or string
+        to the end of a list, with a single copy where they're contiguous.
+        Returns the new length of the list.
+        """
+        self._argcheck(node, 2)
+        lst = self._list_arg(node, node.arguments[0])
+        akitype = lst.akitype
+
+        arg = node.arguments[1]
+        if isinstance(arg, Name):
+            bits = self._name(arg, arg.name)
+            if isinstance(bits.akitype, AkiBitArray):
+                return self._append_bits(node, lst, bits)
+
+        src, count, stride, base_type, source = self._slice_source(node, arg)
+        if base_type != akitype.base_type:
+            raise AkiTypeErr(
+                node.arguments[1],
+                self.text,
+                f'Elements of type "{CMD}{base_type}{REP}" can\'t be added to "{CMD}{akitype}{REP}"',
+            )
+
+        builder = self.builder
+        size_type = self.types["u_size"].llvm_type
+        length_ptr = akitype.field(self, lst, AkiList.LENGTH)
+        length = builder.load(length_ptr)
+        new_length = builder.add(length, count)
+        akitype.reserve(self, node, lst, new_length)
+
+        # Reserving space may move the list's elements,
+        # so a list being appended to itself is read again
+
+        if source is not None:
+            src = builder.load(akitype.field(self, source, AkiList.DATA))
+
+        data = builder.load(akitype.field(self, lst, AkiList.DATA))
+        dest = builder.gep(data, [length])
+
+        if isinstance(stride, ir.Constant) and stride.constant == 1:
+            element_size = self.typemgr.layout(base_type.llvm_type).size
+            self._memcpy(
+                dest, src, builder.mul(count, ir.Constant(size_type, element_size))
+            )
+
+        else:
+
+            # Elements of a slice with a stride are copied one by one
+
+            zero = ir.Constant(size_type, 0)
+            start_block = builder.block
+            copy_block = builder.append_basic_block("append_copy")
+            exit_block = builder.append_basic_block("append_exit")
+            builder.cbranch(
+                builder.icmp_unsigned("==", count, zero), exit_block, copy_block
+            )
+
+            builder.position_at_start(copy_block)
+            index = builder.phi(size_type)
+            index.add_incoming(zero, start_block)
+            element = builder.load(builder.gep(src, [builder.mul(index, stride)]))
+            builder.store(element, builder.gep(dest, [index]))
+            next_index = builder.add(index, ir.Constant(size_type, 1))
+            index.add_incoming(next_index, copy_block)
+            builder.cbranch(
+                builder.icmp_unsigned("<", next_index, count), copy_block, exit_block
+            )
+
+            builder.position_at_start(exit_block)
+
+        if self._is_heap_object(base_type):
+            self._each_element(dest, count, lambda _, index: self._retain(_))
+
+        builder.store(new_length, length_ptr)
+        return self._list_length(node, new_length)
+
+    def _append_bits(self, node, lst, bits):
+        """
+        Add the elements of an array of booleans to the end of a list.
+        The array is stored as bits, so each one is unpacked
+        into the list's bytes.
+        """
+        akitype = lst.akitype
+        if bits.akitype.dimensions != 1:
+            raise AkiTypeErr(
+                node.arguments[1],
+                self.text,
+                f"Only one-dimensional arrays can be appended to a list",
+            )
+        if akitype.base_type != bits.akitype.base_type:
+            raise AkiTypeErr(
+                node.arguments[1],
+                self.text,
+                f'Elements of type "{CMD}{bits.akitype.base_type}{REP}" can\'t be added to "{CMD}{akitype}{REP}"',
+            )
+
+        builder = self.builder
+        size_type = self.types["u_size"].llvm_type
+        word_bits = AkiBitArray.WORD_BITS
+        count = ir.Constant(size_type, bits.akitype.shape[0])
+
+        length_ptr = akitype.field(self, lst, AkiList.LENGTH)
+        length = builder.load(length_ptr)
+        new_length = builder.add(length, count)
+        akitype.reserve(self, node, lst, new_length)
+
+        words, _ = bits.akitype.words(self, bits)
+        data = builder.load(akitype.field(self, lst, AkiList.DATA))
+        dest = builder.gep(data, [length])
+
+        start_block = builder.block
+        copy_block = builder.append_basic_block("append_copy")
+        exit_block = builder.append_basic_block("append_exit")
+        builder.branch(copy_block)
+
+        builder.position_at_start(copy_block)
+        index = builder.phi(size_type)
+        index.add_incoming(ir.Constant(size_type, 0), start_block)
+        word_index = builder.lshr(
+            index, ir.Constant(size_type, word_bits.bit_length() - 1)
+        )
+        word = builder.load(builder.gep(words, [word_index]))
+        bit = builder.zext(
+            builder.and_(index, ir.Constant(size_type, word_bits - 1)), word.type
+        )
+        builder.store(
+            builder.trunc(builder.lshr(word, bit), akitype.base_type.llvm_type),
+            builder.gep(dest, [index]),
+        )
+        next_index = builder.add(index, ir.Constant(size_type, 1))
+        index.add_incoming(next_index, copy_block)
+        builder.cbranch(
+            builder.icmp_unsigned("<", next_index, count), copy_block, exit_block
+        )
+
+        builder.position_at_start(exit_block)
+        builder.store(new_length, length_ptr)
+        return self._list_length(node, new_length)
+
+    def _map_arg(self, node):
+        """
+        Codegen the arguments of a builtin that takes a map and a key.
+        """
+        self._argcheck(node, 2)
+        arg = node.arguments[0]
+        header = self._codegen(arg)
+        if not self._is_type(arg, header, AkiMap):
+            raise AkiTypeErr(
+                arg,
+                self.text,
+                f'"{CMD}{node.name}{REP}" requires a map, not "{CMD}{header.akitype}{REP}"',
+            )
+        key = header.akitype.key(self, node.arguments[1])
+        return header, key
+
+    def _map_result(self, node, result, akitype):
+        result.akitype = akitype
+        result.akinode = node
+        result.akinode.vartype = result.akitype.type_id
+        return result
+
+    def _builtins_get(self, node):
+        """
+        Get the value for a key in a map, or the value type's zero value
+        if the key isn't there. Unlike `m[k]`, this never inserts the key.
+        """
+        header, key = self._map_arg(node)
+        akitype = header.akitype
+        builder = self.builder
+        index = builder.call(akitype.function(self, node, "find"), [header, key])
+        missing = builder.icmp_unsigned("==", index, akitype.not_found(self))
+
+        # A missing key reads slot 0, which is always allocated,
+        # and the value read is discarded
+
+        slots = builder.load(akitype.field(self, header, AkiMap.SLOTS))
+        index = builder.select(missing, ir.Constant(index.type, 0), index)
+        value = builder.load(builder.gep(slots, [index, _int(1)]))
+        result = builder.select(
+            missing, ir.Constant(akitype.value_type.llvm_type, None), value
+        )
+        return self._map_result(node, result, akitype.value_type)
+
+    def _builtins_contains(self, node):
+        """
+        Determine if a key is in a map.
+        """
+        header, key = self._map_arg(node)
+        akitype = header.akitype
+        index = self.builder.call(akitype.function(self, node, "find"), [header, key])
+        result = self.builder.icmp_unsigned("!=", index, akitype.not_found(self))
+        return self._map_result(node, result, self.types["bool"])
+
+    def _builtins_delete(self, node):
+        """
+        Remove a key from a map.
+        Returns whether the key was there to remove.
+        """
+        header, key = self._map_arg(node)
+        result = self.builder.call(
+            header.akitype.function(self, node, "delete"), [header, key]
+        )
+        return self._map_result(node, result, self.types["bool"])
+
+    def _map_list(self, node, field, akitype):
+        """
+        Build a new list from the keys or values of a map.
+        """
+        self._argcheck(node, 1)
+        arg = node.arguments[0]
+        header = self._codegen(arg)
+        if not self._is_type(arg, header, AkiMap):
+            raise AkiTypeErr(
+                arg,
+                self.text,
+                f'"{CMD}{node.name}{REP}" requires a map, not "{CMD}{header.akitype}{REP}"',
+            )
+        list_type = self.types["list"].new(self, node, akitype(header.akitype))
+        result = list_type.allocate(self, node)
+
+        builder = self.builder
+        count = builder.load(header.akitype.field(self, header, AkiMap.COUNT))
+        list_type.reserve(
+            self, node, result, builder.add(count, ir.Constant(count.type, 1))
+        )
+        builder.store(count, list_type.field(self, result, AkiList.LENGTH))
+        data = builder.load(list_type.field(self, result, AkiList.DATA))
+
+        capacity = builder.load(header.akitype.field(self, header, AkiMap.CAPACITY))
+        control = builder.load(header.akitype.field(self, header, AkiMap.CONTROL))
+        slots = builder.load(header.akitype.field(self, header, AkiMap.SLOTS))
+
+        # Copy from each slot in use, in the order of the slots
+
+        size_type = capacity.type
+        zero = ir.Constant(size_type, 0)
+        start_block = builder.block
+        loop_block = builder.append_basic_block(f"{node.name}_loop")
+        exit_block = builder.append_basic_block(f"{node.name}_exit")
+        builder.branch(loop_block)
+
+        builder.position_at_start(loop_block)
+        index = builder.phi(size_type)
+        position = builder.phi(size_type)
+        index.add_incoming(zero, start_block)
+        position.add_incoming(zero, start_block)
+        byte = builder.load(builder.gep(control, [index]))
+        full = builder.icmp_unsigned("==", byte, ir.Constant(byte.type, AkiMap.FULL))
+
+        # Every slot is written to the list's next position,
+        # but the position only moves on for slots in use.
+        # The list always has room for one more element.
+
+        element = builder.load(builder.gep(slots, [index, _int(field)]))
+        builder.store(element, builder.gep(data, [position]))
+        next_index = builder.add(index, ir.Constant(size_type, 1))
+        next_position = builder.add(position, builder.zext(full, size_type))
+        index.add_incoming(next_index, loop_block)
+        position.add_incoming(next_position, loop_block)
+        builder.cbranch(
+            builder.icmp_unsigned("<", next_index, capacity), loop_block, exit_block
+        )
+
+        builder.position_at_start(exit_block)
+        if self._is_heap_object(list_type.base_type):
+            self._each_element(data, count, lambda _, index: self._retain(_))
+        result.akinode = node
+        result.akinode.vartype = list_type.type_id
+        return self._temporary(node, result)
+
+    def _builtins_keys(self, node):
+        """
+        Get a new list of the keys in a map.
+        """
+        return self._map_list(node, 0, lambda _: _.key_type)
+
+    def _builtins_values(self, node):
+        """
+        Get a new list of the values in a map.
+        """
+        return self._map_list(node, 1, lambda _: _.value_type)
+
+    #################################################################
+    # Decorators
+    #################################################################
+
+    def _decorator_inline_enter(self):
+        self.decorator_context["inline"] = True
+
+    def _decorator_inline_exit(self):
+        self.decorator_context["inline"] = None
+
+    def _decorator_noinline_enter(self):
+        self.decorator_context["inline"] = False
+
+    def _decorator_noinline_exit(self):
+        return self._decorator_inline_exit()
+
+    def _decorator_pure_enter(self):
+        self.decorator_context["effect"] = "pure"
+
+    def _decorator_pure_exit(self):
+        self.decorator_context["effect"] = None
+
+    def _decorator_const_enter(self):
+        self.decorator_context["effect"] = "const"
+
+    def _decorator_const_exit(self):
+        return self._decorator_pure_exit()
+
+    def _decorator_parallel_enter(self):
+        decorator = self.decorator_stack[-1]
+        if not isinstance(decorator.expr_block, LoopExpr):
+            raise AkiSyntaxErr(
+                decorator,
+                self.text,
+                f'"{CMD}parallel{REP}" can only be used on a "{CMD}loop{REP}"',
+            )
+        self.decorator_context["parallel"] = decorator
+
+    def _decorator_parallel_exit(self):
+        self.decorator_context["parallel"] = None
+
+    def _decorated_expr(self, types, name=None):
+        """
+        Return the current decorator, which can only be used
+        on an expression of one of `types`.
+        """
+        decorator = self.decorator_stack[-1]
+        body = decorator.expr_block
+        while isinstance(body, Decorator):
+            body = body.expr_block
+        if not isinstance(body, types):
+            raise AkiSyntaxErr(
+                decorator,
+                self.text,
+                f'"{CMD}{decorator.name}{REP}" can only be used on {name}',
+            )
+        return decorator
+
+    def _decorator_likely_enter(self):
+        self._decorated_expr(IfExpr, f'an "{CMD}if{REP}" or "{CMD}when{REP}"')
+        self.decorator_context["expect"] = True
+
+    def _decorator_likely_exit(self):
+        self.decorator_context["expect"] = None
+
+    def _decorator_unlikely_enter(self):
+        self._decorated_expr(IfExpr, f'an "{CMD}if{REP}" or "{CMD}when{REP}"')
+        self.decorator_context["expect"] = False
+
+    def _decorator_unlikely_exit(self):
+        return self._decorator_likely_exit()
+
+    def _decorator_unroll_enter(self):
+        decorator = self._decorated_expr(
+            (LoopExpr, WhileExpr), f'a "{CMD}loop{REP}" or "{CMD}while{REP}"'
+        )
+        args = decorator.args
+        if decorator.name == "nounroll" and args:
+            raise AkiSyntaxErr(
+                decorator, self.text, f'"{CMD}nounroll{REP}" takes no arguments'
+            )
+        if args and (
+            len(args) != 1
+            or not isinstance(args[0], Constant)
+            or not isinstance(args[0].val, int)
+            or args[0].val < 1
+        ):
+            raise AkiSyntaxErr(
+                decorator,
+                self.text,
+                f'"{CMD}unroll{REP}" takes a single constant greater than zero',
+            )
+        self.decorator_context["unroll"] = decorator
+
+    def _decorator_unroll_exit(self):
+        self.decorator_context["unroll"] = None
+
+    def _decorator_nounroll_enter(self):
+        return self._decorator_unroll_enter()
+
+    def _decorator_nounroll_exit(self):
+        return self._decorator_unroll_exit()
+
+    def _decorator_assume_enter(self):
+        """
+        Tell the optimizer that each argument is true
+        from here on. If one isn't, the results are undefined,
+        so this requires an `unsafe` block.
+        """
+        decorator = self.decorator_stack[-1]
+        if isinstance(decorator.expr_block, TopLevel):
+            raise AkiSyntaxErr(
+                decorator,
+                self.text,
+                f'"{CMD}assume{REP}" can only be used on an expression',
+            )
+        if not self.unsafe_set:
+            raise AkiSyntaxErr(
+                decorator,
+                self.text,
+                f'"{CMD}assume{REP}" requires an "{CMD}unsafe{REP}" block',
+            )
+        if not decorator.args:
+            raise AkiSyntaxErr(
+                decorator,
+                self.text,
+                f'"{CMD}assume{REP}" takes one or more conditions',
+            )
+        assume = self.module.declare_intrinsic("llvm.assume")
+        for _ in decorator.args:
+            if isinstance(_, Argument):
+                raise AkiSyntaxErr(
+                    _, self.text, f'"{CMD}assume{REP}" takes conditions, not options'
+                )
+            condition = self._codegen(_)
+            if not self._is_type(_, condition, AkiBool):
+                condition = self._scalar_as_bool(_, condition)
+            self.builder.call(assume, [condition])
+
+    def _decorator_assume_exit(self):
+        pass
+
+    def _decorator_fastmath_enter(self):
+        self.decorator_context["fastmath"] = True
+
+    def _decorator_fastmath_exit(self):
+        self.decorator_context["fastmath"] = None
+
+    def _struct_decorator(self):
+        """
+        Return the current decorator, which can only be used on a `struct`.
+        """
+        decorator = self.decorator_stack[-1]
+        body = decorator.expr_block
+        while isinstance(body, Decorator):
+            body = body.expr_block
+        if not isinstance(body, StructDeclaration):
+            raise AkiSyntaxErr(
+                decorator,
+                self.text,
+                f'"{CMD}{decorator.name}{REP}" can only be used on a "{CMD}struct{REP}"',
+            )
+        return decorator
+
+    def _decorator_packed_enter(self):
+        self._struct_decorator()
+        self.decorator_context["packed"] = True
+
+    def _decorator_packed_exit(self):
+        self.decorator_context["packed"] = None
+
+    def _decorator_align_enter(self):
+        decorator = self._struct_decorator()
+        args = decorator.args
+        if (
+            len(args) != 1
+            or not isinstance(args[0], Constant)
+            or not isinstance(args[0].val, int)
+            or args[0].val < 1
+            or args[0].val & (args[0].val - 1)
+        ):
+            raise AkiSyntaxErr(
+                decorator,
+                self.text,
+                f'"{CMD}align{REP}" takes a single constant that is a power of two',
+            )
+        self.decorator_context["align"] = args[0].val
+
+    def _decorator_align_exit(self):
+        self.decorator_context["align"] = None
+
+    def _decorator_reorder_enter(self):
+        self._struct_decorator()
+        self.decorator_context["reorder"] = True
+
+    def _decorator_reorder_exit(self):
+        self.decorator_context["reorder"] = None
@@ -7,25 +7,67 @@ llvm.initialize_native_target()
 llvm.initialize_native_asmprinter()
 
 import os
+import threading
+from bisect import bisect_right, insort
+from itertools import chain
 
 
 class AkiCompiler:
-    def __init__(self):
+
+    # Optimization level for functions recompiled by tiered compilation.
+
+    TIER_OPT_LEVEL = 3
+
+    def __init__(self, opt_level=0, tiered=False, perf_map=False):
         """
         Create execution engine.
+        With `tiered`, modules are compiled without optimization,
+        and hot functions are optimized later with `compile_tier`.
+        With `perf_map`, the address of every compiled function
+        is written to a map file for the Linux `perf` profiler.
         """
 
-        # Create a target machine representing the host
+        # Create a target machine representing the host.
+        # When optimizing, we also target the host CPU's own features
+        # (e.g., FMA and vector extensions).
+
         self.target = llvm.Target.from_default_triple()
-        self.target_machine = self.target.create_target_machine()
+        if opt_level or tiered:
+            self.target_machine = self.target.create_target_machine(
+                cpu=llvm.get_host_cpu_name(),
+                features=llvm.get_host_cpu_features().flatten(),
+            )
+        else:
+            self.target_machine = self.target.create_target_machine()
+        self.opt_level = opt_level
+        self.tiered = tiered
+
+        # The engine is shared with the tiered compilation thread.
+
+        self.lock = threading.RLock()
 
         # Prepare the engine with an empty module
         self.backing_mod = llvm.parse_assembly("")
         self.engine = llvm.create_mcjit_compiler(self.backing_mod, self.target_machine)
         self.mod_ref = None
 
-        # Not used yet
-        # self.engine.set_object_cache(export,None)
+        # Address ranges of compiled functions,
+        # as (start, end, name), sorted by start.
+        # The object file for each compiled module is kept
+        # just long enough to find the size of its code.
+
+        self.functions: list = []
+        self.last_object = None
+        self.engine.set_object_cache(self.object_compiled)
+
+        # Names of the global variables defined by compiled modules.
+        # Later modules can declare these instead of defining them again.
+
+        self.globals: set = set()
+
+        self.perf_map = None
+        if perf_map:
+            self.perf_map = f"/tmp/perf-{os.getpid()}.map"
 
     def compile_ir(self, llvm_ir):
         """
@@ -43,12 +85,126 @@ class AkiCompiler:
 
     def finalize_compilation(self, mod):
         mod.verify()
-        self.engine.add_module(mod)
-        self.engine.finalize_object()
-        self.engine.run_static_constructors()
+        if self.opt_level and not self.tiered:
+            self.optimize(mod)
+        with self.lock:
+            self.engine.add_module(mod)
+            self.engine.finalize_object()
+            self.engine.run_static_constructors()
+            self.add_functions(mod)
+            self.globals.update(
+                _.name for _ in mod.global_variables if not _.is_declaration
+            )
         self.mod_ref = mod
         return mod
 
+    def compile_tier(self, llvm_ir, func_name):
+        """
+        Compile an optimized copy of a function from the IR
+        of a module already in the engine, and return its address.
+        The module's other functions and globals are kept as
+        `available_externally` definitions, so they can be inlined
+        into the copy, while references to them still resolve
+        to the originals.
+        """
+        mod = llvm.parse_assembly(llvm_ir)
+        tier_name = f"{func_name}.tier1"
+
+        for _ in chain(mod.functions, mod.global_variables):
+            if _.is_declaration or _.linkage in (
+                llvm.Linkage.internal,
+                llvm.Linkage.private,
+            ):
+                continue
+            if _.name == func_name:
+                _.name = tier_name
+            else:
+                _.linkage = "available_externally"
+
+        mod.verify()
+        self.optimize(mod, self.TIER_OPT_LEVEL)
+        with self.lock:
+            self.engine.add_module(mod)
+            self.engine.finalize_object()
+            self.add_functions(mod)
+            return self.engine.get_function_address(tier_name)
+
+    def object_compiled(self, mod, data):
+        self.last_object = data
+
+    def add_functions(self, mod):
+        """
+        Record the address ranges of the functions in a newly
+        compiled module, and add them to the perf map if we have one.
+        Each function is assumed to run up to the next one,
+        and the last to the end of the module's code.
+        Functions already compiled from an earlier module
+        resolve to their earlier copies, and are skipped.
+        """
+        if self.last_object is None:
+            return
+
+        code_size = sum(
+            _.size()
+            for _ in llvm.ObjectFileRef.from_data(self.last_object).sections()
+            if _.is_text()
+        )
+        self.last_object = None
+
+        known = {_[0] for _ in self.functions}
+        functions = []
+        for _ in mod.functions:
+            if _.is_declaration or _.linkage == llvm.Linkage.available_externally:
+                continue
+            address = self.engine.get_function_address(_.name)
+            if address and address not in known:
+                functions.append((address, _.name))
+        if not functions:
+            return
+
+        functions.sort()
+        ends = [_[0] for _ in functions[1:]] + [functions[0][0] + code_size]
+
+        for (address, name), end in zip(functions, ends):
+            insort(self.functions, (address, max(end, address + 1), name))
+
+        if self.perf_map is None:
+            return
+
+        with open(self.perf_map, "a") as file:
+            for (address, name), end in zip(functions, ends):
+                file.write(f"{address:x} {max(end - address, 1):x} {name}\n")
+
+    def find_function(self, address):
+        """
+        Return the name of the compiled function
+        containing an address, or `None`.
+        """
+        index = bisect_right(self.functions, (address, float("inf"))) - 1
+        if index < 0:
+            return None
+        start, end, name = self.functions[index]
+        if address >= end:
+            return None
+        return name
+
+    def optimize(self, mod, opt_level=None):
+        """
+        Run the LLVM optimization pipeline over a module,
+        by default at the compiler's optimization level.
+        """
+        if opt_level is None:
+            opt_level = self.opt_level
+        mod.data_layout = str(self.target_machine.target_data)
+        pmb = llvm.create_pass_manager_builder()
+        pmb.opt_level = opt_level
+        pmb.loop_vectorize = opt_level > 1
+        pmb.slp_vectorize = opt_level > 1
+        pm = llvm.create_module_pass_manager()
+        self.target_machine.add_analysis_passes(pm)
+        pmb.populate(pm)
+        pm.run(mod)
+
     def compile_module(self, module, filename="output"):
         """
         JIT-compiles the module for immediate execution.
@@ -75,5 +231,55 @@ class AkiCompiler:
 
     def get_addr(self, func_name="main"):
         # Obtain module entry point
-        func_ptr = self.engine.get_function_address(func_name)
+        with self.lock:
+            func_ptr = self.engine.get_function_address(func_name)
         return func_ptr
+
+
+class AkiTierThread(threading.Thread):
+    """
+    Background thread for tiered compilation.
+    Watches the call counters of a module's functions,
+    and once a function has been called `threshold` times,
+    recompiles it with optimizations and swaps the copy
+    into the function's dispatch slot.
+    """
+
+    def __init__(self, compiler, llvm_ir, tiers, threshold, interval=0.05):
+        super().__init__(daemon=True)
+        self.compiler = compiler
+        self.llvm_ir = llvm_ir
+        self.tiers = tiers
+        self.threshold = threshold
+        self.interval = interval
+
+        # Addresses of the optimized copies, by function name.
+        # `None` means the function could not be recompiled.
+
+        self.promoted: dict = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.poll()
+
+    def poll(self):
+        """
+        Recompile any functions that have become hot.
+        """
+        with self.lock:
+            for name, (counter, slot) in self.tiers.items():
+                if name in self.promoted or counter.value < self.threshold:
+                    continue
+                try:
+                    address = self.compiler.compile_tier(self.llvm_ir, name)
+                except Exception:
+                    address = None
+                self.promoted[name] = address
+                if address:
+                    slot.value = address
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
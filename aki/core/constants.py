@@ -33,6 +33,37 @@ def defaults():
             "compile_on_load": ("Compile immediately when a file is loaded.", True),
             "cache_compilation": ("Cache compiled files for reuse", True),
             "ignore_cache": ("Ignore cached files when recompiling", False),
+            "fastmath": (
+                "Use fast-math semantics for all floating-point operations.",
+                False,
+            ),
+            "opt_level": ("LLVM optimization level (0-3) for compiled code.", 0),
+            "threads": ("Threads for parallel loops (0 = one per CPU core).", 0),
+            "pgo_instrument": (
+                "Count function calls and branches in loaded files, and save the counts on exit.",
+                False,
+            ),
+            "pgo_use": (
+                "Optimize loaded files using counts saved from an instrumented run.",
+                True,
+            ),
+            "tiered": (
+                "Compile loaded files without optimization, and optimize hot functions in the background.",
+                False,
+            ),
+            "tier_threshold": (
+                "Calls to a function before tiered compilation optimizes it.",
+                1000,
+            ),
+            "profile_interval": ("Milliseconds between samples for .profile.", 1),
+            "debug_info": (
+                "Generate debug info, mapping compiled code to source lines.",
+                False,
+            ),
+            "perf_map": (
+                'Write compiled function addresses to "/tmp/perf-<pid>.map" for the Linux perf profiler.',
+                False,
+            ),
         },
     }
 
@@ -1,4 +1,4 @@
-from lark import Lark, Transformer, Tree, exceptions
+from lark import Lark, Transformer, Tree, Token, exceptions
 from core import error
 
 from core.astree import (
@@ -29,16 +29,24 @@ from core.astree import (
     VarTypePtr,
     VarTypeFunc,
     VarTypeAccessor,
+    VarTypeVector,
+    VarTypeSlice,
+    VarTypeList,
+    VarTypeMap,
     VarTypeNode,
     Accessor,
+    AnyDimension,
     UnOp,
     UnsafeBlock,
     Decorator,
     InlineDecorator,
     ConstList,
     External,
+    MultiFunction,
     AccessorExpr,
+    FieldRef,
     UniList,
+    StructDeclaration,
     Return,
 )
 
@@ -109,7 +117,17 @@ class AkiTransformer(Transformer):
         return node
 
     def inline_decorator(self, node):
-        raise NotImplementedError
+        """
+        A decorator in an expression context.
+        """
+        body = node[1]
+        for _ in node[0]:
+            pos = _[0]
+            name = _[1].value
+            args = _[2]
+            ret = InlineDecorator(pos.pos_in_stream, name, args, body)
+            body = ret
+        return ret
 
     def decorator(self, node):
         """
@@ -121,8 +139,32 @@ class AkiTransformer(Transformer):
         """
         An optional argument list for a decorator.
         """
+        if not node:
+            return []
+        return node[1]
+
+    def decorator_args(self, node):
+        """
+        The arguments within a decorator's argument list.
+        """
         return node
 
+    def decorator_arg(self, node):
+        """
+        A single decorator argument, either named or an expression.
+        A named argument, like `schedule="dynamic"`, parses
+        as an assignment, so it's turned back into an `Argument`.
+        """
+        arg = node[0]
+        if (
+            isinstance(arg, Assignment)
+            and arg.op == "="
+            and isinstance(arg.lhs, ObjectRef)
+            and type(arg.lhs.expr) is Name
+        ):
+            return Argument(arg.index, arg.lhs.expr.name, None, arg.rhs)
+        return arg
+
     def opt_arglist(self, node):
         """
         The arguments themselves within an optional argument list.
@@ -160,7 +202,10 @@ class AkiTransformer(Transformer):
     def dimension(self, node):
         """
         Single dimension in a dimension list.
+        A `*` is a dimension only known at runtime.
         """
+        if isinstance(node[0], Token):
+            return AnyDimension(node[0].pos_in_stream)
         return node[0]
 
     def mandatory_vartype(self, node):
@@ -178,10 +223,51 @@ class AkiTransformer(Transformer):
             pos.pos_in_stream, vartype, Accessor(pos2.pos_in_stream, dimensions)
         )
 
+    def vectortypedef(self, node):
+        """
+        Type definition for a SIMD vector.
+        """
+        pos, vartype, _, length, _ = node
+        return VarTypeVector(pos.pos_in_stream, vartype, length)
+
+    def slicetypedef(self, node):
+        """
+        Type definition for a slice.
+        """
+        return VarTypeSlice(node[0].pos_in_stream, node[1])
+
+    def listtypedef(self, node):
+        """
+        Type definition for a list.
+        """
+        return VarTypeList(node[0].pos_in_stream, node[1])
+
+    def maptypedef(self, node):
+        """
+        Type definition for a map.
+        """
+        pos, key_vartype, value_vartype = node
+        return VarTypeMap(pos.pos_in_stream, key_vartype, value_vartype)
+
+    def slice_call(self, node):
+        """
+        Call to the `slice` builtin.
+        """
+        ptr_list, pos, _, args, _ = node
+        if ptr_list:
+            raise error.AkiSyntaxErr(
+                ptr_list[0].pos_in_stream, self.text, "Unexpected token or keyword"
+            )
+        return Call(pos.pos_in_stream, "slice", args, None)
+
     def func_call(self, node):
         """
         Function call.
         """
+        if not isinstance(node[0], Name):
+            raise error.AkiTypeErr(
+                node[0].index, self.text, "Only functions can be called"
+            )
         return Call(node[0].index, node[0].name, node[2], None)
 
     def opt_call_args(self, node):
@@ -217,6 +303,45 @@ class AkiTransformer(Transformer):
         func = Function(pos.pos_in_stream, proto, body)
         return func
 
+    def function_multi_declaration(self, node):
+        """
+        Function declaration with multiple versions.
+        """
+        pos = node[0]
+        name = node[1].name
+        variants = []
+        default = None
+        for kind, func in node[3]:
+            func.prototype.name = name
+            if kind.type == "DEFAULT":
+                if default is not None:
+                    raise error.AkiSyntaxErr(
+                        func.index,
+                        self.text,
+                        "Multiple default versions specified for function",
+                    )
+                default = func
+            else:
+                variants.append(func)
+        return MultiFunction(pos.pos_in_stream, name, variants, default)
+
+    def multi_dec_list(self, node):
+        """
+        List of versions for a function declaration.
+        """
+        return node
+
+    def multi_dec(self, node):
+        """
+        One version of a function declaration, with its kind.
+        """
+        kind = node[0]
+        args = node[2]
+        vartype = node[4]
+        body = node[5]
+        proto = Prototype(kind.pos_in_stream, None, args, vartype)
+        return kind, Function(kind.pos_in_stream, proto, body)
+
     def external_declaration(self, node):
         """
         External function declaration.
@@ -491,10 +616,22 @@ class AkiTransformer(Transformer):
         """
         pos = node[1]
         accessor = node[2]
+        for _ in accessor:
+            if isinstance(_, AnyDimension):
+                raise error.AkiSyntaxErr(
+                    _.index, self.text, "Array indexes must be values, not `*`"
+                )
         return AccessorExpr(
             pos.pos_in_stream, node[0], Accessor(pos.pos_in_stream, accessor)
         )
 
+    def field_ref(self, node):
+        """
+        Structure field reference.
+        """
+        pos = node[1]
+        return FieldRef(pos.pos_in_stream, node[0], node[2].value)
+
     def vartype(self, node):
         """
         Variable type expression.
@@ -628,6 +765,26 @@ class AkiTransformer(Transformer):
         """
         return UniList(node[0].pos_in_stream, node[2])
 
+    def struct_declaration(self, node):
+        """
+        Structure declaration.
+        """
+        return StructDeclaration(node[0].pos_in_stream, node[1].name, node[3])
+
+    def struct_fields(self, node):
+        """
+        Fields for a structure declaration.
+        """
+        return node
+
+    def struct_field(self, node):
+        """
+        Single structure field.
+        """
+        name = node[0]
+        name.vartype = node[2]
+        return name
+
     def constant(self, node):
         """
         True/False.
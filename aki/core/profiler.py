@@ -0,0 +1,379 @@
+import ctypes
+import platform
+import signal
+import sys
+import threading
+from llvmlite import ir
+
+
+class SigAction(ctypes.Structure):
+    """
+    Linux `struct sigaction`, for installing the sampling handler.
+    """
+
+    _fields_ = [
+        ("handler", ctypes.c_void_p),
+        ("mask", ctypes.c_uint64 * 16),
+        ("flags", ctypes.c_int),
+        ("restorer", ctypes.c_void_p),
+    ]
+
+
+class AkiProfiler:
+    """
+    Sampling profiler for JIT-compiled code.
+    While code runs, the native program counter is sampled
+    at regular intervals, along with the return addresses found
+    on the stack, and both are mapped back to Aki functions
+    by way of the compiler's function address ranges.
+
+    On Linux (x86-64), samples are taken by a `SIGPROF` handler,
+    itself JIT-compiled. On Windows, a thread suspends the running
+    thread and reads its context.
+    """
+
+    # Most samples kept for one run,
+    # and most stack entries (including the program counter) per sample.
+
+    MAX_SAMPLES = 100000
+    DEPTH = 32
+
+    # How far up the stack to look for return addresses, in bytes.
+
+    STACK_LIMIT = 65536
+
+    # Offsets into the saved context of the program counter
+    # and the stack pointer.
+
+    LINUX_PC, LINUX_SP = 168, 160
+    WINDOWS_PC, WINDOWS_SP = 0xF8, 0x98
+
+    def __init__(self, compiler, interval=0.001):
+        self.compiler = compiler
+        self.interval = interval
+
+        self.samples = (ctypes.c_uint64 * (self.MAX_SAMPLES * self.DEPTH))()
+        self.count = ctypes.c_int64(0)
+
+        # The range of addresses with compiled code,
+        # and the top of the stack for the code being profiled.
+
+        self.bounds = (ctypes.c_uint64 * 3)()
+
+        # Recording the stack top is left to compiled code,
+        # so it's taken at the same depth as the code we run.
+
+        i64 = ir.IntType(64)
+        mod = ir.Module("aki.profile")
+        handler = self._sample_handler(mod) if self.native() else None
+        mark = ir.Function(mod, ir.FunctionType(ir.VoidType(), []), "aki.profile.mark")
+        builder = ir.IRBuilder(mark.append_basic_block("entry"))
+        top = builder.add(
+            builder.ptrtoint(builder.alloca(i64), i64), ir.Constant(i64, 512)
+        )
+        builder.store(top, self._ptr(self.bounds, 2))
+        builder.ret_void()
+
+        compiler.compile_ir(str(mod))
+        self.mark = ctypes.CFUNCTYPE(None)(compiler.get_addr("aki.profile.mark"))
+        self.handler = None
+        if handler is not None:
+            self.handler = compiler.get_addr(handler)
+
+    @staticmethod
+    def supported():
+        """
+        Can we profile on this platform?
+        """
+        return (sys.platform == "win32" and sys.maxsize > 2**32) or (
+            AkiProfiler.native()
+        )
+
+    @staticmethod
+    def native():
+        """
+        Can we take samples with a signal handler on this platform?
+        """
+        return sys.platform.startswith("linux") and platform.machine() == "x86_64"
+
+    def _ptr(self, array, index=0):
+        i64 = ir.IntType(64)
+        return ir.Constant(
+            i64, ctypes.addressof(array) + index * ctypes.sizeof(ctypes.c_uint64)
+        ).inttoptr(i64.as_pointer())
+
+    def _sample_handler(self, mod):
+        """
+        Generate the signal handler that records a sample:
+        the program counter, followed by any words on the stack
+        that fall within compiled code.
+        """
+        i64 = ir.IntType(64)
+        i8_ptr = ir.IntType(8).as_pointer()
+
+        def const(value):
+            return ir.Constant(i64, value)
+
+        func = ir.Function(
+            mod,
+            ir.FunctionType(ir.VoidType(), [ir.IntType(32), i8_ptr, i8_ptr]),
+            "aki.profile.sample",
+        )
+        entry = func.append_basic_block("entry")
+        record = func.append_basic_block("record")
+        scan_test = func.append_basic_block("scan_test")
+        scan_body = func.append_basic_block("scan_body")
+        scan_store = func.append_basic_block("scan_store")
+        scan_next = func.append_basic_block("scan_next")
+        done = func.append_basic_block("done")
+
+        builder = ir.IRBuilder(entry)
+
+        def load(address):
+            return builder.load(builder.inttoptr(address, i64.as_pointer()))
+
+        index = builder.atomic_rmw("add", self._ptr(self.count), const(1), "monotonic")
+        builder.cbranch(
+            builder.icmp_signed("<", index, const(self.MAX_SAMPLES)), record, done
+        )
+
+        builder.position_at_start(record)
+        sample = builder.add(
+            const(ctypes.addressof(self.samples)),
+            builder.mul(index, const(self.DEPTH * 8)),
+        )
+        context = builder.ptrtoint(func.args[2], i64)
+        builder.store(
+            load(builder.add(context, const(self.LINUX_PC))),
+            builder.inttoptr(sample, i64.as_pointer()),
+        )
+        stack = load(builder.add(context, const(self.LINUX_SP)))
+        low = builder.load(self._ptr(self.bounds, 0))
+        high = builder.load(self._ptr(self.bounds, 1))
+        top = builder.load(self._ptr(self.bounds, 2))
+
+        # Only scan the stack if we were interrupted
+        # below the stack top of the profiled code.
+
+        builder.cbranch(
+            builder.and_(
+                builder.icmp_unsigned("<", stack, top),
+                builder.icmp_unsigned(
+                    "<=", builder.sub(top, stack), const(self.STACK_LIMIT)
+                ),
+            ),
+            scan_test,
+            done,
+        )
+
+        builder.position_at_start(scan_test)
+        address = builder.phi(i64)
+        depth = builder.phi(i64)
+        builder.cbranch(
+            builder.and_(
+                builder.icmp_unsigned("<", address, top),
+                builder.icmp_unsigned("<", depth, const(self.DEPTH)),
+            ),
+            scan_body,
+            done,
+        )
+
+        builder.position_at_start(scan_body)
+        word = load(address)
+        builder.cbranch(
+            builder.and_(
+                builder.icmp_unsigned(">=", word, low),
+                builder.icmp_unsigned("<", word, high),
+            ),
+            scan_store,
+            scan_next,
+        )
+
+        builder.position_at_start(scan_store)
+        builder.store(
+            word,
+            builder.inttoptr(
+                builder.add(sample, builder.mul(depth, const(8))), i64.as_pointer()
+            ),
+        )
+        stored_depth = builder.add(depth, const(1))
+        builder.branch(scan_next)
+
+        builder.position_at_start(scan_next)
+        next_depth = builder.phi(i64)
+        next_depth.add_incoming(depth, scan_body)
+        next_depth.add_incoming(stored_depth, scan_store)
+        next_address = builder.add(address, const(8))
+        builder.branch(scan_test)
+
+        address.add_incoming(stack, record)
+        address.add_incoming(next_address, scan_next)
+        depth.add_incoming(const(1), record)
+        depth.add_incoming(next_depth, scan_next)
+
+        builder.position_at_start(done)
+        builder.ret_void()
+
+        return func.name
+
+    def run(self, func):
+        """
+        Call a compiled function, sampling it as it runs,
+        and return its result.
+        """
+        ctypes.memset(self.samples, 0, ctypes.sizeof(self.samples))
+        self.count.value = 0
+        self.bounds[0] = self.compiler.functions[0][0]
+        self.bounds[1] = max(_[1] for _ in self.compiler.functions)
+
+        if self.handler is not None:
+            return self._run_signal(func)
+        return self._run_thread(func)
+
+    def _run_signal(self, func):
+        libc = ctypes.CDLL(None, use_errno=True)
+        action, previous = SigAction(), SigAction()
+        action.handler = self.handler
+        action.flags = 0x4 | 0x10000000  # SA_SIGINFO | SA_RESTART
+        libc.sigaction(signal.SIGPROF, ctypes.byref(action), ctypes.byref(previous))
+        try:
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            self.mark()
+            return func()
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            libc.sigaction(signal.SIGPROF, ctypes.byref(previous), None)
+
+    def _run_thread(self, func):
+        kernel32 = ctypes.windll.kernel32
+        kernel32.OpenThread.restype = ctypes.c_void_p
+        kernel32.SuspendThread.argtypes = [ctypes.c_void_p]
+        kernel32.ResumeThread.argtypes = [ctypes.c_void_p]
+        kernel32.GetThreadContext.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        kernel32.CloseHandle.argtypes = [ctypes.c_void_p]
+
+        # THREAD_GET_CONTEXT | THREAD_SUSPEND_RESUME | THREAD_QUERY_INFORMATION
+        thread = kernel32.OpenThread(
+            0x8 | 0x2 | 0x40, False, kernel32.GetCurrentThreadId()
+        )
+
+        # CONTEXT must be 16-byte aligned.
+        buffer = ctypes.create_string_buffer(1232 + 16)
+        context = ctypes.addressof(buffer) + (-ctypes.addressof(buffer) % 16)
+        stopped = threading.Event()
+
+        def sample():
+            while not stopped.wait(self.interval):
+                if self.count.value >= self.MAX_SAMPLES:
+                    continue
+                ctypes.c_uint32.from_address(context + 0x30).value = 0x100001
+                if kernel32.SuspendThread(thread) == 0xFFFFFFFF:
+                    continue
+                try:
+                    if not kernel32.GetThreadContext(thread, context):
+                        continue
+                    pc = ctypes.c_uint64.from_address(context + self.WINDOWS_PC).value
+                    stack = ctypes.c_uint64.from_address(
+                        context + self.WINDOWS_SP
+                    ).value
+                    words = []
+                    top = self.bounds[2]
+                    if stack < top <= stack + self.STACK_LIMIT:
+                        words = (ctypes.c_uint64 * ((top - stack) // 8)).from_address(
+                            stack
+                        )
+                        words = [
+                            _ for _ in words if self.bounds[0] <= _ < self.bounds[1]
+                        ]
+                finally:
+                    kernel32.ResumeThread(thread)
+                sample = self.count.value * self.DEPTH
+                for index, _ in enumerate([pc] + words[: self.DEPTH - 1]):
+                    self.samples[sample + index] = _
+                self.count.value += 1
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            self.mark()
+            return func()
+        finally:
+            stopped.set()
+            sampler.join()
+            kernel32.CloseHandle(thread)
+
+    def stacks(self):
+        """
+        Return the stack of Aki function names for each sample,
+        innermost first. Samples taken outside Aki code are skipped.
+        """
+        starts = {_[0] for _ in self.compiler.functions}
+        stacks = []
+        for index in range(min(self.count.value, self.MAX_SAMPLES)):
+            sample = self.samples[index * self.DEPTH : (index + 1) * self.DEPTH]
+            names = [self.compiler.find_function(sample[0])]
+            if names[0] is None:
+                names = []
+            for address in sample[1:]:
+                if not address:
+                    break
+                # A function's own start address is a function pointer,
+                # not a return address.
+                if address in starts:
+                    continue
+                name = self.compiler.find_function(address)
+                if name is not None:
+                    names.append(name)
+            if names:
+                stacks.append(names)
+        return stacks
+
+    def report(self):
+        """
+        Return a flat profile and a call graph of the last run,
+        as a list of lines.
+        """
+        stacks = self.stacks()
+        if not stacks:
+            return ["No samples recorded in Aki code"]
+
+        total = len(stacks)
+        self_counts: dict = {}
+        total_counts: dict = {}
+        callers: dict = {}
+        callees: dict = {}
+
+        for names in stacks:
+            self_counts[names[0]] = self_counts.get(names[0], 0) + 1
+            for name in set(names):
+                total_counts[name] = total_counts.get(name, 0) + 1
+            for callee, caller in set(zip(names, names[1:])):
+                edges = callers.setdefault(callee, {})
+                edges[caller] = edges.get(caller, 0) + 1
+                edges = callees.setdefault(caller, {})
+                edges[callee] = edges.get(callee, 0) + 1
+
+        def percent(count):
+            return f"{count*100/total:6.1f}%"
+
+        def by_count(counts):
+            return sorted(counts.items(), key=lambda _: (-_[1], _[0]))
+
+        lines = [f"Flat profile ({total} samples):", "   Self   Total  Function"]
+        for name, count in by_count(self_counts):
+            lines.append(f"{percent(count)} {percent(total_counts[name])}  {name}")
+        for name, count in by_count(total_counts):
+            if name not in self_counts:
+                lines.append(f"{percent(0)} {percent(count)}  {name}")
+
+        lines.extend(["", "Call graph:"])
+        for name, count in by_count(total_counts):
+            lines.append(
+                f"{name} ({percent(count).strip()} total, {percent(self_counts.get(name, 0)).strip()} self)"
+            )
+            for caller, count in by_count(callers.get(name, {})):
+                lines.append(f"    called from {caller} ({percent(count).strip()})")
+            for callee, count in by_count(callees.get(name, {})):
+                lines.append(f"    calls       {callee} ({percent(count).strip()})")
+
+        return lines
@@ -1,5 +1,6 @@
 from llvmlite import ir, binding
 import pickle
+import json
 
 pickle.DEFAULT_PROTOCOL = pickle.HIGHEST_PROTOCOL
 import sys
@@ -54,7 +55,8 @@ import os
 
 from core import grammar as AkiParser
 from core.codegen import AkiCodeGen
-from core.compiler import AkiCompiler, ir
+from core.compiler import AkiCompiler, AkiTierThread, ir
+from core.profiler import AkiProfiler
 from core.astree import (
     Function,
     Call,
@@ -65,8 +67,21 @@ from core.astree import (
     VarTypeName,
     External,
 )
-from core.error import AkiBaseErr, ReloadException, QuitException, LocalException
-from core.akitypes import AkiTypeMgr, AkiObject
+from core.error import (
+    AkiBaseErr,
+    AkiTypeErr,
+    ReloadException,
+    QuitException,
+    LocalException,
+)
+from core.akitypes import (
+    AkiTypeMgr,
+    AkiObject,
+    AkiVector,
+    AkiStruct,
+    AkiSlice,
+    AkiString,
+)
 from core import constants
 
 
@@ -86,6 +101,9 @@ preceded by a dot sign:
                   : Dump current module to file in LLVM assembler format.
                   : Uses output.ll in current directory as default filename.
     {CMD}.help|.?|.{REP}    : Show this message.
+    {CMD}.profile|pf <expr>{REP}
+                  : Run <expr> (main() by default) and report
+                    which functions it spends its time in.
     {CMD}.rerun|..{REP}     : Reload the Python code and restart the REPL. 
     {CMD}.rl[c|r]{REP}      : Reset the interpreting engine and reload the last .aki
                     file loaded in the REPL. Add c to run .cp afterwards.
@@ -129,10 +147,13 @@ pyaki  :{constants.VERSION}"""
             typemgr = self.typemgr
         mod = ir.Module(name)
         mod.triple = binding.Target.from_default_triple().triple
-        other_modules = []
+        mod.codegen = AkiCodeGen(mod, typemgr, name)
+        mod.codegen.compiled_globals = self.compiler.globals
+        mod.codegen.fastmath = self.settings["fastmath"]
+        mod.codegen.threads = self.settings["threads"]
+        mod.codegen.debug = self.settings["debug_info"]
         if name != "stdlib":
-            other_modules.append(self.stdlib_module)
-        mod.codegen = AkiCodeGen(mod, typemgr, name, other_modules)
+            mod.codegen.add_module(self.stdlib_module)
         return mod
 
     def compile_stdlib(self):
@@ -190,6 +211,8 @@ pyaki  :{constants.VERSION}"""
             except AkiBaseErr as e:
                 print(e)
             except EOFError:
+                self.dump_profile()
+                self.stop_tiers()
                 break
 
     def cmd(self, text):
@@ -237,6 +260,12 @@ pyaki  :{constants.VERSION}"""
         if file_path is None:
             file_path = self.paths["source_dir"]
 
+        # Save the profile from the last file, if any,
+        # before we discard it
+
+        self.dump_profile()
+        self.stop_tiers()
+
         # reset
         self.main_module = self.make_module(None)
 
@@ -244,6 +273,16 @@ pyaki  :{constants.VERSION}"""
         self.last_file_loaded = file_to_load
         cache_path = f"{file_path}/__akic__/"
 
+        # Set up profile-guided optimization
+
+        self.profile_path = cache_path + f"{file_to_load}.akip"
+        self.main_module.codegen.profile = self.settings["pgo_instrument"]
+        if self.settings["pgo_use"]:
+            self.main_module.codegen.profile_data = self.load_profile(filepath)
+
+        self.main_module.codegen.tiered = self.settings["tiered"]
+        self.main_module.codegen.source_file = filepath
+
         # Attempt to load precomputed module from cache
 
         if self.settings["ignore_cache"] is True:
@@ -302,6 +341,7 @@ pyaki  :{constants.VERSION}"""
                     cp(f"Compile: {t3.time:.3f} sec")
                     cp(f"  Total: {t1.time+t2.time+t3.time:.3f} sec")
 
+                    self.start_tiers()
                     return
                 except LocalException:
                     pass
@@ -370,6 +410,8 @@ pyaki  :{constants.VERSION}"""
         cp(f"Compile: {t3.time:.3f} sec")
         cp(f"  Total: {t1.time+t2.time+t3.time:.3f} sec")
 
+        self.start_tiers()
+
         # write compiled bitcode and IR
         # We will eventually reuse bitcode when it's appropriate
 
@@ -379,6 +421,54 @@ pyaki  :{constants.VERSION}"""
             with open(cache_path + file_to_load + ".akib", "wb") as file:
                 file.write(self.compiler.mod_ref.as_bitcode())
 
+    def load_profile(self, source_path):
+        """
+        Load the counts saved from an instrumented run of a file.
+        The counts are ignored if the file has changed since then.
+        """
+        if not os.path.exists(self.profile_path) or os.path.getmtime(
+            source_path
+        ) > os.path.getmtime(self.profile_path):
+            return {}
+        with open(self.profile_path) as file:
+            return json.load(file)
+
+    def dump_profile(self):
+        """
+        Save the counts from the currently loaded file,
+        if it was instrumented.
+        """
+        counters = self.main_module.codegen.profile_counters
+        if not counters:
+            return
+        os.makedirs(os.path.dirname(self.profile_path), exist_ok=True)
+        with open(self.profile_path, "w") as file:
+            json.dump({k: v.value for k, v in counters.items()}, file, indent=0)
+
+    def start_tiers(self):
+        """
+        Start recompiling hot functions from the loaded file
+        in the background, if it was compiled for tiered compilation.
+        """
+        tiers = self.main_module.codegen.tiers
+        if not tiers:
+            return
+        self.tier_thread = AkiTierThread(
+            self.compiler,
+            str(self.main_module),
+            tiers,
+            self.settings["tier_threshold"],
+        )
+        self.tier_thread.start()
+
+    def stop_tiers(self):
+        """
+        Stop the background recompilation for the loaded file, if any.
+        """
+        if self.tier_thread is not None:
+            self.tier_thread.stop()
+            self.tier_thread = None
+
     def interactive(self, text, immediate_mode=False):
         # Immediate mode processes everything in the repl compiler.
         # Nothing is retained.
@@ -448,7 +538,18 @@ pyaki  :{constants.VERSION}"""
         if not immediate_mode:
             for k, v in self.main_module.codegen.module.globals.items():
                 if isinstance(v, ir.GlobalVariable):
+                    # String literals already compiled are declared
+                    # by the REPL module as it needs them
+                    if k.startswith(".str.") and k in self.compiler.globals:
+                        continue
                     self.repl_module.codegen.module.globals[k] = v
+                elif k.startswith("llvm."):
+                    # Intrinsics are declared by each module as needed
+                    continue
+                elif v.linkage == "internal":
+                    # Internal functions (such as parallel loop workers)
+                    # can't be called from other modules
+                    continue
                 else:
                     f_ = External(None, v.akinode, None)
                     self.repl_module.codegen.eval([f_])
@@ -463,6 +564,25 @@ pyaki  :{constants.VERSION}"""
 
         first_result_type = self.repl_module.globals[call_name].return_value.akitype
 
+        # Vectors have no C equivalent we can return by value,
+        # so they need to be reduced to a scalar first.
+
+        if isinstance(first_result_type, AkiVector):
+            del self.repl_module.globals[call_name]
+            raise AkiTypeErr(
+                _,
+                self.repl_module.codegen.text,
+                f'Vectors can\'t be displayed; use "{CMD}extract{REP}" or "{CMD}reduce_add{REP}" to get a value',
+            )
+
+        if isinstance(first_result_type, (AkiStruct, AkiSlice)):
+            del self.repl_module.globals[call_name]
+            raise AkiTypeErr(
+                _,
+                self.repl_module.codegen.text,
+                f"Structures and slices can't be displayed; use a field or an element instead",
+            )
+
         # If the result from the codegen is an object,
         # redo the codegen with an addition to the AST stack
         # that extracts the c_data value.
@@ -471,7 +591,13 @@ pyaki  :{constants.VERSION}"""
         # for things like arrays. It should be some other method
         # that extracts something appropriate. Maybe `repl_result`
 
-        if isinstance(first_result_type, AkiObject):
+        # Strings are displayed from the string object itself,
+        # since a wrapper would let go of a string built at runtime
+        # before it could be read.
+
+        if isinstance(first_result_type, AkiObject) and not isinstance(
+            first_result_type, AkiString
+        ):
             _ = ast_stack.pop()
             ast_stack = []
 
@@ -512,7 +638,10 @@ pyaki  :{constants.VERSION}"""
 
         # Generate a result
         cfunc = ctypes.CFUNCTYPE(return_type_ctype, *[])(func_ptr)
-        res = cfunc()
+        if self.profiling:
+            res = self.profiler.run(cfunc)
+        else:
+            res = cfunc()
 
         return res, return_type
 
@@ -525,12 +654,36 @@ pyaki  :{constants.VERSION}"""
 
     def quit(self, *a, **ka):
         print(XX)
+        self.dump_profile()
+        self.stop_tiers()
         raise QuitException
 
     def reload(self, *a, **ka):
         print(XX)
+        self.dump_profile()
+        self.stop_tiers()
         raise ReloadException
 
+    def profile(self, *a, params, **ka):
+        if not AkiProfiler.supported():
+            cp("Profiling is not supported on this platform")
+            return
+        if self.profiler is None:
+            self.profiler = AkiProfiler(self.compiler)
+        self.profiler.interval = self.settings["profile_interval"] / 1000
+
+        text = " ".join(params) if params else "main()"
+        self.profiling = True
+        try:
+            print(f"{REP}", end="")
+            for _ in self.interactive(text):
+                print(_)
+        finally:
+            self.profiling = False
+
+        for _ in self.profiler.report():
+            cp(_)
+
     def help(self, *a, **ka):
         cp(f"\n{USAGE}")
 
@@ -560,14 +713,26 @@ pyaki  :{constants.VERSION}"""
             self.typemgr = AkiTypeMgr()
         self.types = self.typemgr.types
 
-        self.compiler = AkiCompiler()
+        if getattr(self, "tier_thread", None) is not None:
+            self.stop_tiers()
+        self.tier_thread = None
+
+        self.compiler = AkiCompiler(
+            self.settings["opt_level"],
+            tiered=self.settings["tiered"],
+            perf_map=self.settings["perf_map"],
+        )
         self.load_stdlib()
         self.main_module = self.make_module(None)
         self.repl_module = self.make_module(".repl")
 
         self.anon_counter = 0
 
+        self.profiler = None
+        self.profiling = False
+
         self.last_file_loaded = None
+        self.profile_path = None
         if not "silent" in ka:
             cp(f"{RED}Workspace reset")
 
@@ -614,6 +779,8 @@ pyaki  :{constants.VERSION}"""
         "ex": not_implemented,
         "help": help,
         "?": help,
+        "profile": profile,
+        "pf": profile,
         "rerun": not_implemented,
         "rl": reload_file,
         "rlc": not_implemented,
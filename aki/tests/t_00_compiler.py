@@ -34,3 +34,156 @@ class TestLexer(unittest.TestCase):
         # Right now we're just trying to see if the Life file compiles
         self.r.load_file("l", ignore_cache=True)
 
+    def test_pgo(self):
+        import os, tempfile
+
+        # An instrumented run saves a profile,
+        # which the next load of the same file uses.
+
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "pgo.aki"), "w") as file:
+                file.write(
+                    "def f1(x){if x>3 1 else 0} def f2(){0} "
+                    "def f3(){var s=0 loop (var i=0, i<10) {s+=f1(i)} s} "
+                    "def f4(n){if n==0 0 else f4(n-1)}"
+                )
+            try:
+                self.r.settings["pgo_instrument"] = True
+                self.r.load_file("pgo", file_path=path, ignore_cache=True)
+                self.e("f3()", 6)
+                # A self tail call loops without entering the function again
+                self.e("f4(20)", 0)
+                counters = self.r.main_module.codegen.profile_counters
+                self.assertEqual(counters["f4:entry"].value, 1)
+            finally:
+                self.r.settings["pgo_instrument"] = False
+            self.r.load_file("pgo", file_path=path, ignore_cache=True)
+
+        module = self.r.main_module
+        self.assertIn("inlinehint", module.globals["f1"].attributes)
+        self.assertIn("cold", module.globals["f2"].attributes)
+        self.assertIn('!"branch_weights", i32 6, i32 4', str(module))
+        self.assertIn('!"function_entry_count", i64 10', str(module))
+        self.e("f3()", 6)
+
+    def test_tiered(self):
+        import os, tempfile
+
+        # Once a function is called often enough,
+        # an optimized copy takes over its calls.
+
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "tier.aki"), "w") as file:
+                file.write(
+                    "def f1(x){x*2+1} "
+                    "def f2(n){var s=0 loop (var i=0, i<n) {s=f1(s)%1000} s}"
+                )
+            try:
+                self.r.settings["tiered"] = True
+                self.r.settings["tier_threshold"] = 5
+                self.r.load_file("tier", file_path=path, ignore_cache=True)
+            finally:
+                self.r.settings["tiered"] = False
+                self.r.settings["tier_threshold"] = 1000
+
+        self.e("f2(10)", 23)
+        tiers = self.r.main_module.codegen.tiers
+        self.r.tier_thread.poll()
+        self.r.stop_tiers()
+        self.assertTrue(tiers["f1"][1].value)
+        self.assertIsNone(tiers["f2"][1].value)
+        self.e("f2(10)", 23)
+        self.assertEqual(tiers["f1"][0].value, 10)
+
+        # Calls from parallel loops are all counted.
+
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "tier.aki"), "w") as file:
+                file.write(
+                    "def f1(x){x%7} def f2(){var s=0 "
+                    "@parallel(s='+') loop (var i=0, i<100000) {s+=f1(i)} s}"
+                )
+            try:
+                self.r.settings["tiered"] = True
+                self.r.settings["tier_threshold"] = 1000000000
+                self.r.load_file("tier", file_path=path, ignore_cache=True)
+            finally:
+                self.r.settings["tiered"] = False
+                self.r.settings["tier_threshold"] = 1000
+
+        self.e("f2()", 299995)
+        self.r.stop_tiers()
+        self.assertEqual(self.r.main_module.codegen.tiers["f1"][0].value, 100000)
+        self.assertIn("atomicrmw add", str(self.r.main_module.globals["f1"]))
+
+    def test_debug_info(self):
+        import os, tempfile
+        from core.compiler import AkiCompiler
+
+        # Functions and their instructions are mapped to source lines.
+
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "debug.aki"), "w") as file:
+                file.write("def f1(x){\n    x+1\n}\ndef f2(){\n    len(str(12))\n}")
+            try:
+                self.r.settings["debug_info"] = True
+                self.r.load_file("debug", file_path=path, ignore_cache=True)
+            finally:
+                self.r.settings["debug_info"] = False
+
+        module = str(self.r.main_module)
+        self.assertIn('filename: "debug.aki"', module)
+        self.assertIn('line: 1, name: "f1"', module)
+        self.assertIn("!DILocation(column: 5, line: 2", module)
+        self.e("f1(1)", 2)
+
+        # Calls the function makes to release its objects have locations too,
+        # or LLVM drops the module's debug info.
+
+        import llvmlite.binding as llvm
+
+        self.assertIn("DICompileUnit", str(llvm.parse_assembly(module)))
+        self.e("f2()", 2)
+
+        # Compiled functions are listed in the perf map.
+
+        compiler = AkiCompiler(perf_map=True)
+        try:
+            compiler.compile_ir('define i32 @"perf_test"() {\n  ret i32 0\n}')
+            with open(compiler.perf_map) as file:
+                entry = file.read().splitlines()[-1].split(" ")
+        finally:
+            os.remove(compiler.perf_map)
+        self.assertEqual(entry[0], f"{compiler.get_addr('perf_test'):x}")
+        self.assertEqual(entry[2], "perf_test")
+
+    def test_profile(self):
+        import os, tempfile
+        from core.profiler import AkiProfiler
+
+        if not AkiProfiler.supported():
+            self.skipTest("Profiling is not supported on this platform")
+
+        # Samples are traced back to the functions that were running,
+        # and the functions that called them.
+
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "prof.aki"), "w") as file:
+                file.write(
+                    "def f1(x){(x*7+3)%1000} "
+                    "def f2(x){var s=x loop (var i=0, i<20) {s=(s*3+i)%1013} s} "
+                    "def main(){var t=0 loop (var j=0,j<1000000) {t=f1(t)+f2(t)} t}"
+                )
+            self.r.load_file("prof", file_path=path, ignore_cache=True)
+
+        self.r.profiler = AkiProfiler(self.r.compiler)
+        self.r.profiling = True
+        try:
+            self.e("main()", 1132)
+        finally:
+            self.r.profiling = False
+
+        self.assertIn(["f2", "main"], self.r.profiler.stacks())
+        report = self.r.profiler.report()
+        self.assertTrue(report[2].endswith(" f2"))
+        self.assertIn("    called from main", "\n".join(report))
@@ -1,7 +1,8 @@
 # Test all code generation functions.
 
 import unittest
-from core.error import AkiTypeErr, AkiSyntaxErr, AkiBaseErr, AkiOpError
+from llvmlite import ir
+from core.error import AkiTypeErr, AkiSyntaxErr, AkiBaseErr, AkiOpError, AkiNameErr
 
 
 class TestLexer(unittest.TestCase):
@@ -141,9 +142,78 @@ class TestLexer(unittest.TestCase):
     def test_with(self):
         self.e(r"def m1(z){with var q:i32 loop (q=0, q<20, q+1) {z+=1} z} m1(0)", 20)
 
+    def test_scoped_slot_reuse(self):
+        self.e(r"def m1(){var r=0 with var a=1 {r+=a} with var b=2 {r+=b} r} m1()", 3)
+        # Sibling `with` blocks share a single stack slot
+        allocas = [
+            _
+            for _ in self.r.repl_module.globals["m1"].blocks[0].instructions
+            if _.opname == "alloca"
+        ]
+        self.assertEqual(len(allocas), 3)
+        # Loop body variables are scoped to each iteration,
+        # so sibling loops can reuse the same name
+        self.e(
+            r"def m2(){var r=0 loop (var i=0, i<3) {var t=i r+=t} loop (var j=0, j<3) {var t=j r+=t} r} m2()",
+            6,
+        )
+
+    def test_heap_release(self):
+        def released(name):
+            return [
+                _
+                for block in self.r.repl_module.globals[name].blocks
+                for _ in block.instructions
+                if _.opname == "call" and _.callee.name.startswith(".release.")
+            ]
+
+        # Each iteration releases the list declared in it
+        self.e(
+            r"def m1(){var s=0 loop (var i=0, i<100) {var l:list i32 push(l,i) s+=l[0]} s} m1()",
+            4950,
+        )
+        self.assertTrue(released("m1"))
+        # A returned list is handed over to the caller
+        self.e(
+            r"def m1(n:i32):list i32 {var l:list i32 push(l,n) l} def m2(){var l=m1(7) var k=l var j=m1(2) l[0]+k[0]+j[0]} m2()",
+            16,
+        )
+        self.e(
+            r"def m1(l:list i32):list i32 {l} def m2(){var l:list i32 push(l,4) var k=m1(l) k[0]} m2()",
+            4,
+        )
+        # Containers own their elements; `pop` hands the element over
+        self.e(
+            r"def m1(){var ll:list list i32 loop (var i=0, i<3) {var l:list i32 push(l,i) push(ll,l)} var x=pop(ll) var y=pop(ll) x[0]+y[0]} m1()",
+            3,
+        )
+        self.e(
+            r"def m1(){var m:map i32 list i32 loop (var i=0, i<50) {var l:list i32 push(l,i) m[i]=l} delete(m,3) var x=m[10] x[0]+unsafe cast(len(values(m)),i32)} m1()",
+            59,
+        )
+        self.e(
+            r"def m1(){with var l:list i32 {push(l,2) l}} def m2(){len(m1())} m2()", 1
+        )
+        # An argument assigned another object keeps it alive
+        self.e(
+            r"def m1(l:list i32):i32 {with var k:list i32 {push(k,41) l=k 0} var j:list i32 push(j,7) push(l,1) l[0]+j[0]} def m2(){var l:list i32 push(l,5) m1(l)} m2()",
+            48,
+        )
+
     def test_break(self):
         self.e(r"def m1(z){var q=0 loop () {q+=1 when q==20 break} q} m1(0)", 20)
 
+    def test_external_name_resolution(self):
+        self.e(r"def m1(){sleep(0) sleep(0) sleep(0)} m1()", 0)
+        codegen = self.r.repl_module.codegen
+        link = codegen.module.globals["sleep"]
+        # One declaration per module, using the callee's calling convention
+        self.assertIs(codegen.resolved_names["sleep"], link)
+        self.assertEqual(link.calling_convention, "fastcc")
+        # Failed lookups are cached too
+        self.ex(AkiNameErr, r"undefined_name()")
+        self.assertIsNone(self.r.repl_module.codegen.resolved_names["undefined_name"])
+
     def test_default_function_arguments(self):
         self.e(r"def m1(z=1){z} m1()", 1)
         self.e(r"def m2(y,z=1){y+z} m2(2)", 3)
@@ -197,9 +267,49 @@ class TestLexer(unittest.TestCase):
         self.e(r'{var x:str x="hi" x}', '"hi"')
         self.e(r"var x:str x", '""')
         self.e(r"if 1 'hi' else 'bye'", '"hi"')
+        # The string's data is stored in the same global as its header
+        self.e(r'"hello"', '"hello"')
+        self.assertFalse(
+            [_ for _ in self.r.repl_module.globals if _.startswith(".str.data")]
+        )
+
+    def test_string_ops(self):
+        self.e(r'"abc"+"def"', '"abcdef"')
+        self.e(r'def m1(x:i32){str(x)+"!"} m1(-42)', '"-42!"')
+        self.e(r"str(18446744073709551615:u64)", '"18446744073709551615"')
+        self.e(r"str(2.5)", '"2.5"')
+        self.e(r'str("hi")', '"hi"')
+        self.e(r'"ab"+"c"=="abc"', True)
+        self.e(r'"abc"!="abd"', True)
+        self.e(r'"ab"<"abc"', True)
+        self.e(r'"b">="abc"', True)
+        self.e(r'find("hello world", "wor")', 6)
+        self.e(r'find("hello", "")', 0)
+        self.e(r'find("hello", "z")', -1)
+        self.e(r'len("hi"+str(10))', 4)
+        self.e(r'def m1(){var s="" loop (var i=0, i<5) {s=s+str(i)} s} m1()', '"01234"')
+        self.e(r'def m1(){var m:map str i32 m["a"+"b"]=2 m["ab"]} m1()', 2)
+        self.ex(AkiTypeErr, r"{var x=1 str(ref(x))}")
+        self.ex(AkiTypeErr, r'find("a", 1)')
+        self.ex(AkiOpError, r'"a"-"b"')
 
     # Trap expressions that return no value, like `var`
 
+    def test_string_literal_pool(self):
+        def literals():
+            return [
+                _
+                for _ in self.r.repl_module.globals.values()
+                if isinstance(_, ir.GlobalVariable) and _.name.startswith(".str.")
+            ]
+
+        self.e(r'def m1(){var a="pooled" a+"pooled"} m1()', '"pooledpooled"')
+        self.assertEqual(len(literals()), 1)
+        self.assertIsNotNone(literals()[0].initializer)
+        # The literal was compiled with the last input, so it's only declared
+        self.e(r'"pooled"', '"pooled"')
+        self.assertIsNone(literals()[0].initializer)
+
     def test_nonyielding_expression_trap(self):
         self.ex(AkiSyntaxErr, r"if {var x:i32=1} 2 else 3")
         self.ex(AkiSyntaxErr, r"{var x:i32=1}==1")
@@ -319,6 +429,381 @@ class TestLexer(unittest.TestCase):
         self.e(r"@inline def m1(){32} m1()", 32)
         self.ex(AkiSyntaxErr, r"@bogus def m1(){32} m1()")
 
+    def test_fastmath(self):
+        self.e(r"@fastmath def m1(x:f64, y:f64){x*y+x} m1(2.0, 3.0)", 8.0)
+        ops = [
+            _
+            for b in self.r.repl_module.globals["m1"].blocks
+            for _ in b.instructions
+            if _.opname in ("fmul", "fadd")
+        ]
+        for _ in ops:
+            self.assertEqual(set(_.flags), {"nnan", "ninf", "reassoc", "contract"})
+        # Without the decorator, float ops have no fast-math flags
+        self.e(r"def m2(x:f64, y:f64){x*y+x} m2(2.0, 3.0)", 8.0)
+        ops = [
+            _
+            for b in self.r.repl_module.globals["m2"].blocks
+            for _ in b.instructions
+            if _.opname in ("fmul", "fadd")
+        ]
+        for _ in ops:
+            self.assertFalse(_.flags)
+
+    def test_optimization_hints(self):
+        self.e(r"def m1(x){@likely if x>0 1 else 2} m1(3)", 1)
+        self.e(r"def m1(x){@unlikely if x>0 1 else 2} m1(-3)", 2)
+        branch = [
+            _
+            for b in self.r.repl_module.globals["m1"].blocks
+            for _ in b.instructions
+            if _.opname == "br" and "prof" in _.metadata
+        ]
+        self.assertEqual(
+            [_.constant for _ in branch[0].metadata["prof"].operands[1:]], [1, 2000]
+        )
+        self.e(
+            r"def m1(){var t=0 @unroll(4) loop (var i=0, i<100) {t+=i} @nounroll while t>0 {t-=7} t} m1()",
+            -6,
+        )
+        loops = [
+            _.metadata["llvm.loop"]
+            for b in self.r.repl_module.globals["m1"].blocks
+            for _ in b.instructions
+            if "llvm.loop" in _.metadata
+        ]
+        self.assertEqual(len(loops), 2)
+        self.assertIs(loops[0].operands[0], loops[0])
+        self.e(
+            r"def m1(n){var t=0 unsafe @assume(n>0, n%4==0) loop (var i=0, i<n) {t+=i} t} m1(8)",
+            28,
+        )
+        self.ex(AkiSyntaxErr, r"def m1(n){@assume(n>0) n} m1(8)")
+        self.ex(AkiSyntaxErr, r"def m1(x){@likely x>0} m1(1)")
+        self.ex(AkiSyntaxErr, r"def m1(){@unroll(0) loop (var i=0, i<4) {i}} m1()")
+
+    def test_function_effects(self):
+        def attributes(name):
+            return self.r.repl_module.globals[name].attributes
+
+        self.e(r"def m1(x){x*2} def m2(x){m1(x)+1} m2(2)", 5)
+        self.assertTrue({"readnone", "nounwind"} <= attributes("m1"))
+        self.assertTrue({"readnone", "nounwind"} <= attributes("m2"))
+        # Reading a uni makes a function readonly, writing one makes it impure
+        self.e(r"uni {g=1} def m1(){g} def m2(){g=2 g} m1()+m2()", 3)
+        self.assertIn("readonly", attributes("m1"))
+        self.assertFalse({"readnone", "readonly"} & attributes("m2"))
+        # Calls to externs (here, `sleep`) are assumed to have side effects
+        self.e(r"def m1(){sleep(0) 1} m1()", 1)
+        self.assertFalse({"readnone", "readonly"} & attributes("m1"))
+        # Decorators override inference
+        self.e(r"@const def m1(){sleep(0) 1} m1()", 1)
+        self.assertIn("readnone", attributes("m1"))
+        self.e(r"@pure def m1(x){x*2} m1(2)", 4)
+        self.assertIn("readonly", attributes("m1"))
+        # Writing through an argument, or using a list, is impure
+        self.e(
+            r"def m1(s:slice i32){s[0]=5 0} def m2(){var a:array i32[3] m1(slice(a,1,3)) a[1]} m2()",
+            5,
+        )
+        self.assertFalse({"readnone", "readonly"} & attributes("m1"))
+        self.e(
+            r"struct P {x:i32} def m1(p:ptr P){var q=p q.x=7 0} def m2(){var a:P m1(ref(a)) a.x} m2()",
+            7,
+        )
+        self.assertFalse({"readnone", "readonly"} & attributes("m1"))
+        self.e(
+            r"def m1(s:slice i32){var t=s t[0]=9 0} def m2(){var a:array i32[3] m1(slice(a,0,3)) a[0]} m2()",
+            9,
+        )
+        self.assertFalse({"readnone", "readonly"} & attributes("m1"))
+        self.e(r"def m1(){var l:list i32 push(l,1) 1} m1()", 1)
+        self.assertFalse({"readnone", "readonly"} & attributes("m1"))
+        # Reading through an argument is readonly, reading a local array isn't
+        self.e(
+            r"struct P {x:i32, y:i32} def m1(p:ptr P):i32 {p.x} def m2():i32 {var a:P a.x=6 m1(ref(a))} m2()",
+            6,
+        )
+        self.assertIn("readonly", attributes("m1"))
+        self.e(r"def m1(s:slice i32):i32 {s[0]} 0", 0)
+        self.assertIn("readonly", attributes("m1"))
+        self.e(r"def m1(x:i32):i32 {var a:array i32[4] a[1]=x a[1]} m1(3)", 3)
+        self.assertIn("readnone", attributes("m1"))
+        # Looking up a key in a map argument can insert it
+        self.e(r"def m1(m:map i32 i32){m[1]} def m2(){var m:map i32 i32 m1(m)} m2()", 0)
+        self.assertFalse({"readnone", "readonly"} & attributes("m1"))
+
+    def test_vector(self):
+        self.e(
+            r"def m1(){var v:vec f32[4] v=insert(v,0,1.0:f32) v=insert(v,3,4.0:f32) reduce_add(v*v+v)} m1()",
+            22.0,
+        )
+        self.e(r"def m1(){var v:vec i32[4] v=insert(v,1,5) extract(-v,1)} m1()", -5)
+        self.e(
+            r"def m1(){var v:vec i32[4] v=insert(v,1,5) var s=shuffle(v,v,1,5,1,5,1,5,1,5) reduce_add(s)} m1()",
+            40,
+        )
+        self.e(
+            r"uni {a:array vec f64[4][8]} def m1(){loop (var i=0, i<8) {a[i]=a[i]+a[i]} reduce_mul(a[0])} m1()",
+            0.0,
+        )
+        self.ex(AkiSyntaxErr, r"def m1(){var v:vec f32[3] 0} m1()")
+        self.ex(AkiTypeErr, r"def m1(){var v:vec i32[4] extract(v,4)} m1()")
+        self.ex(AkiTypeErr, r"def m1(){var v:vec i32[4] insert(v,0,1.0)} m1()")
+        self.ex(AkiTypeErr, r"def m1(){var v:vec i32[4] v} m1()")
+
+    def test_struct(self):
+        self.e(r"struct p {x:i32, y:f64} var a:p a.x=3 a.y=2.5 a.x+=1 a.x", 4)
+        self.e(
+            r"struct p {x:i32, y:i32} struct s {a:p, b:p} def m1(q:ptr s){q.b.y=7} var t:s m1(ref(t)) t.b.y",
+            7,
+        )
+        self.e(r"struct p {x:i32, y:i32} var a:array p[4] a[2].y=5 a[2].y", 5)
+        self.e(r"struct p {x:i32} def m1():p {var a:p a.x=4 a} m1().x", 4)
+        self.e(r"struct p {x:i32} def m1(){var s:p s.x=4 var c=s.x c} m1()", 4)
+        self.e(
+            r"struct p {a:i32} struct s {p:p} def m1(){var t:s t.p.a=3 var c=t.p c.a} m1()",
+            3,
+        )
+        self.e(r"struct p {c:u8, y:f64, d:u8} sizeof(p)", 24)
+        self.e(r"@reorder struct p {c:u8, y:f64, d:u8} sizeof(p)", 16)
+        self.e(r"@reorder struct p {c:u8, y:f64, d:u8} offsetof(p, c)", 8)
+        self.e(r"@packed struct p {c:u8, y:f64, d:u8} offsetof(p, d)", 9)
+        self.e(r"@align(64) struct p {c:u8, y:f64} sizeof(p)", 64)
+        self.ex(AkiSyntaxErr, r"@align(3) struct p {x:i32} 0")
+        self.ex(AkiSyntaxErr, r"@packed def m1(){0}")
+        self.ex(AkiSyntaxErr, r"struct p {x:i32, x:i32} 0")
+        self.ex(AkiNameErr, r"struct p {x:i32} var a:p a.y")
+        self.ex(AkiTypeErr, r"struct p {x:i32} var a:p a")
+        self.ex(AkiTypeErr, r"var a=1 a.x")
+        self.ex(AkiTypeErr, r"var a=2 (a*3).x")
+        self.ex(AkiTypeErr, r"var a=2 var b=(a*3)[0]")
+        self.e(r"def f():array i32[3] {var a:array i32[3] a[1]=7 a} f()[1]", 7)
+        # Array fields are indexed in place
+        self.e(
+            r"struct p {x:i32, b:array u8[10]} def m1(){var s:p s.b[3]=1:u8 s.b[3]} m1()",
+            1,
+        )
+        self.e(
+            r"struct p {b:array bool[70]} def m1(){var s:p s.b[65]=True s.b[65]} m1()",
+            True,
+        )
+        self.e(
+            r"struct p {b:array i32[4]} def m1(q:ptr p){q.b[1]=6} def m2(){var s:p m1(ref(s)) s.b[1]} m2()",
+            6,
+        )
+
+    def test_slice(self):
+        self.e(
+            r"var a:array i32[10] loop (var i=0, i<10) {a[i]=i} var s=slice(a,2,8) s[1]",
+            3,
+        )
+        self.e(r"var a:array i32[10] var s=slice(a,2,8) len(s)", 6)
+        # Slices of slices compose their strides
+        self.e(
+            r"var a:array i32[10] loop (var i=0, i<10) {a[i]=i} var s=slice(slice(a,1,100,2),1,4,2) s[1]",
+            7,
+        )
+        self.e(r"var a:array i32[10] var s=slice(slice(a,1,100,2),1,4,2) len(s)", 2)
+        self.e(r"var a:array i32[10] var s=slice(a,2,8) s[0]=42 a[2]", 42)
+        self.e(
+            r"uni {b:array f64[1000]} def m1(s:slice f64):f64 {var t=0.0 loop (var i:u_size=0:u_size, i<len(s)) {s[i]=2.0 t+=s[i]} t} m1(slice(b,100,200))",
+            200.0,
+        )
+        self.e(r"var s=slice('hello world',6,11) unsafe cast(s[0],i32)", 119)
+        self.e(r"sizeof(slice i32)", 24)
+        # A zero or negative step that is only known at runtime counts as one
+        self.e(r"var a:array i32[10] var z=0 var s=slice(a,0,4,z) len(s)", 4)
+        self.e(r"var a:array i32[10] var z=0-2 var s=slice(a,0,4,z) len(s)", 4)
+        self.ex(AkiTypeErr, r"var s=slice(1,0,1) 0")
+        self.ex(AkiSyntaxErr, r"var a:array i32[10] var s=slice(a,0,1,0) 0")
+        self.ex(AkiSyntaxErr, r"var a:array i32[10] var s=slice(a,8,1,-2) 0")
+        self.ex(AkiTypeErr, r"var a:array i32[2,3] var s=slice(a,0,1) 0")
+        self.ex(AkiTypeErr, r"var a:array i32[10] slice(a,0,1)")
+
+    def test_heap_array(self):
+        self.e(r"var n=10 var a:array i32[n] loop (var i=0, i<n) {a[i]=i*2} a[7]", 14)
+        self.e(
+            r"var n=3, m=4, k=5 var a:array i32[n,m,k] loop (var i=0, i<3) {loop (var j=0, j<4) {loop (var l=0, l<5) {a[i,j,l]=i*100+j*10+l}}} a[2,3,4]+a[1,2,3]",
+            357,
+        )
+        self.e(r"var n=3, m=4 var a:array i32[n,m] len(a)+len(a,1)", 7)
+        self.e(
+            r"def s(a:array f64[*]):f64 {var t=0.0 loop (var i:u_size=0:u_size, i<len(a)) {t+=a[i]} t} def m(n:i32):f64 {var a:array f64[n] loop (var i=0, i<n) {a[i]=1.5} s(a)} m(100)",
+            150.0,
+        )
+        self.e(
+            r"def mk(n:i32):array i32[*] {var a:array i32[n] a[n-1]=99 a} var b=mk(5) b[4]",
+            99,
+        )
+        self.e(r"var n=10 var a:array i32[n] a[3]=7 var s=slice(a,2,8) s[1]", 7)
+        self.e(r"var n=10 var a:array i32[n] type(a)", "<type:array(:i32)[*]>")
+        self.ex(AkiSyntaxErr, r"var n=10 var a:array i32[n] a[1,2]")
+        self.ex(AkiSyntaxErr, r"var n=10 var a:array i32[n,*] 0")
+        self.ex(AkiSyntaxErr, r"var n=10 var a:array i32[n] a[*]")
+        self.ex(AkiSyntaxErr, r"var n=2 var a:array i32[n] len(a,1)")
+        self.ex(AkiSyntaxErr, r"var a:array i32[0] 0")
+
+    def test_bit_array(self):
+        self.e(r"var a:array bool[100] a[70]=True a[70]", True)
+        self.e(r"var a:array bool[100] a[70]=True a[71]", False)
+        # Each row of the last dimension starts on a new 64-bit word
+        self.e(r"sizeof(array bool[3,100])", 48)
+        self.e(
+            r"def m1(){var a:array bool[3,200] loop (var i=0, i<200) {a[1,i]=i%3==0 a[2,i]=True} a[2,7]=False popcount(a[1])*1000:u_size+popcount(a)} m1()",
+            67266,
+        )
+        self.e(
+            r"def m1(){var a:array bool[2,100] var b:array bool[2,100] a[0,5]=True a[0,70]=True b[0,70]=True b[1,3]=True bits_and(a[0],b[0])*100:u_size+bits_or(a,b)*10:u_size+bits_xor(a,b)} m1()",
+            120,
+        )
+        self.e(
+            r"def m1(){var a:array bool[8,64] @parallel loop (var i=0, i<64) {a[3,i]=True} popcount(a)} m1()",
+            64,
+        )
+        self.ex(
+            AkiTypeErr, r"var a:array bool[2,100] var b:array bool[100] bits_or(a,b)"
+        )
+        self.ex(AkiTypeErr, r"var a:array u8[100] popcount(a)")
+        self.ex(AkiTypeErr, r"var a:array bool[100] ref(a[1])")
+        self.ex(AkiTypeErr, r"var a:array bool[100] slice(a,0,10)")
+        # Appending unpacks the bits into the list
+        self.e(
+            r"def m1(){var a:array bool[70] a[1]=True a[65]=True var l:list bool push(l,True) append(l,a) var n=0 loop (var i=0, i<71) {if l[i] n+=i} n*100+unsafe cast(len(l),i32)} m1()",
+            6871,
+        )
+        self.ex(AkiTypeErr, r"var a:array bool[2,3] var l:list bool append(l,a)")
+
+    def test_list(self):
+        self.e(
+            r"var l:list i32 loop (var i=0, i<100) {push(l, i)} l[57]+unsafe cast(len(l),i32)",
+            157,
+        )
+        self.e(r"var l:list f64 push(l,1.5) push(l,2.5) pop(l)+pop(l)+pop(l)", 4.0)
+        # Arrays, the list itself, and strided slices can be appended
+        self.e(
+            r"var l:list i32 var a:array i32[10] loop (var i=0, i<10) {a[i]=i} append(l,a) append(l,l) append(l,slice(a,0,10,3)) l[19]+l[21]+unsafe cast(len(l),i32)",
+            36,
+        )
+        self.e(
+            r"def f(l:list i32):u_size {push(l,5)} def g():i32 {var l:list i32 f(l) f(l) l[1]+unsafe cast(len(l),i32)} g()",
+            7,
+        )
+        self.e(r"var l:list i32 type(l)", "<type:list i32>")
+        self.ex(AkiTypeErr, r"var l:list i32 push(l, 1.0)")
+        self.ex(AkiTypeErr, r"var l:list i32 push(1, 1)")
+        self.ex(AkiTypeErr, r"var l:list i32 var a:array f64[3] append(l,a)")
+        self.ex(AkiTypeErr, r"uni {l:list i32} 0")
+
+    def test_map(self):
+        self.e(
+            r"var m:map i64 i32 loop (var i=0, i<100) {m[unsafe cast(i,i64)]=i*2} delete(m,5:i64) unsafe cast(len(m),i32)*1000+m[7:i64]+get(m,5:i64)",
+            99014,
+        )
+        # Reading a missing key with `m[k]` inserts it; `get` doesn't
+        self.e(
+            r'var m:map str i32 m["a"]=1 m["bb"]=2 m["a"]+=10 m["c"] get(m,"d") var k=keys(m) var v=values(m) unsafe cast(len(k),i32)*100+v[0]+v[1]+v[2]+get(m,"a")*1000',
+            11313,
+        )
+        # Deleted slots are reclaimed when the table is rebuilt
+        self.e(
+            r"var m:map i32 i32 loop (var i=0, i<1000) {m[i]=i delete(m,i)} m[3]=4 unsafe cast(len(m),i32)*10+m[3]",
+            14,
+        )
+        self.e(
+            r'def f(m:map str i32, k:str) {m[k]+=1} def g():i32 {var m:map str i32 f(m,"x") f(m,"x") f(m,"y") m["x"]*10+unsafe cast(len(m),i32)} g()',
+            22,
+        )
+        self.e(
+            r"var m:map u8 bool m[3:u8]=True contains(m,3:u8) and not contains(m,4:u8)",
+            True,
+        )
+        self.e(r"var m:map i32 f64 type(m)", "<type:map i32 f64>")
+        # Keys built at runtime are kept by the map after they go out of scope
+        self.e(
+            r"def m1():i32 {var m:map str i32 loop (var i=0,i<50) {m[str(i)]=i} var t=0 loop (var i=0,i<50) {t+=get(m,str(i))} t} m1()",
+            1225,
+        )
+        self.e(
+            r"def m1():u64 {var m:map str i32 loop (var i=0,i<30) {m[str(i)]=i} loop (var i=0,i<20) {delete(m,str(i))} var k=keys(m) len(k)} m1()",
+            10,
+        )
+        self.ex(AkiTypeErr, r"var m:map f64 i32 0")
+        self.ex(AkiTypeErr, r"var m:map i32 i32 m[1.0]")
+        self.ex(AkiTypeErr, r"var l:list i32 get(l,1)")
+        self.ex(AkiTypeErr, r"uni {m:map i32 i32} 0")
+
+    def test_parallel(self):
+        self.e(
+            r"uni {a:array i32[1000]} def m1(){var s=0 @parallel(s='+') loop (var i=0, i<1000) {a[i]=i s+=a[i]} s} m1()",
+            499500,
+        )
+        self.e(
+            r"def m1(){var s=0 var k=3 @parallel(schedule='dynamic', chunk=7, s='+') loop (var i=0, i<1000, i+3) {s+=k} s} m1()",
+            1002,
+        )
+        self.e(
+            r"def m1(){var p=1.0 @parallel(threads=3, p='*') loop (var i=0, i<5) {p*=2.0} p} m1()",
+            32.0,
+        )
+        # The result of a parallel loop is its number of iterations
+        self.e(r"def m1(){@parallel loop (var i=0, i<10, i+4) {0}} m1()", 3)
+        # Trip counts don't wrap around for unsigned or narrow loop variables
+        self.e(
+            r"def m1(){var n=0 @parallel(n='+', threads=2) loop (var i=5:u32, i<2:u32) {n+=1} n} m1()",
+            0,
+        )
+        self.e(
+            r"def m1(){var n=0 @parallel(n='+', threads=3) loop (var i=0:i8-100:i8, i<100:i8) {n+=1} n} m1()",
+            200,
+        )
+        self.e(
+            r"def m1(){var n=0 @parallel(n='+', threads=3) loop (var i=0:u8, i<250:u8, i+7:u8) {n+=1} n} m1()",
+            36,
+        )
+        self.ex(AkiSyntaxErr, r"def m1(){@parallel loop (var i=0, i<5) {break}} m1()")
+        self.ex(AkiSyntaxErr, r"def m1(){@parallel loop (var i=0, i>5) {0}} m1()")
+        self.ex(AkiSyntaxErr, r"def m1(){@parallel 5} m1()")
+        self.ex(
+            AkiSyntaxErr, r"def m1(){var s=0 @parallel(s='-') loop (var i=0, i<5) {0}} m1()"
+        )
+
+    def test_type_layout(self):
+        import pickle
+        from llvmlite import ir
+
+        layout = self.mgr.layout(self.types["i64"].llvm_type)
+        self.assertEqual(layout.size, 8)
+        self.assertIs(self.mgr.layout(ir.IntType(64)), layout)
+
+        struct = ir.LiteralStructType([ir.IntType(8), ir.IntType(64)])
+        self.assertEqual(self.mgr.layout(struct).offsets, (0, 8))
+
+        # The layout table survives serialization.
+        mgr = pickle.loads(pickle.dumps(self.AkiTypeMgr()))
+        self.assertEqual(mgr.layout(struct), self.mgr.layout(struct))
+
+    def test_type_interning(self):
+        i32 = self.types["i32"]
+        ptr = self.mgr.as_ptr(i32)
+        self.assertIs(self.mgr.as_ptr(i32), ptr)
+        self.assertIs(self.mgr.as_ptr(self.types["int"]), ptr)
+        self.assertIs(self.mgr.custom_types[ptr.type_id], ptr)
+        self.e(r"def m1(x:ptr i32){0} def m2(y:ptr i32){0} type(m1)==type(m2)", True)
+        self.e(r"def m1():i64{0:i64} def m2(){0:i64} type(m1)==type(m2)", True)
+        self.e(r"def m1(){0:i64} def m2(){0} type(m1)", "<type:func():i64>")
+        self.e(r"var x:array i32[2,3] var y:array i32[2,3] type(x)==type(y)", True)
+        # Calls through a function pointer only know its signature,
+        # not the defaults of functions that share it
+        self.ex(
+            AkiSyntaxErr,
+            r"def b(y:i32):i32 {y*2} def a(x:i32=5):i32 {x} def m1(){var f:func(i32):i32 f=b f()} m1()",
+        )
+        self.e(
+            r"def b(y:i32):i32 {y*2} def a(x:i32=5):i32 {x} def m1(){var f:func(i32):i32 f=b f(4)} m1()",
+            8,
+        )
+
     def test_return(self):
         self.e(r"def m1(){return 32} m1()",32)
         self.e(r"def m1():u64{return 32:u64} m1()",32)
@@ -328,6 +813,56 @@ class TestLexer(unittest.TestCase):
         self.e(r"def m1(x){if x==1 return 32 else return 64} m1(0)",64)
         self.ex(AkiTypeErr, r"def m1():u64{return 32} m1()")
 
+    def test_generic_functions(self):
+        p = r"def add { with (x:f64, y:f64) {x*y} default (x, y) {x+y} } "
+        self.e(p + r"add(2.0,4.0)", 8.0)
+        self.e(p + r"add(2,4)", 6)
+        self.e(p + r"add(250:u8,10:u8)", 4)
+        self.e(p + r"def m1(){add(1,2)+add(3,4)} m1()", 10)
+        self.e(
+            r"def fact { default (n):u64 {if n<=1:u64 1:u64 else n*fact(n-1:u64)} } fact(20:u64)",
+            2432902008176640000,
+        )
+        self.e(r"def m1 { with (x:i32, y:i32=5) {x-y} } m1(8)", 3)
+        self.ex(AkiTypeErr, r"def m1 { with (x:i32) {x} } m1(1.0)")
+        self.ex(AkiTypeErr, r"def m1 { default (x, y:i32) {x} } m1(1.0, 1.0)")
+        self.ex(AkiSyntaxErr, r"def m1 { default (x) {x} default (x) {x+1} }")
+        self.ex(AkiSyntaxErr, r"def m1 { with (x:i32) {x} with (y:i32) {y} }")
+        self.ex(AkiNameErr, r"def m1 { default (x) {x} } var m1=1")
+
+    def test_tail_calls(self):
+        # Self-recursion in tail position runs as a loop,
+        # so this doesn't exhaust the stack
+        self.e(
+            r"def m1(n, acc):i32 {if n==0 acc else m1(n-1, acc+1)} m1(1000000, 0)",
+            1000000,
+        )
+        self.e(
+            r"def m2(n:i64, acc:i64):i64 {if n<=1:i64 return acc; m2(n-1:i64, acc*n)} m2(20:i64, 1:i64)",
+            2432902008176640000,
+        )
+        self.e(r"def m3(x){x+1} def m4(x){if x>0 m3(x) else 0} m4(4)", 5)
+        calls = [
+            _
+            for b in self.r.repl_module.globals["m4"].blocks
+            for _ in b.instructions
+            if _.opname == "call"
+        ]
+        self.assertTrue(calls[0].tail)
+        # Nothing is emitted into a block after its `ret` or `br`
+        self.e(r"def m3(x){x+1} def m4(x){m3(x)} m4(1)", 2)
+        self.e(r"def m4(n){if n==0 0 else m4(n-1)} m4(10)", 0)
+        self.e(r"def m4(x){if x==1 return 32; 64} m4(1)", 32)
+        for b in self.r.repl_module.globals["m4"].blocks:
+            self.assertFalse(
+                [_ for _ in b.instructions[:-1] if _.opname in ("br", "ret")]
+            )
+        # A slice of a local array points into our own frame
+        self.e(
+            r"def m5(s:slice i32):i32 {s[0]} def m6():i32 {var a:array i32[4] a[0]=5 m5(slice(a,0,4))} m6()",
+            5,
+        )
+
     def test_select(self):
         p0 = r"""
 def main(){